@@ -0,0 +1,170 @@
+"""
+Замеры производительности отрисовки поля.
+
+Сравнивает покадровую отрисовку поля клетками (BoardRenderer) и через массив NumPy
+(NumpyBoardRenderer) на полях разного размера. Змейка идет по Гамильтонову циклу,
+поэтому может двигаться сколько угодно без столкновений.
+
+Фикстуры медленных шагов (python main.py --slow-step-ms 20) воспроизводятся так:
+состояние поля и random восстанавливаются перед каждым повтором, замеряется один snake.move.
+
+Запуск:
+    python benchmarks.py [--frames N] [--sizes 40x30 200x200 1000x1000]
+    python benchmarks.py --fixtures slow_steps/*.json [--repeats N]
+    python benchmarks.py --fixtures states/endgame.snake --playout 5000 [--lookahead]
+"""
+import os
+import sys
+import time
+import argparse
+import random
+import statistics
+from typing import Tuple
+
+# Окно и звук для замеров не нужны
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+import pygame
+
+import main as game
+
+DEFAULT_SIZES = [(40, 30), (200, 200), (1000, 1000)]
+MAX_BOARD_PIXELS = (800, 600) # Поле вписывается в окно игры, но клетка не меньше пикселя
+SNAKE_FILL = 0.25 # Доля поля под змейкой в начале замера
+GROW_EVERY = 10 # Раз в столько шагов змейка растет на сегмент
+
+
+def parse_size(text: str) -> Tuple[int, int]:
+    width, height = text.lower().split("x")
+    return int(width), int(height)
+
+
+def cell_size_for(width: int, height: int) -> int:
+    return max(1, min(MAX_BOARD_PIXELS[0] // width, MAX_BOARD_PIXELS[1] // height))
+
+
+def make_snake() -> "game.Snake":
+    """Змейка, уложенная вдоль начала Гамильтонова цикла (голова впереди по циклу)."""
+    snake = game.Snake('manual')
+    cycle = snake.hamiltonian_path
+    length = max(2, int(len(cycle) * SNAKE_FILL))
+    snake.set_body(reversed(cycle[:length]))
+    return snake
+
+
+def bench_renderer(renderer_class, width: int, height: int, frames: int) -> Tuple[float, float]:
+    """Возвращает (первый кадр, среднее на кадр) в миллисекундах."""
+    game.set_grid_size(width, height, cell_size_for(width, height))
+    snake = make_snake()
+    cycle = snake.hamiltonian_path
+    renderer = renderer_class()
+    food_pos = cycle[-1]
+
+    start = time.perf_counter()
+    renderer.render(snake, food_pos, None)
+    first_frame = time.perf_counter() - start
+
+    step = snake.length
+    total = 0.0
+    for frame in range(frames):
+        new_head = cycle[step % len(cycle)]
+        snake.current_food_pos = new_head if frame % GROW_EVERY == 0 else None
+        snake.move_forward(new_head)
+        step += 1
+
+        start = time.perf_counter()
+        renderer.render(snake, food_pos, None)
+        total += time.perf_counter() - start
+    return first_frame * 1000, total / frames * 1000
+
+
+def bench_fixture(path: str, repeats: int) -> Tuple[float, float]:
+    """Возвращает (минимум, медиана) времени шага из фикстуры в миллисекундах."""
+    state = game.load_board_fixture(path)
+    game.use_board_grid(state)
+    snake = game.snake_from_fixture(state)
+    food_pos = tuple(state['food'])
+    times = []
+    for _ in range(repeats):
+        snake.load_state(state)
+        game.restore_rng_state(state)
+        start = time.perf_counter()
+        snake.move(food_pos)
+        times.append(time.perf_counter() - start)
+    return min(times) * 1000, statistics.median(times) * 1000
+
+
+def bench_playout(path: str, steps: int) -> Tuple[int, float, str]:
+    """Играет автопилотом до steps шагов от состояния фикстуры. Возвращает (шаги, шагов в секунду, исход)."""
+    state = game.load_board_fixture(path)
+    game.use_board_grid(state)
+    snake = game.snake_from_fixture(state, 'auto')
+    random.seed(0) # Без записанного состояния random - повторяемая последовательность еды
+    game.restore_rng_state(state)
+    food = game.Food()
+    game.place_food(food, snake, state)
+    board_cells = game.GRID_WIDTH * game.GRID_HEIGHT
+    outcome = "running"
+    start = time.perf_counter()
+    for step in range(1, steps + 1):
+        if snake.move(food.position):
+            outcome = "died"
+            break
+        if snake.get_head_position() == food.position:
+            if snake.length >= board_cells - 1:
+                outcome = "won"
+                break
+            food.randomize_position(snake.positions)
+            snake.current_food_pos = food.position
+    elapsed = time.perf_counter() - start
+    return step, step / elapsed, outcome
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сравнение BoardRenderer и NumpyBoardRenderer.")
+    parser.add_argument("--frames", type=int, default=200, help="число замеряемых кадров на поле")
+    parser.add_argument("--sizes", nargs="+", type=parse_size, default=DEFAULT_SIZES,
+                        help="размеры поля в клетках, например 40x30")
+    parser.add_argument("--fixtures", nargs="+", metavar="PATH",
+                        help="замерить шаг логики из фикстур состояния вместо отрисовки")
+    parser.add_argument("--repeats", type=int, default=20, help="повторов шага на фикстуру")
+    parser.add_argument("--playout", type=int, metavar="STEPS",
+                        help="вместо одного шага играть автопилотом от фикстуры до STEPS шагов")
+    parser.add_argument("--lookahead", action="store_true",
+                        help="автопилот с поиском вперед (время на шаг - по скорости из фикстуры)")
+    args = parser.parse_args()
+    pygame.init()
+    game.set_lookahead(args.lookahead)
+
+    if args.fixtures and args.playout:
+        print(f"{'fixture':>40} {'board':>10} {'length':>7} {'steps':>7} {'steps/s':>9} {'outcome':>8}")
+        for path in args.fixtures:
+            state = game.load_board_fixture(path)
+            steps, rate, outcome = bench_playout(path, args.playout)
+            board = "x".join(str(size) for size in state['grid'])
+            print(f"{os.path.basename(path):>40} {board:>10} {len(state['body']):>7} {steps:>7} {rate:>9.0f} {outcome:>8}")
+        pygame.quit()
+        return
+
+    if args.fixtures:
+        print(f"{'fixture':>40} {'board':>10} {'length':>7} {'recorded, ms':>13} {'min, ms':>9} {'median, ms':>11}")
+        for path in args.fixtures:
+            state = game.load_board_fixture(path)
+            recorded = state.get('slow_step', {}).get('step_ms', float('nan'))
+            best, median = bench_fixture(path, args.repeats)
+            board = "x".join(str(size) for size in state['grid'])
+            print(f"{os.path.basename(path):>40} {board:>10} {len(state['body']):>7} {recorded:>13.2f} {best:>9.2f} {median:>11.2f}")
+        pygame.quit()
+        return
+
+    print(f"{'board':>10} {'cell':>4} {'renderer':>10} {'first, ms':>10} {'frame, ms':>10}")
+    for width, height in args.sizes:
+        for name, renderer_class in (("per-cell", game.BoardRenderer), ("numpy", game.NumpyBoardRenderer)):
+            first_frame, per_frame = bench_renderer(renderer_class, width, height, args.frames)
+            print(f"{f'{width}x{height}':>10} {game.GRIDSIZE:>4} {name:>10} {first_frame:>10.2f} {per_frame:>10.3f}")
+    pygame.quit()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,41 +1,667 @@
 #!/usr/bin/env python3
+import time # Import time for performance counter
+STARTUP_MARKS = [('start', time.perf_counter())] # Отметки этапов запуска для --profile-startup
 import pygame
+STARTUP_MARKS.append(('import pygame', time.perf_counter()))
 import sys
 import random
 import os
-from collections import deque
-from typing import List, Tuple, Set, Deque, Dict, Optional, Any, Union, TypedDict
+from collections import deque, OrderedDict
+from typing import List, Tuple, Set, Deque, Dict, Optional, Any, Union, TypedDict, Iterable, Iterator
 import itertools
+import argparse
+import math
 import heapq
-import time # Import time for performance counter
+import json
+import csv
+import queue
+import threading
+from array import array
+import numpy as np
 from pygame import Surface
 from pygame.font import Font
+STARTUP_MARKS.append(('import numpy and stdlib', time.perf_counter()))
+
+# --- Временной ряд для статистики (LPS/FPS) ---
+class TimeSeries:
+    """
+    Временной ряд фиксированной емкости: метки time.perf_counter() и значения в кольцевых массивах NumPy.
+    Min/avg/max за последние window_seconds (считая от последнего значения) поддерживаются
+    скользящими - сумма окна и монотонные очереди минимумов и максимумов, так что stats() стоит O(1).
+    """
+
+    def __init__(self, capacity: int, window_seconds: float):
+        self.capacity = capacity
+        self.window_seconds = window_seconds
+        self._timestamps = np.zeros(capacity, dtype=np.float64)
+        self._values = np.zeros(capacity, dtype=np.float64)
+        self.total = 0 # Сколько значений добавлено за все время (он же номер следующего)
+        self._window_start = 0 # Номер самого старого значения в окне статистики
+        self._window_sum = 0.0
+        self._window_min: Deque[Tuple[int, float]] = deque() # (номер, значение), значения возрастают
+        self._window_max: Deque[Tuple[int, float]] = deque() # (номер, значение), значения убывают
+
+    def __len__(self) -> int:
+        return min(self.total, self.capacity)
+
+    def append(self, value: float, timestamp: Optional[float] = None):
+        if timestamp is None:
+            timestamp = time.perf_counter()
+        value = float(value)
+        serial = self.total
+        if self._window_start <= serial - self.capacity:
+            self._drop_oldest() # Ячейка сейчас будет перезаписана
+        slot = serial % self.capacity
+        self._timestamps[slot] = timestamp
+        self._values[slot] = value
+        self.total += 1
+
+        self._window_sum += value
+        while self._window_min and self._window_min[-1][1] >= value:
+            self._window_min.pop()
+        self._window_min.append((serial, value))
+        while self._window_max and self._window_max[-1][1] <= value:
+            self._window_max.pop()
+        self._window_max.append((serial, value))
+
+        cutoff = timestamp - self.window_seconds
+        while self._timestamps[self._window_start % self.capacity] < cutoff:
+            self._drop_oldest()
+
+    def _drop_oldest(self):
+        """Выводит из окна статистики самое старое значение."""
+        serial = self._window_start
+        self._window_sum -= self._values[serial % self.capacity]
+        self._window_start += 1
+        if self._window_min[0][0] == serial:
+            self._window_min.popleft()
+        if self._window_max[0][0] == serial:
+            self._window_max.popleft()
+        if self._window_start == self.total:
+            self._window_sum = 0.0 # Окно опустело: сбрасываем накопленную ошибку округления
+
+    def stats(self) -> Tuple[float, float, float]:
+        """(min, avg, max) значений за последние window_seconds или нули, если ряд пуст."""
+        count = self.total - self._window_start
+        if not count:
+            return 0.0, 0.0, 0.0
+        return self._window_min[0][1], self._window_sum / count, self._window_max[0][1]
+
+    def latest(self, count: int) -> np.ndarray:
+        """Последние count значений (не больше len(self)) в порядке добавления."""
+        return self._values[np.arange(self.total - count, self.total) % self.capacity]
+
+    def values(self) -> np.ndarray:
+        return self.latest(len(self))
+
+    def window(self, seconds: float) -> np.ndarray:
+        """Значения за последние seconds секунд (от последнего значения), поиск границы - бинарный."""
+        if not self.total:
+            return self.latest(0)
+        cutoff = self._timestamps[(self.total - 1) % self.capacity] - seconds
+        low, high = self.total - len(self), self.total - 1
+        while low < high:
+            middle = (low + high) // 2
+            if self._timestamps[middle % self.capacity] < cutoff:
+                low = middle + 1
+            else:
+                high = middle
+        return self.latest(self.total - low)
+
+# --- Профиль запуска (--profile-startup) ---
+DEFAULT_STARTUP_BUDGET_MS = 1500.0 # Время до первого кадра стартового экрана, которое считаем нормой
+
+class StartupProfiler:
+    """
+    Отметки этапов запуска от начала импорта модуля до первого показанного кадра start_screen.
+    Отметки ставятся всегда (это дешево), отчет печатается только в режиме --profile-startup.
+    """
+
+    def __init__(self, marks: List[Tuple[str, float]]):
+        self.marks = marks
+        self.enabled = False
+        self.budget_ms = DEFAULT_STARTUP_BUDGET_MS
+        self.first_frame_ms: Optional[float] = None
+
+    def mark(self, stage: str):
+        if self.first_frame_ms is None:
+            self.marks.append((stage, time.perf_counter()))
+
+    def first_frame(self):
+        """Вызывается после показа кадра стартового экрана; в режиме профиля печатает отчет и завершает процесс."""
+        if self.first_frame_ms is not None:
+            return
+        self.mark('first start_screen frame')
+        self.first_frame_ms = (self.marks[-1][1] - self.marks[0][1]) * 1000
+        if self.enabled:
+            print(self.format_report())
+            deferred = measure_deferred_startup_stages()
+            print(deferred)
+            over_budget = self.first_frame_ms > self.budget_ms
+            verdict = "OVER BUDGET" if over_budget else "within budget"
+            print(f"Time to first frame: {self.first_frame_ms:.1f} ms (budget {self.budget_ms:.0f} ms, {verdict})")
+            pygame.quit()
+            sys.exit(1 if over_budget else 0)
+
+    def format_report(self) -> str:
+        lines = ["Startup, ms:                          stage    total"]
+        previous = self.marks[0][1]
+        for stage, timestamp in self.marks[1:]:
+            lines.append(f"  {stage:<32}{(timestamp - previous) * 1000:>9.1f}{(timestamp - self.marks[0][1]) * 1000:>9.1f}")
+            previous = timestamp
+        return "\n".join(lines)
+
+startup_profiler = StartupProfiler(STARTUP_MARKS)
+
+def measure_deferred_startup_stages() -> str:
+    """Замеряет дорогие этапы, которые идут уже после первого кадра: звук, превью тем, змейка с Гамильтоновым циклом."""
+    lines = ["Off the first-frame path, ms:"]
+    assets.wait(5.0)
+    for name, seconds in assets.load_times.items():
+        lines.append(f"  {'synthesize sound ' + name + ' (bg)':<32}{seconds * 1000:>9.1f}")
+    start = time.perf_counter()
+    ThemeSelector(0, 0, 300, current_theme_name=current_theme)
+    lines.append(f"  {'ThemeSelector with previews':<32}{(time.perf_counter() - start) * 1000:>9.1f}")
+    start = time.perf_counter()
+    snake = Snake('auto')
+    lines.append(f"  {'Snake() total':<32}{(time.perf_counter() - start) * 1000:>9.1f}")
+    start = time.perf_counter()
+    snake._generate_hamiltonian_cycle_path()
+    lines.append(f"  {'  Hamiltonian cycle':<32}{(time.perf_counter() - start) * 1000:>9.1f}")
+    return "\n".join(lines)
+
+# --- Гистограммы задержек кадра и шага логики ---
+LATENCY_PHASES = ('frame', 'step', 'event', 'logic', 'render', 'present')
+LATENCY_PERCENTILES = (50, 95, 99)
+LATENCY_MIN_SECONDS = 1e-6 # Все, что быстрее микросекунды, попадает в первую корзину
+LATENCY_BUCKETS_PER_OCTAVE = 32 # Относительная погрешность корзины ~2%
+LATENCY_OCTAVES = 25 # От 1 мкс до ~30 с
+
+class LatencyHistogram:
+    """
+    Гистограмма задержек в духе HDR Histogram: логарифмические корзины с постоянной
+    относительной точностью. Запись - O(1) без выделения памяти, перцентили - по накопленной сумме.
+    """
 
-# --- Класс для значений с временными метками для статистики ---
-class TimestampedValue:
-    def __init__(self, value: float, timestamp: Optional[float] = None):
-        self.value = value
-        self.timestamp = time.time() if timestamp is None else timestamp
+    def __init__(self):
+        self.counts = np.zeros(LATENCY_BUCKETS_PER_OCTAVE * LATENCY_OCTAVES, dtype=np.int64)
+        self.count = 0
+        self.max = 0.0
 
-    def __lt__(self, other):
-        return self.value < other.value if isinstance(other, TimestampedValue) else self.value < other
+    def record(self, seconds: float):
+        if seconds > LATENCY_MIN_SECONDS:
+            bucket = min(int(math.log2(seconds / LATENCY_MIN_SECONDS) * LATENCY_BUCKETS_PER_OCTAVE), len(self.counts) - 1)
+        else:
+            bucket = 0
+        self.counts[bucket] += 1
+        self.count += 1
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, percent: float) -> float:
+        """Верхняя граница корзины, в которую попал перцентиль (не больше максимума), в секундах."""
+        if not self.count:
+            return 0.0
+        rank = max(1, math.ceil(self.count * percent / 100))
+        bucket = int(np.searchsorted(np.cumsum(self.counts), rank))
+        upper = LATENCY_MIN_SECONDS * 2.0 ** ((bucket + 1) / LATENCY_BUCKETS_PER_OCTAVE)
+        return min(upper, self.max)
+
+    def reset(self):
+        self.counts.fill(0)
+        self.count = 0
+        self.max = 0.0
+
+class LatencyRecorder:
+    """
+    Задержки по фазам: кадр целиком, шаг логики, события, логика кадра, отрисовка, вывод на экран.
+    session копит всю игру (для сводки в конце), window - короткое окно для оверлея.
+    """
+
+    def __init__(self, window_seconds: float):
+        self.window_seconds = window_seconds
+        self.session = {phase: LatencyHistogram() for phase in LATENCY_PHASES}
+        self.window = {phase: LatencyHistogram() for phase in LATENCY_PHASES}
+        self.snapshot: Dict[str, Tuple[float, ...]] = {} # Перцентили и максимум последнего окна
+        self._window_start = time.perf_counter()
+
+    def record(self, phase: str, seconds: float):
+        self.session[phase].record(seconds)
+        self.window[phase].record(seconds)
+
+    def roll_window(self, now: float) -> bool:
+        """Закрывает окно оверлея, если оно истекло. Возвращает True, если снимок обновился."""
+        if now - self._window_start < self.window_seconds:
+            return False
+        self.snapshot = {phase: summarize_latency(histogram) for phase, histogram in self.window.items() if histogram.count}
+        for histogram in self.window.values():
+            histogram.reset()
+        self._window_start = now
+        return True
+
+    def format_summary(self) -> str:
+        lines = ["Latency, ms:      " + "".join(f"{'p' + str(p):>8}" for p in LATENCY_PERCENTILES) + f"{'max':>8}{'count':>10}"]
+        for phase, histogram in self.session.items():
+            if histogram.count:
+                values = "".join(f"{value * 1000:8.2f}" for value in summarize_latency(histogram))
+                lines.append(f"  {phase:<16}{values}{histogram.count:>10}")
+        return "\n".join(lines)
+
+    def reset_session(self):
+        for histogram in self.session.values():
+            histogram.reset()
+
+def summarize_latency(histogram: LatencyHistogram) -> Tuple[float, ...]:
+    """(p50, p95, p99, max) в секундах."""
+    return tuple(histogram.percentile(p) for p in LATENCY_PERCENTILES) + (histogram.max,)
+
+def report_latency(latency: LatencyRecorder):
+    """Печатает сводку задержек за закончившуюся игру и начинает накопление заново."""
+    if latency.session['frame'].count:
+        print(latency.format_summary())
+    latency.reset_session()
+
+# --- Экспорт метрик (JSONL/CSV и textfile для Prometheus) ---
+METRICS_INTERVAL_SECONDS = 1.0
+METRICS_MAX_BYTES = 10 * 1024 * 1024 # Размер файла метрик, после которого он ротируется
+METRICS_BACKUPS = 5 # Сколько ротированных файлов хранить (metrics.jsonl.1 ... .5)
+METRICS_QUEUE_SIZE = 256
+METRICS_FIELDS = ('time', 'actual_lps', 'target_lps', 'render_fps', 'logic_share', 'dropped_steps',
+                  'snake_length', 'fill_percent', 'astar_expansions')
+METRICS_HELP = {
+    'actual_lps': 'Logic steps per second actually executed',
+    'target_lps': 'Logic steps per second requested by the speed setting',
+    'render_fps': 'Rendered frames per second',
+    'logic_share': 'Fraction of wall time spent in game logic',
+    'dropped_steps': 'Logic steps short of the target speed during the sample',
+    'snake_length': 'Snake length in cells',
+    'fill_percent': 'Share of the board occupied by the snake, percent',
+    'astar_expansions': 'A* nodes expanded during the sample',
+}
 
-    def __gt__(self, other):
-        return self.value > other.value if isinstance(other, TimestampedValue) else self.value > other
+class MetricsSink:
+    """
+    Пишет образцы метрик в JSONL или CSV (по расширению файла) с ротацией по размеру
+    и, если задан prometheus_path, в файл для textfile-коллектора node_exporter.
+    Запись идет в фоновом потоке: игровой цикл только кладет словарь в очередь
+    и при переполненной очереди образец отбрасывается, а не ждет диска.
+    """
+
+    def __init__(self, path: Optional[str], prometheus_path: Optional[str] = None,
+                 max_bytes: int = METRICS_MAX_BYTES, backups: int = METRICS_BACKUPS):
+        self.path = path
+        self.prometheus_path = prometheus_path
+        self.use_csv = bool(path) and path.lower().endswith('.csv')
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.dropped_samples = 0
+        self._queue: queue.Queue = queue.Queue(maxsize=METRICS_QUEUE_SIZE)
+        self._file = None
+        self._csv_writer = None
+        self._thread = threading.Thread(target=self._run, name='metrics-sink', daemon=True)
+        self._thread.start()
+
+    def submit(self, sample: Dict[str, float]):
+        try:
+            self._queue.put_nowait(sample)
+        except queue.Full:
+            self.dropped_samples += 1
 
-    def __eq__(self, other):
-        return self.value == other.value if isinstance(other, TimestampedValue) else self.value == other
+    def close(self):
+        """Дописывает очередь и закрывает файл."""
+        self._queue.put(None)
+        self._thread.join(timeout=5.0)
 
-    def __float__(self):
-        return float(self.value)
+    def _run(self):
+        while True:
+            sample = self._queue.get()
+            if sample is None:
+                break
+            try:
+                if self.path:
+                    self._write_sample(sample)
+                if self.prometheus_path:
+                    self._write_prometheus(sample)
+            except OSError as e:
+                print(f"Could not write metrics: {e}")
+        if self._file is not None:
+            self._file.close()
+
+    def _open(self):
+        self._file = open(self.path, 'a', newline='', encoding='utf-8')
+        if self.use_csv:
+            self._csv_writer = csv.DictWriter(self._file, fieldnames=METRICS_FIELDS)
+            if self._file.tell() == 0:
+                self._csv_writer.writeheader()
+
+    def _rotate(self):
+        self._file.close()
+        for index in range(self.backups - 1, 0, -1):
+            older = f"{self.path}.{index}"
+            if os.path.exists(older):
+                os.replace(older, f"{self.path}.{index + 1}")
+        if self.backups > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self._open()
+
+    def _write_sample(self, sample: Dict[str, float]):
+        if self._file is None:
+            self._open()
+        elif self._file.tell() >= self.max_bytes:
+            self._rotate()
+        if self.use_csv:
+            self._csv_writer.writerow(sample)
+        else:
+            self._file.write(json.dumps(sample) + '\n')
+        self._file.flush()
+
+    def _write_prometheus(self, sample: Dict[str, float]):
+        """Файл пишется целиком во временный и подменяется атомарно, чтобы коллектор не прочел половину."""
+        lines = []
+        for field, help_text in METRICS_HELP.items():
+            name = f"modernsnake_{field}"
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {sample[field]}")
+        temp_path = f"{self.prometheus_path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as prometheus_file:
+            prometheus_file.write('\n'.join(lines) + '\n')
+        os.replace(temp_path, self.prometheus_path)
+
+class MetricsSampler:
+    """Копит счетчики кадров, шагов логики и раскрытий A* и раз в интервал отдает образец в MetricsSink."""
+
+    def __init__(self, sink: MetricsSink, interval: float = METRICS_INTERVAL_SECONDS):
+        self.sink = sink
+        self.interval = interval
+        self._window_start = time.perf_counter()
+        self._frames = 0
+        self._steps = 0
+        self._target_steps = 0.0
+        self._logic_time = 0.0
+        self._expansions_seen = 0
+
+    def frame(self, now: float, dt_seconds: float, steps: int, logic_time: float, snake: 'Snake'):
+        self._frames += 1
+        self._steps += steps
+        self._target_steps += snake.speed * dt_seconds
+        self._logic_time += logic_time
+        elapsed = now - self._window_start
+        if elapsed < self.interval:
+            return
 
-def get_values_in_timespan(history: Deque[TimestampedValue], seconds: float = 5.0) -> List[float]:
-    """Get only values from the last N seconds."""
-    now = time.time()
-    return [item.value for item in history if now - item.timestamp <= seconds]
+        expansions = snake.path_find.expansions
+        if expansions < self._expansions_seen: # Новая змейка - счетчик начался заново
+            self._expansions_seen = 0
+        board_cells = GRID_WIDTH * GRID_HEIGHT
+        self.sink.submit({
+            'time': round(time.time(), 3),
+            'actual_lps': round(self._steps / elapsed, 2),
+            'target_lps': snake.speed,
+            'render_fps': round(self._frames / elapsed, 2),
+            'logic_share': round(self._logic_time / elapsed, 4),
+            'dropped_steps': max(0, int(self._target_steps) - self._steps),
+            'snake_length': snake.length,
+            'fill_percent': round(snake.length / board_cells * 100, 2),
+            'astar_expansions': expansions - self._expansions_seen,
+        })
+        self._expansions_seen = expansions
+        self._window_start = now
+        self._frames = self._steps = 0
+        self._target_steps = self._logic_time = 0.0
+
+# --- Фикстуры состояния поля и сторож медленных шагов логики ---
+FIXTURE_VERSION = 1
+SLOW_STEP_MAX_DUMPS = 20 # Больше фикстур за запуск не пишем, чтобы не засыпать диск
+
+STATE_DIR = 'states' # Куда F5 в игре сохраняет текущее состояние поля
+STATE_HEADER = 'modernsnake-state'
+# Текстовый формат: тело задается головой и шагами от каждого сегмента к следующему (к хвосту)
+STATE_STEP_LETTERS = {(0, -1): 'U', (0, 1): 'D', (-1, 0): 'L', (1, 0): 'R'}
+STATE_DIRECTION_NAMES = {(0, -1): 'up', (0, 1): 'down', (-1, 0): 'left', (1, 0): 'right'}
+
+def format_board_state(state: Dict[str, Any]) -> str:
+    """
+    Текстовая запись состояния поля (размер, направление, еда, тело), например:
+        modernsnake-state 1
+        grid 40 30
+        direction right
+        food 12 7
+        head 5 5
+        body LLLDDR
+    """
+    width, height = state['grid']
+    body = state['body']
+    steps = []
+    for (ax, ay), (bx, by) in zip(body, body[1:]):
+        dx = (bx - ax + 1) % width - 1
+        dy = (by - ay + 1) % height - 1
+        steps.append(STATE_STEP_LETTERS[(dx, dy)])
+    food = state.get('food')
+    lines = [
+        f"{STATE_HEADER} {FIXTURE_VERSION}",
+        f"grid {width} {height}",
+        f"direction {STATE_DIRECTION_NAMES[tuple(state['direction'])]}",
+        f"food {food[0]} {food[1]}" if food is not None else "food none",
+        f"head {body[0][0]} {body[0][1]}",
+        f"body {''.join(steps)}",
+    ]
+    return '\n'.join(lines) + '\n'
+
+def parse_board_state(text: str) -> Dict[str, Any]:
+    """Разбирает текстовую запись format_board_state. Пустые строки и строки с # пропускаются."""
+    fields: Dict[str, List[str]] = {}
+    for line in text.splitlines():
+        line = line.split('#', 1)[0].strip()
+        if line:
+            key, *values = line.split()
+            fields[key] = values
+    if fields.get(STATE_HEADER) != [str(FIXTURE_VERSION)]:
+        raise ValueError(f"expected '{STATE_HEADER} {FIXTURE_VERSION}' header")
+    try:
+        width, height = (int(value) for value in fields['grid'])
+        directions = {name: direction for direction, name in STATE_DIRECTION_NAMES.items()}
+        direction = directions[fields['direction'][0]]
+        food = None if fields.get('food', ['none']) == ['none'] else [int(value) for value in fields['food']]
+        x, y = (int(value) for value in fields['head'])
+        steps = fields.get('body', [''])
+        moves = {letter: step for step, letter in STATE_STEP_LETTERS.items()}
+        body = [[x, y]]
+        for letter in ''.join(steps):
+            dx, dy = moves[letter]
+            x, y = (x + dx) % width, (y + dy) % height
+            body.append([x, y])
+    except (KeyError, ValueError) as e:
+        raise ValueError(f"malformed board state: {e}")
+    return {'version': FIXTURE_VERSION, 'grid': [width, height], 'body': body,
+            'direction': list(direction), 'food': food}
+
+def validate_board_state(state: Dict[str, Any]):
+    """Проверяет, что состояние можно сыграть: клетки на поле, тело без повторов и без разрывов."""
+    width, height = state['grid']
+    if width < 2 or height < 2:
+        raise ValueError("board must be at least 2x2")
+    body = [tuple(pos) for pos in state['body']]
+    if not body:
+        raise ValueError("snake body is empty")
+    cells = body + ([tuple(state['food'])] if state.get('food') is not None else [])
+    if any(not (0 <= x < width and 0 <= y < height) for x, y in cells):
+        raise ValueError("cell outside the board")
+    if len(set(body)) != len(body):
+        raise ValueError("snake body crosses itself")
+    if state.get('food') is not None and tuple(state['food']) in set(body):
+        raise ValueError("food is on the snake")
+    for (ax, ay), (bx, by) in zip(body, body[1:]):
+        if ((bx - ax + 1) % width - 1, (by - ay + 1) % height - 1) not in STATE_STEP_LETTERS:
+            raise ValueError(f"segments {(ax, ay)} and {(bx, by)} are not adjacent")
+    if tuple(state['direction']) not in STATE_DIRECTION_NAMES:
+        raise ValueError(f"bad direction {state['direction']!r}")
+
+def save_board_fixture(path: str, state: Dict[str, Any]):
+    """Сохраняет состояние: в JSON для .json (со всеми полями), иначе в текстовом формате."""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as fixture_file:
+        if path.lower().endswith('.json'):
+            json.dump(state, fixture_file)
+        else:
+            fixture_file.write(format_board_state(state))
+
+def load_board_fixture(path: str) -> Dict[str, Any]:
+    """Загружает состояние из JSON-фикстуры или текстового формата (определяется по содержимому)."""
+    with open(path, encoding='utf-8') as fixture_file:
+        text = fixture_file.read()
+    if text.lstrip().startswith('{'):
+        state = json.loads(text)
+        if state.get('version') != FIXTURE_VERSION:
+            raise ValueError(f"unsupported fixture version {state.get('version')!r} in '{path}'")
+    else:
+        state = parse_board_state(text)
+    validate_board_state(state)
+    return state
+
+def snake_from_fixture(state: Dict[str, Any], mode: Optional[str] = None) -> 'Snake':
+    """Создает змейку в состоянии фикстуры. Поле должно быть уже переключено на ее размер (use_board_grid)."""
+    if tuple(state['grid']) != (GRID_WIDTH, GRID_HEIGHT):
+        raise ValueError(f"fixture grid {state['grid'][0]}x{state['grid'][1]} does not match the board {GRID_WIDTH}x{GRID_HEIGHT}")
+    snake = Snake(mode or state.get('mode', 'auto'))
+    snake.load_state(state)
+    return snake
+
+def place_food(food: 'Food', snake: 'Snake', board_state: Optional[Dict[str, Any]]):
+    """Ставит еду из загруженного состояния, а если его нет (или клетка занята) - в случайную клетку."""
+    food_cell = board_state.get('food') if board_state is not None else None
+    if food_cell is not None and tuple(food_cell) not in snake.positions:
+        food.position = tuple(food_cell)
+    else:
+        food.randomize_position(snake_positions=snake.positions)
 
-pygame.init()
-pygame.mixer.init()
+def restart_board(snake: 'Snake', food: 'Food', fill_percent: int, board_state: Optional[Dict[str, Any]]):
+    """Начинает игру заново: с загруженного состояния (вместе с состоянием random), иначе с заполнения fill_percent."""
+    if board_state is not None:
+        snake.load_state(board_state)
+        restore_rng_state(board_state)
+    else:
+        snake.reset(initial_fill_percentage=fill_percent)
+    place_food(food, snake, board_state)
+
+def restore_rng_state(state: Dict[str, Any]):
+    """Возвращает генератор random в состояние из фикстуры (если оно записано)."""
+    rng_state = state.get('rng_state')
+    if rng_state is not None:
+        version, internal_state, gauss_next = rng_state
+        random.setstate((version, tuple(internal_state), gauss_next))
+
+class SlowStepWatchdog:
+    """
+    Замеряет каждый шаг логики. Шаг дольше threshold_ms сохраняется фикстурой в out_dir:
+    состояние поля до шага, состояние random и время по фазам выбора хода.
+    Фазы замеряются обертками над методами змейки (включительно: поиск пути внутри
+    режима выживания попадает и в survival_move, и в find_path).
+    Снимок до шага стоит ~20 мкс (random.getstate), поэтому сторож включается только явно.
+    """
+
+    PROFILED_METHODS = (
+        ('path_find', 'find_path', 'find_path'),
+        (None, 'is_path_safe_to_food', 'path_safety'),
+        (None, '_is_path_to_target_safe', 'path_safety'),
+        (None, '_find_standard_survival_move', 'survival_move'),
+        (None, 'find_immediate_safe_direction', 'immediate_safe_direction'),
+        ('planner', 'advance', 'lookahead'),
+        (None, 'move_forward', 'move_forward'),
+    )
+
+    def __init__(self, threshold_ms: float, out_dir: str, max_dumps: int = SLOW_STEP_MAX_DUMPS):
+        self.threshold_ms = threshold_ms
+        self.out_dir = out_dir
+        self.max_dumps = max_dumps
+        self.dumps = 0
+        self._snake: Optional['Snake'] = None
+        self._phases: Dict[str, List[float]] = {} # фаза -> [секунды, вызовы] за текущий шаг
+        self._before: Dict[str, Any] = {}
+
+    def _attach(self, snake: 'Snake'):
+        for owner_name, method_name, phase in self.PROFILED_METHODS:
+            owner = getattr(snake, owner_name) if owner_name else snake
+            setattr(owner, method_name, self._timed(getattr(owner, method_name), phase))
+        self._snake = snake
+
+    def _timed(self, method, phase: str):
+        phases = self._phases
+        def timed_method(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                totals = phases.setdefault(phase, [0.0, 0])
+                totals[0] += time.perf_counter() - start
+                totals[1] += 1
+        return timed_method
+
+    def before_step(self, snake: 'Snake', food_pos: Tuple[int, int]):
+        if snake is not self._snake:
+            self._attach(snake)
+        self._phases.clear()
+        path = snake.current_path
+        self._before = {
+            'rng_state': random.getstate(),
+            'direction': snake.direction,
+            'next_direction': snake.next_direction,
+            'survival_mode_steps_remaining': snake.survival_mode_steps_remaining,
+            'recalculate_path': snake.recalculate_path,
+            'path': path,
+            'path_length': len(path),
+            'path_head': path[0] if path else None,
+            'tail': snake.positions[-1],
+            'length': snake.length,
+            'food': food_pos,
+        }
+
+    def after_step(self, snake: 'Snake', step_seconds: float, collision: bool):
+        if step_seconds * 1000 < self.threshold_ms or self.dumps >= self.max_dumps:
+            return
+        self.dumps += 1
+        state = self._state_before_step(snake)
+        state['slow_step'] = {
+            'step_ms': round(step_seconds * 1000, 3),
+            'threshold_ms': self.threshold_ms,
+            'collision': collision,
+            'phases_ms': {phase: round(totals[0] * 1000, 3) for phase, totals in self._phases.items()},
+            'phase_calls': {phase: totals[1] for phase, totals in self._phases.items()},
+            'recorded_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        }
+        path = os.path.join(self.out_dir, f"slow_step_{time.strftime('%Y%m%d_%H%M%S')}_{self.dumps:02d}.json")
+        try:
+            save_board_fixture(path, state)
+            print(f"Slow logic step {step_seconds * 1000:.1f} ms at length {self._before['length']}, state saved to '{path}'")
+        except OSError as e:
+            print(f"Could not save slow step fixture ('{path}'): {e}")
+
+    def _state_before_step(self, snake: 'Snake') -> Dict[str, Any]:
+        """Восстанавливает состояние до шага: шаг всегда добавляет голову и убирает хвост, если змейка не выросла."""
+        before = self._before
+        body = list(snake.positions)[1:]
+        if snake.length == before['length']:
+            body.append(before['tail'])
+        path = list(before['path'])
+        if before['path'] is snake.current_path and len(path) < before['path_length']:
+            path.insert(0, before['path_head']) # Пройденная клетка снята с начала пути на месте
+
+        state = snake.export_state(before['food'])
+        version, internal_state, gauss_next = before['rng_state']
+        state.update({
+            'body': [list(pos) for pos in body],
+            'direction': list(before['direction']),
+            'next_direction': list(before['next_direction']),
+            'survival_mode_steps_remaining': before['survival_mode_steps_remaining'],
+            'recalculate_path': before['recalculate_path'],
+            'current_path': [list(pos) for pos in path],
+            'rng_state': [version, list(internal_state), gauss_next],
+        })
+        return state
 
 SCREEN_WIDTH, SCREEN_HEIGHT = 800, 600
 GRIDSIZE = 20
@@ -78,31 +704,267 @@ FONT_SIZE_MEDIUM = 24
 FONT_SIZE_LARGE = 36
 FONT_SIZE_XLARGE = 72
 FONT_SIZE_TINY = 14
+MENU_IDLE_WAIT_MS = 500 # Сколько меню ждет события, прежде чем проверить анимации
 
 UP = (0, -1)
 DOWN = (0, 1)
 LEFT = (-1, 0)
 RIGHT = (1, 0)
 
-script_dir = os.path.dirname(__file__)
-sound_file_path = os.path.join(script_dir, 'eat.wav')
+# --- Процедурный звук: волны строятся NumPy прямо в памяти, без WAV-файлов ---
+MELODY_CHORDS = {
+    "Cm": (261.63, 311.13, 392.00),  # C minor: C, Eb, G
+    "F5": (698.46, 880.00, 1046.50), # F5: F, A, C октавой выше
+    "A5": (440.00, 554.37, 659.25),  # A5: A, C#, E октавой выше
+    "Dm": (293.66, 349.23, 440.00),  # D minor: D, F, A
+    "Em": (329.63, 392.00, 493.88),  # E minor: E, G, B
+    "Gm": (392.00, 466.16, 587.33),  # G minor: G, Bb, D
+    "C5": (523.25, 659.25, 783.99),  # C5: C, E, G октавой выше
+}
+MELODY_PROGRESSION = ("Cm", "F5", "A5", "Dm", None, "Em", "Gm", None, "C5") # None - пауза
+MELODY_CHORD_SECONDS = 0.2
+MELODY_PAUSE_SECONDS = 0.1
+MELODY_DETUNE = 0.05 # Каждая нота случайно расстроена в пределах ±5%
+EAT_SWEEP_HZ = (1500.0, 800.0) # Частота "хрума" плавно падает
+EAT_SECONDS = 0.72
+EAT_ATTACK_SECONDS = 0.15
+EAT_PEAK = 0.9
+DEFAULT_SAMPLE_RATE = 44100
+
+def synthesize_melody(seed: int = 0, sample_rate: int = DEFAULT_SAMPLE_RATE,
+                      chord_seconds: float = MELODY_CHORD_SECONDS, pause_seconds: float = MELODY_PAUSE_SECONDS,
+                      detune: float = MELODY_DETUNE) -> np.ndarray:
+    """
+    Мелодия проигрыша: аккорды из трех синусов со случайной расстройкой, между частями паузы.
+    Весь буфер считается одним np.sin по матрице (отсчет x нота) - без циклов по аккордам и concatenate.
+    Возвращает моно float32 в диапазоне [-1, 1].
+    """
+    rng = np.random.default_rng(seed)
+    is_chord = np.array([chord is not None for chord in MELODY_PROGRESSION])
+    frequencies = np.array([MELODY_CHORDS[chord] if chord else (0.0, 0.0, 0.0) for chord in MELODY_PROGRESSION])
+    frequencies *= rng.uniform(1 - detune, 1 + detune, frequencies.shape)
+    lengths = np.where(is_chord, int(sample_rate * chord_seconds), int(sample_rate * pause_seconds))
+    starts = np.cumsum(lengths) - lengths
+    segment = np.repeat(np.arange(len(lengths)), lengths) # Номер части для каждого отсчета
+    t = (np.arange(lengths.sum()) - starts[segment]) / sample_rate # Время от начала своей части
+    wave = (0.5 * np.sin(2 * np.pi * frequencies[segment] * t[:, None])).mean(axis=1)
+    wave[~is_chord[segment]] = 0.0
+    return (wave / np.abs(wave).max()).astype(np.float32)
+
+def synthesize_eat_sound(sample_rate: int = DEFAULT_SAMPLE_RATE, seconds: float = EAT_SECONDS,
+                         sweep_hz: Tuple[float, float] = EAT_SWEEP_HZ, attack_seconds: float = EAT_ATTACK_SECONDS,
+                         peak: float = EAT_PEAK) -> np.ndarray:
+    """Звук поедания: синус с частотой, падающей по sweep_hz, с быстрой атакой и экспоненциальным затуханием."""
+    t = np.arange(int(sample_rate * seconds)) / sample_rate
+    start_hz, end_hz = sweep_hz
+    phase = 2 * np.pi * (start_hz * t + (end_hz - start_hz) * t * t / (2 * seconds)) # Интеграл линейной частоты
+    envelope = np.minimum(t / attack_seconds, 1.0) * np.exp(-np.maximum(t - attack_seconds, 0.0) * 8 / seconds)
+    return (peak * envelope * np.sin(phase)).astype(np.float32)
+
+def _to_mixer_buffer(wave: np.ndarray, mixer_init: Tuple[int, int, int]) -> bytes:
+    """Переводит моно float-волну в формат микшера (pygame.mixer.get_init()): разрядность и число каналов."""
+    _, size, channels = mixer_init
+    if size == 32: # float32
+        samples = wave.astype(np.float32)
+    elif abs(size) == 16:
+        samples = np.round(wave * 32767).astype(np.int16) if size < 0 else np.round((wave + 1) * 32767.5).astype(np.uint16)
+    elif abs(size) == 8:
+        samples = np.round(wave * 127).astype(np.int8) if size < 0 else np.round((wave + 1) * 127.5).astype(np.uint8)
+    else:
+        raise ValueError(f"unsupported mixer sample format: {size}")
+    return np.repeat(samples[:, None], channels, axis=1).tobytes()
+
+_synthesized_sounds: Dict[Tuple[Any, ...], pygame.mixer.Sound] = {}
+
+def synthesized_sound(generator, params: Dict[str, Any]) -> pygame.mixer.Sound:
+    """
+    Звук из generator(**params) в формате текущего микшера. Кэшируется по генератору, параметрам
+    (в том числе seed) и формату микшера, так что одна и та же волна строится один раз.
+    """
+    mixer_init = pygame.mixer.get_init()
+    if not mixer_init:
+        raise pygame.error("mixer not initialized")
+    key = (generator.__name__, tuple(sorted(params.items())), mixer_init)
+    sound = _synthesized_sounds.get(key)
+    if sound is None:
+        wave = generator(sample_rate=mixer_init[0], **params)
+        sound = pygame.mixer.Sound(buffer=_to_mixer_buffer(wave, mixer_init))
+        _synthesized_sounds[key] = sound
+    return sound
+
+# --- Звуки: синтезируются один раз, лениво, в фоновом потоке ---
+SOUND_DEFINITIONS = {
+    # имя -> (генератор волны, его параметры, громкость по умолчанию)
+    'eat': (synthesize_eat_sound, {}, 0.05),
+    'melody': (synthesize_melody, {'seed': 0}, 0.1),
+}
 
-try:
-    eat_sound = pygame.mixer.Sound(sound_file_path)
-    eat_sound.set_volume(0.05)
-except pygame.error:
-    eat_sound = None
-    print(f"Warning: Sound file '{sound_file_path}' not found or cannot be loaded.")
+class AssetManager:
+    """
+    Выдает звуки по имени. Волны синтезируются один раз в фоновом потоке, запущенном start(),
+    так что окно появляется, не дожидаясь звука. Пока звук не готов (или не собрался вовсе),
+    get() возвращает None и звук просто не играет. Громкость, заданная до загрузки, применяется после нее.
+    """
+
+    def __init__(self, definitions: Dict[str, Tuple[Any, Dict[str, Any], float]]):
+        self.definitions = definitions
+        self._sounds: Dict[str, Optional[pygame.mixer.Sound]] = {}
+        self._volumes = {name: volume for name, (_, _, volume) in definitions.items()}
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self.load_times: Dict[str, float] = {} # Время синтеза каждого звука, с
+
+    def start(self):
+        """Запускает фоновую загрузку (повторные вызовы ничего не делают)."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._load_all, name='asset-loader', daemon=True)
+            self._thread.start()
+
+    def wait(self, timeout: Optional[float] = None):
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _load_all(self):
+        if not pygame.mixer.get_init():
+            try:
+                pygame.mixer.init()
+            except pygame.error as e:
+                print(f"Warning: audio is unavailable, playing without sound: {e}")
+                return
+        for name, (generator, params, _) in self.definitions.items():
+            start = time.perf_counter()
+            try:
+                sound = synthesized_sound(generator, params)
+            except (pygame.error, ValueError) as e:
+                print(f"Warning: Sound '{name}' cannot be synthesized: {e}")
+                continue
+            self.load_times[name] = time.perf_counter() - start
+            with self._lock:
+                sound.set_volume(self._volumes[name])
+                self._sounds[name] = sound
+
+    def get(self, name: str) -> Optional[pygame.mixer.Sound]:
+        return self._sounds.get(name)
+
+    def set_volume(self, name: str, volume: float):
+        with self._lock:
+            self._volumes[name] = volume
+            sound = self._sounds.get(name)
+            if sound is not None:
+                sound.set_volume(volume)
+
+assets = AssetManager(SOUND_DEFINITIONS)
+
+# --- Планировщик звука: события логики копятся и проигрываются раз за кадр ---
+AUDIO_CHANNELS = 4 # Каналы микшера, зарезервированные под звуки игры
+SOUND_MIN_INTERVALS = {
+    # имя -> минимум секунд между запусками; более частые запросы сливаются
+    'eat': 0.06,
+    'melody': 0.5,
+}
 
-melody_sound_path = os.path.join(script_dir, 'melody.wav')
-try:
-    melody_sound = pygame.mixer.Sound(melody_sound_path)
-    melody_sound.set_volume(0.1)
-except pygame.error:
-    melody_sound = None
-    print(f"Warning: Sound file '{melody_sound_path}' not found or cannot be loaded.")
+class AudioScheduler:
+    """
+    Проигрывает звуки на фиксированном пуле каналов микшера. Логика игры только ставит звук
+    в очередь (queue - счетчик в словаре, без обращения к микшеру), а основной цикл раз за кадр
+    вызывает drain: сколько бы раз звук ни запросили за кадр, он играет не больше одного раза
+    и не чаще SOUND_MIN_INTERVALS. Если свободного канала нет, занимается тот, что играет дольше всех.
+    """
+
+    def __init__(self, channel_count: int, min_intervals: Dict[str, float]):
+        self.channel_count = channel_count
+        self.min_intervals = min_intervals
+        self._pending: Dict[str, int] = {}
+        self._last_played: Dict[str, float] = {}
+        self._channels: List[pygame.mixer.Channel] = []
+        self._channel_started: List[float] = []
+        self.played = 0
+        self.coalesced = 0 # Запросы, слитые с другими в одном кадре или отброшенные ограничением частоты
+
+    def queue(self, name: str):
+        self._pending[name] = self._pending.get(name, 0) + 1
+
+    def drain(self, now: Optional[float] = None):
+        """Проигрывает накопленные за кадр звуки (по одному запуску на имя)."""
+        if not self._pending:
+            return
+        if now is None:
+            now = time.perf_counter()
+        for name, count in self._pending.items():
+            if self.play(name, now):
+                count -= 1
+            self.coalesced += count
+        self._pending.clear()
+
+    def clear(self):
+        self._pending.clear()
+
+    def play(self, name: str, now: Optional[float] = None) -> bool:
+        """Запускает звук сразу (с учетом ограничения частоты). Возвращает True, если звук пошел."""
+        if now is None:
+            now = time.perf_counter()
+        last_played = self._last_played.get(name)
+        if last_played is not None and now - last_played < self.min_intervals.get(name, 0.0):
+            return False
+        sound = assets.get(name)
+        if sound is None:
+            return False
+        channel_index = self._pick_channel()
+        if channel_index is None:
+            return False
+        self._channels[channel_index].play(sound)
+        self._channel_started[channel_index] = now
+        self._last_played[name] = now
+        self.played += 1
+        return True
+
+    def _pick_channel(self) -> Optional[int]:
+        if not self._channels:
+            if not pygame.mixer.get_init():
+                return None
+            if pygame.mixer.get_num_channels() < self.channel_count:
+                pygame.mixer.set_num_channels(self.channel_count)
+            pygame.mixer.set_reserved(self.channel_count) # Sound.play() в обход планировщика их не займет
+            self._channels = [pygame.mixer.Channel(index) for index in range(self.channel_count)]
+            self._channel_started = [0.0] * self.channel_count
+        for index, channel in enumerate(self._channels):
+            if not channel.get_busy():
+                return index
+        return min(range(self.channel_count), key=self._channel_started.__getitem__)
+
+audio = AudioScheduler(AUDIO_CHANNELS, SOUND_MIN_INTERVALS)
+
+def play_sound(name: str):
+    """Звук интерфейса: играет сразу. Для звуков из шага логики - queue_sound."""
+    audio.play(name)
+
+def queue_sound(name: str):
+    """Ставит звук в очередь; очередь проигрывается один раз за кадр (audio.drain)."""
+    audio.queue(name)
+
+def set_sound_volume(name: str, volume: float):
+    assets.set_volume(name, volume)
 
 SURVIVAL_MODE_DURATION = 20
+REPLAY_MOVES = 1000 # Сколько последних ходов доступно в реплее
+LOOKAHEAD_BEAM_WIDTH = 8 # Сколько лучших позиций планировщик оставляет на каждой глубине
+LOOKAHEAD_MAX_DEPTH = 12 # Глубина поиска планировщика в ходах
+LOOKAHEAD_REGION_CAP = 200 # Область из стольких свободных клеток считается достаточной для выживания
+LOOKAHEAD_SLICE_CELLS = 128 # Сколько узлов обхода планировщик раскрывает между проверками времени
+LOOKAHEAD_BUDGET_SHARE = 0.5 # Доля времени шага логики, которую может занять планировщик
+LOOKAHEAD_MIN_SECONDS = 0.001 # Меньше этого времени на шаг - планировщик не запускается
+
+lookahead_enabled = False # Проверка хода автопилота поиском на несколько ходов вперед (--lookahead)
+
+def set_lookahead(enabled: bool):
+    global lookahead_enabled
+    lookahead_enabled = enabled
+
+def lookahead_budget(speed: float) -> float:
+    """Время на планировщик в одном шаге: доля бюджета логики кадра, приходящаяся на шаг при speed шагов в секунду."""
+    if speed <= 0:
+        return 0.0
+    return MAX_LOGIC_TIME_PER_FRAME / speed * LOOKAHEAD_BUDGET_SHARE
 
 # --- Централизованное определение тем ---
 def _generate_tyamba_colors():
@@ -213,15 +1075,107 @@ def set_theme(theme_name):
     for key in default_palette:
         current_colors[key] = new_palette.get(key, default_palette[key])
 
+    _board_background_cache.clear()
+
+def set_grid_size(width, height, cell_size=None):
+    """Меняет размер поля в клетках (и, при необходимости, размер клетки в пикселях)."""
+    global GRID_WIDTH, GRID_HEIGHT, GRIDSIZE
+    GRID_WIDTH, GRID_HEIGHT = width, height
+    if cell_size is not None:
+        GRIDSIZE = cell_size
+    _board_background_cache.clear()
+
+configured_grid_size = (GRID_WIDTH, GRID_HEIGHT) # Поле игр без загруженного состояния (по умолчанию или --grid)
+
+def configure_grid_size(width, height):
+    """Задает размер поля для игр без загруженного состояния и переключается на него."""
+    global configured_grid_size
+    configured_grid_size = (width, height)
+    set_grid_size(width, height)
+
+def use_board_grid(board_state: Optional[Dict[str, Any]]):
+    """
+    Переключает поле перед началом игры: на размер загруженного состояния, а без него - обратно
+    на configured_grid_size, чтобы размер прошлой фикстуры не оставался следующим играм.
+    """
+    width, height = board_state['grid'] if board_state is not None else configured_grid_size
+    if (width, height) != (GRID_WIDTH, GRID_HEIGHT):
+        set_grid_size(width, height)
+
 def draw_object(surface, color, pos):
     rect = pygame.Rect((pos[0] * GRIDSIZE, pos[1] * GRIDSIZE), (GRIDSIZE, GRIDSIZE))
     pygame.draw.rect(surface, color, rect)
 
-def draw_grid(surface):
-    for x in range(0, SCREEN_WIDTH, GRIDSIZE):
-        pygame.draw.line(surface, current_colors['grid'], (x, 0), (x, SCREEN_HEIGHT))
-    for y in range(0, SCREEN_HEIGHT, GRIDSIZE):
-        pygame.draw.line(surface, current_colors['grid'], (0, y), (SCREEN_WIDTH, y))
+def draw_grid(surface, cell_size=None, color=None):
+    if cell_size is None:
+        cell_size = GRIDSIZE
+    width, height = surface.get_size()
+    grid_color = current_colors['grid'] if color is None else color
+    for x in range(0, width, cell_size):
+        pygame.draw.line(surface, grid_color, (x, 0), (x, height))
+    for y in range(0, height, cell_size):
+        pygame.draw.line(surface, grid_color, (0, y), (width, y))
+
+# Фон поля с сеткой, отрисованный один раз: (тема, ширина, высота, размер клетки) -> Surface
+_board_background_cache: Dict[Tuple[str, int, int, int], Surface] = {}
+
+def get_board_background(width=None, height=None, cell_size=None) -> Surface:
+    """Возвращает закэшированную поверхность фона с сеткой текущей темы. Кэш сбрасывается в set_theme."""
+    if width is None:
+        width = GRID_WIDTH * GRIDSIZE
+    if height is None:
+        height = GRID_HEIGHT * GRIDSIZE
+    if cell_size is None:
+        cell_size = GRIDSIZE
+    key = (current_theme, width, height, cell_size)
+    background = _board_background_cache.get(key)
+    if background is None:
+        background = pygame.Surface((width, height))
+        if pygame.display.get_surface() is not None:
+            background = background.convert()
+        background.fill(current_colors['background'])
+        draw_grid(background, cell_size, current_colors['grid'])
+        _board_background_cache[key] = background
+    return background
+
+# --- Реестр шрифтов и кэш отрисованного текста ---
+FONT_FALLBACK_NAME = 'arial'
+TEXT_CACHE_SIZE = 512 # Число отрисованных надписей в LRU-кэше
+
+_font_registry: Dict[Tuple[str, int, bool], Font] = {}
+_text_cache: 'OrderedDict[Tuple[str, int, bool, str, Tuple[int, ...]], Surface]' = OrderedDict()
+
+def get_font(size: int, bold: bool = False, family: str = FONT_NAME_PRIMARY) -> Font:
+    """Шрифт из реестра: системный шрифт ищется один раз на (семейство, размер, жирность)."""
+    key = (family, size, bold)
+    font = _font_registry.get(key)
+    if font is None:
+        try:
+            font = pygame.font.SysFont(family, size, bold=bold)
+        except Exception as e:
+            print(f"Font '{family}' not found, using fallback '{FONT_FALLBACK_NAME}'. Error: {e}")
+            try:
+                font = pygame.font.SysFont(FONT_FALLBACK_NAME, size - 2, bold=bold)
+            except Exception:
+                font = pygame.font.Font(None, size)
+        _font_registry[key] = font
+    return font
+
+def render_text(text: str, size: int, color, bold: bool = False, family: str = FONT_NAME_PRIMARY) -> Surface:
+    """
+    Отрисованная надпись из LRU-кэша. Возвращаемая поверхность общая для всех вызовов:
+    ее можно только блитить (не менять альфу и не рисовать на ней).
+    """
+    key = (family, size, bold, text, tuple(color))
+    text_surf = _text_cache.get(key)
+    if text_surf is None:
+        text_surf = get_font(size, bold, family).render(text, True, color)
+        _text_cache[key] = text_surf
+        if len(_text_cache) > TEXT_CACHE_SIZE:
+            _text_cache.popitem(last=False)
+    else:
+        _text_cache.move_to_end(key)
+    return text_surf
 
 def draw_button(surface, button, base_color, text, is_hovered, is_clicked):
     button_color = base_color
@@ -234,25 +1188,11 @@ def draw_button(surface, button, base_color, text, is_hovered, is_clicked):
     button_rect = pygame.Rect(button)
     pygame.draw.rect(surface, button_color, button_rect, border_radius=8)
 
-    try:
-        font = pygame.font.SysFont(FONT_NAME_PRIMARY, FONT_SIZE_MEDIUM)
-    except:
-        font = pygame.font.SysFont('arial', FONT_SIZE_MEDIUM - 2)
-
-    text_surf = font.render(text, True, current_colors['text_white'])
+    text_surf = render_text(text, FONT_SIZE_MEDIUM, current_colors['text_white'])
     text_rect = text_surf.get_rect(center=button_rect.center)
     text_rect.centery += 3
     surface.blit(text_surf, text_rect)
 
-def draw_path(surface, path):
-    """Отрисовывает предполагаемый путь змейки (для автопилота)."""
-    try:
-        for p in path:
-            draw_object(surface, current_colors['path_visualization'], p)
-    except Exception as e:
-        print(f"Error drawing path: {e}")
-        pass
-
 class Slider:
     def __init__(self, x, y, width, height, min_val, max_val, initial_val, label, power=1.0):
         self.rect = pygame.Rect(x, y, width, height)
@@ -268,10 +1208,6 @@ class Slider:
         self.update_handle_pos()
         self.dragging = False
         self.pending_click = False
-        try:
-            self.font = pygame.font.SysFont(FONT_NAME_PRIMARY, FONT_SIZE_MEDIUM)
-        except:
-            self.font = pygame.font.SysFont('arial', FONT_SIZE_MEDIUM - 2)
 
     def update_handle_pos(self):
         """Обновляет позицию ручки на основе текущего значения self.value с учетом self.power."""
@@ -339,7 +1275,7 @@ class Slider:
             pygame.draw.rect(surface, current_colors['slider_handle'], filled_rect, border_radius=5)
 
         if self.label:
-            label_surf = self.font.render(f"{self.label}: {int(self.value)}", True, current_colors['text'])
+            label_surf = render_text(f"{self.label}: {int(self.value)}", FONT_SIZE_MEDIUM, current_colors['text'])
             label_rect = label_surf.get_rect(midbottom=(self.rect.centerx, self.rect.top - 8))
             surface.blit(label_surf, label_rect)
 
@@ -350,10 +1286,6 @@ class Checkbox:
         self.label = label
         self.label_rect = None
         self.clicked = False
-        try:
-            self.font = pygame.font.SysFont(FONT_NAME_PRIMARY, FONT_SIZE_MEDIUM)
-        except:
-            self.font = pygame.font.SysFont('arial', FONT_SIZE_MEDIUM - 2)
 
     def handle_event(self, event):
         if event.type == pygame.MOUSEBUTTONDOWN:
@@ -376,7 +1308,7 @@ class Checkbox:
             check_margin = 4
             inner_rect = self.rect.inflate(-check_margin * 2, -check_margin * 2)
             pygame.draw.rect(surface, current_colors['checkbox_check'], inner_rect, border_radius=2)
-        label_surf = self.font.render(self.label, True, current_colors['text'])
+        label_surf = render_text(self.label, FONT_SIZE_MEDIUM, current_colors['text'])
         label_rect = label_surf.get_rect()
         label_rect.left = self.rect.right + 10
         label_rect.centery = self.rect.centery + 3
@@ -406,13 +1338,6 @@ class ThemeSelector:
         self.total_height = self.title_height + len(self.themes) * self.item_height + self.padding
         self.rect = pygame.Rect(x, y, width, self.total_height)
         
-        try:
-            self.font = pygame.font.SysFont(FONT_NAME_PRIMARY, FONT_SIZE_MEDIUM)
-            self.title_font = pygame.font.SysFont(FONT_NAME_PRIMARY, FONT_SIZE_MEDIUM, bold=True)
-        except:
-            self.font = pygame.font.SysFont('arial', FONT_SIZE_MEDIUM - 2)
-            self.title_font = pygame.font.SysFont('arial', FONT_SIZE_MEDIUM - 2, bold=True)
-            
         self.theme_previews = self._generate_theme_previews()
         
     def _generate_theme_previews(self):
@@ -440,6 +1365,16 @@ class ThemeSelector:
         
         return previews
     
+    def item_at(self, pos) -> Optional[int]:
+        """Индекс темы под точкой pos или None."""
+        mouse_x, mouse_y = pos
+        current_y = self.y + self.title_height + self.padding
+        for i in range(len(self.themes)):
+            if pygame.Rect(self.x, current_y, self.width, self.item_height).collidepoint(mouse_x, mouse_y):
+                return i
+            current_y += self.item_height
+        return None
+
     def handle_event(self, event):
         """Обрабатывает события клика для выбора темы из списка."""
         if event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
@@ -450,8 +1385,7 @@ class ThemeSelector:
                 if item_rect.collidepoint(mouse_x, mouse_y):
                     self.selected_index = i
                     self.current_theme_name = self.themes[self.selected_index]["name"]
-                    set_theme(self.current_theme_name)
-                    self.theme_previews = self._generate_theme_previews()
+                    set_theme(self.current_theme_name) # Превью от текущей темы не зависят
                     return True
                 current_y += self.item_height
         
@@ -466,7 +1400,7 @@ class ThemeSelector:
             scroll_y: Смещение прокрутки по вертикали
             mouse_pos: Позиция курсора мыши, с учетом прокрутки (если None, используется pygame.mouse.get_pos())
         """
-        title_surf = self.title_font.render("Theme Selection", True, current_colors['text_highlight'])
+        title_surf = render_text("Theme Selection", FONT_SIZE_MEDIUM, current_colors['text_highlight'], bold=True)
         title_rect = title_surf.get_rect(centerx=self.rect.centerx, top=self.rect.top)
         surface.blit(title_surf, title_rect)
         
@@ -494,7 +1428,7 @@ class ThemeSelector:
             text_x = preview_x + self.preview_size + self.padding * 2
             theme_name = theme["title"]
             text_color = current_colors['text_highlight'] if is_selected else current_colors['text']
-            name_surf = self.font.render(theme_name, True, text_color)
+            name_surf = render_text(theme_name, FONT_SIZE_MEDIUM, text_color)
             name_rect = name_surf.get_rect(left=text_x, centery=item_rect.centery)
             surface.blit(name_surf, name_rect)
             
@@ -503,40 +1437,68 @@ class ThemeSelector:
             
             current_y += self.item_height
 
-class PathFind:
-    def __init__(self):
-        self.grid_width = GRID_WIDTH
-        self.grid_height = GRID_HEIGHT
+# --- Таблицы поля для поиска: соседи и расстояния с учетом "зацикленности" ---
+class GridTables:
+    """
+    Таблицы для поля width x height, строятся один раз на размер и общие для всех поисков (grid_tables()).
+    Клетка в поиске - номер y * width + x. neighbors[cell] - кортеж номеров соседей (вверх, вниз, влево,
+    вправо) с переходом через край; xs/ys - координаты клетки; wrap_dx[d]/wrap_dy[d] - расстояние по оси
+    при разнице координат d. Раскрытие узла - только чтение готовых кортежей, без выделения списков.
+    """
 
-    def get_neighbors(self, position: Tuple[int, int]) -> List[Tuple[int, int]]:
-        x, y = position
-        directions = [UP, DOWN, LEFT, RIGHT]
+    def __init__(self, width: int, height: int):
+        self.width = width
+        self.height = height
+        self.cell_count = width * height
+        numbers = list(range(self.cell_count)) # Все таблицы ссылаются на одни и те же объекты int
+        self.xs = list(range(width)) * height
+        self.ys = [numbers[y] for y in range(height) for _ in range(width)]
         neighbors = []
-        for dx, dy in directions:
-            nx, ny = (x + dx) % self.grid_width, (y + dy) % self.grid_height
-            neighbors.append((nx, ny))
-        return neighbors
-
-    def _heuristic(self, pos_a: Tuple[int, int], pos_b: Tuple[int, int]) -> int:
+        for y in range(height):
+            row, up, down = y * width, ((y - 1) % height) * width, ((y + 1) % height) * width
+            for x in range(width):
+                neighbors.append((numbers[up + x], numbers[down + x],
+                                  numbers[row + (x - 1) % width], numbers[row + (x + 1) % width]))
+        self.neighbors: List[Tuple[int, int, int, int]] = neighbors
+        self.wrap_dx = [min(d, width - d) for d in range(width)]
+        self.wrap_dy = [min(d, height - d) for d in range(height)]
+
+    def cell(self, pos: Tuple[int, int]) -> int:
+        return pos[1] * self.width + pos[0]
+
+    def position(self, cell: int) -> Tuple[int, int]:
+        return self.xs[cell], self.ys[cell]
+
+    def distance(self, cell_a: int, cell_b: int) -> int:
         """Манхэттенское расстояние с учетом 'зацикленности' поля."""
-        ax, ay = pos_a
-        bx, by = pos_b
+        return (self.wrap_dx[abs(self.xs[cell_a] - self.xs[cell_b])] +
+                self.wrap_dy[abs(self.ys[cell_a] - self.ys[cell_b])])
 
-        dx = abs(ax - bx)
-        dist_x = min(dx, self.grid_width - dx)
+_grid_tables_cache: Dict[Tuple[int, int], GridTables] = {}
 
-        dy = abs(ay - by)
-        dist_y = min(dy, self.grid_height - dy)
+def grid_tables(width: Optional[int] = None, height: Optional[int] = None) -> GridTables:
+    """Таблицы для поля заданного (по умолчанию - текущего) размера."""
+    key = (GRID_WIDTH if width is None else width, GRID_HEIGHT if height is None else height)
+    tables = _grid_tables_cache.get(key)
+    if tables is None:
+        tables = _grid_tables_cache[key] = GridTables(*key)
+    return tables
 
-        return dist_x + dist_y
+class PathFind:
+    def __init__(self):
+        self.grid_width = GRID_WIDTH
+        self.grid_height = GRID_HEIGHT
+        self.tables = grid_tables(GRID_WIDTH, GRID_HEIGHT)
+        self.expansions = 0 # Сколько узлов раскрыл A* за все время (для метрик)
 
-    def reconstruct_path(self, came_from: Dict[Tuple[int, int], Optional[Tuple[int, int]]], goal_node: Tuple[int, int]) -> List[Tuple[int, int]]:
-        """Восстанавливает путь от цели к старту по словарю came_from."""
+    def reconstruct_path(self, came_from: Dict[int, Optional[int]], goal_node: int) -> List[Tuple[int, int]]:
+        """Восстанавливает путь от цели к старту по словарю came_from (номера клеток) в координатах."""
+        xs, ys = self.tables.xs, self.tables.ys
         path = []
-        current_pos = goal_node
-        while current_pos is not None:
-            path.append(current_pos)
-            current_pos = came_from.get(current_pos)
+        current_cell = goal_node
+        while current_cell is not None:
+            path.append((xs[current_cell], ys[current_cell]))
+            current_cell = came_from.get(current_cell)
         path.reverse()
         return path
 
@@ -548,57 +1510,361 @@ class PathFind:
         is_target_food влияет только на то, как будет интерпретирован путь в вызывающем коде
         (например, для is_path_safe_to_food), сам поиск пути A* не меняется.
         """
+        tables = self.tables
+        neighbors, xs, ys = tables.neighbors, tables.xs, tables.ys
+        wrap_dx, wrap_dy = tables.wrap_dx, tables.wrap_dy
+        width = self.grid_width
+        start_cell = start[1] * width + start[0]
+        goal_cell = goal[1] * width + goal[0]
+        goal_x, goal_y = goal
+
         snake_length = len(snake_positions)
-        # Оптимизация: Преобразование в set для быстрой проверки принадлежности
-        snake_body_indices = {pos: i for i, pos in enumerate(snake_positions)}
-        obstacles_set = set(snake_positions) # Для быстрой проверки статических препятствий
+        # Через сколько ходов освободится клетка тела: сегмент i уходит вместе с хвостом
+        # через snake_length - i ходов (при повторе клетки берется сегмент ближе к хвосту)
+        free_after = {y * width + x: snake_length - i for i, (x, y) in enumerate(snake_positions)}
 
-        open_set_heap = [(self._heuristic(start, goal), 0, start)]
-        came_from: Dict[Tuple[int, int], Optional[Tuple[int, int]]] = {start: None}
-        g_score: Dict[Tuple[int, int], float] = {start: 0}
+        open_set_heap = [(tables.distance(start_cell, goal_cell), 0, start_cell)]
+        came_from: Dict[int, Optional[int]] = {start_cell: None}
+        g_score: Dict[int, int] = {start_cell: 0}
         # Множество для хранения узлов в open_set_heap для быстрой проверки
-        open_set_nodes = {start} 
+        open_set_nodes = {start_cell}
 
         while open_set_heap:
             # Извлекаем узел с наименьшей f_cost
-            current_f_cost, current_g_cost, current_pos = heapq.heappop(open_set_heap)
-            open_set_nodes.remove(current_pos) # Удаляем из множества
-
-            if current_pos == goal:
-                return self.reconstruct_path(came_from, goal)
-
-            for neighbor_pos in self.get_neighbors(current_pos):
-                tentative_g_cost = current_g_cost + 1
-
-                # Проверка на столкновение с движущимся хвостом
-                is_collision = False
-                if neighbor_pos in snake_body_indices:
-                    segment_index = snake_body_indices[neighbor_pos]
-                    # Столкновение, если время достижения клетки (tentative_g_cost)
-                    # меньше времени, когда хвост освободит эту клетку (snake_length - segment_index)
-                    if tentative_g_cost < snake_length - segment_index:
-                        is_collision = True
-
-                # Если нет столкновения с хвостом, проверяем дальше
-                if not is_collision:
-                    # Проверяем, лучше ли этот путь, чем предыдущий найденный к соседу
-                    if tentative_g_cost < g_score.get(neighbor_pos, float('inf')):
-                        came_from[neighbor_pos] = current_pos
-                        g_score[neighbor_pos] = tentative_g_cost
-                        f_cost = tentative_g_cost + self._heuristic(neighbor_pos, goal)
-                        # Добавляем в кучу и множество, только если его там еще нет или новый путь лучше
-                        if neighbor_pos not in open_set_nodes:
-                            heapq.heappush(open_set_heap, (f_cost, tentative_g_cost, neighbor_pos))
-                            open_set_nodes.add(neighbor_pos)
-                        # Если узел уже в куче, но мы нашли лучший путь - нужно обновить его приоритет.
-                        # Прямое обновление приоритета в heapq сложно, проще добавить новый узел.
-                        # Старый узел с худшим приоритетом останется, но будет извлечен позже и проигнорирован,
-                        # так как g_score[neighbor_pos] уже будет обновлен на меньшее значение.
-                        # (Это стандартный подход при работе с heapq без поддержки decrease-key)
-
+            current_f_cost, current_g_cost, current_cell = heapq.heappop(open_set_heap)
+            open_set_nodes.remove(current_cell) # Удаляем из множества
+            self.expansions += 1
+
+            if current_cell == goal_cell:
+                return self.reconstruct_path(came_from, goal_cell)
+
+            tentative_g_cost = current_g_cost + 1
+            for neighbor_cell in neighbors[current_cell]:
+                # Столкновение, если змейка придет в клетку раньше, чем ее освободит хвост
+                if tentative_g_cost < free_after.get(neighbor_cell, 0):
+                    continue
+                # Проверяем, лучше ли этот путь, чем предыдущий найденный к соседу
+                if tentative_g_cost < g_score.get(neighbor_cell, tentative_g_cost + 1):
+                    came_from[neighbor_cell] = current_cell
+                    g_score[neighbor_cell] = tentative_g_cost
+                    f_cost = tentative_g_cost + wrap_dx[abs(xs[neighbor_cell] - goal_x)] + wrap_dy[abs(ys[neighbor_cell] - goal_y)]
+                    # Добавляем в кучу и множество, только если его там еще нет или новый путь лучше
+                    if neighbor_cell not in open_set_nodes:
+                        heapq.heappush(open_set_heap, (f_cost, tentative_g_cost, neighbor_cell))
+                        open_set_nodes.add(neighbor_cell)
+                    # Если узел уже в куче, но мы нашли лучший путь - нужно обновить его приоритет.
+                    # Прямое обновление приоритета в heapq сложно, проще добавить новый узел.
+                    # Старый узел с худшим приоритетом останется, но будет извлечен позже и проигнорирован,
+                    # так как g_score[neighbor_cell] уже будет обновлен на меньшее значение.
+                    # (Это стандартный подход при работе с heapq без поддержки decrease-key)
 
         return [] # Путь не найден
 
+    def distance_field(self, start: Tuple[int, int], body_cells: Iterable[int]) -> 'DistanceField':
+        """Ленивое поле расстояний от start для тела body_cells (номера клеток от головы к хвосту)."""
+        return DistanceField(self, self.tables.cell(start), body_cells)
+
+class DistanceField:
+    """
+    Расстояния (в ходах) от клетки start до клеток поля: один обход в ширину с учетом движения тела.
+    Клетка тела проходима, если змейка придет в нее не раньше, чем ее освободит хвост - как в find_path,
+    поэтому длина пути отсюда совпадает с длиной пути A*. Обход ленивый: запрос расстояния раскрывает
+    узлы только до нужной клетки, следующие запросы продолжают с того же места, а размер достижимой
+    области дообходит поле до конца. Одно поле за ход заменяет отдельные поиски к еде, хвосту и циклу.
+    """
+
+    def __init__(self, path_find: 'PathFind', start_cell: int, body_cells: Iterable[int] = (),
+                 free_after: Optional[Dict[int, int]] = None, start_level: int = 0):
+        """
+        Тело задается списком body_cells или готовым словарем free_after; start_level - ход, на котором
+        змейка стоит в start (для позиций, отстоящих от текущей на несколько ходов), от него же считаются dist.
+        """
+        self.path_find = path_find
+        self.tables = path_find.tables
+        if free_after is None:
+            body_cells = list(body_cells)
+            length = len(body_cells)
+            # Через сколько ходов освободится клетка тела (от головы к хвосту: length, ..., 1)
+            free_after = {cell: length - i for i, cell in enumerate(body_cells)}
+        self.free_after = free_after
+        self.dist: Dict[int, int] = {start_cell: start_level}
+        self.parent: Dict[int, Optional[int]] = {start_cell: None}
+        self.start_cell = start_cell
+        self._frontier = [start_cell] # Клетки последнего раскрытого уровня (расстояние _level)
+        self._level = start_level
+        self._start_level = start_level
+        self._body_reached = 1 if free_after.get(start_cell, 0) > start_level else 0 # Достигнутые клетки тела
+
+    def _expand(self, stop_cell: Optional[int] = None, empty_limit: Optional[int] = None, max_expanded: Optional[int] = None):
+        """
+        Раскрывает уровни обхода, пока не найдено расстояние до stop_cell или не достигнуто
+        empty_limit свободных клеток (без ограничений - до конца). С max_expanded останавливается
+        после уровня, на котором раскрыто столько узлов: следующий вызов продолжит с того же места.
+        """
+        neighbors = self.tables.neighbors
+        free_after, dist, parent = self.free_after, self.dist, self.parent
+        frontier, level, start_level = self._frontier, self._level, self._start_level
+        expanded = body_reached = 0
+        if empty_limit is None:
+            empty_limit = self.tables.cell_count + 1
+        if max_expanded is None:
+            max_expanded = self.tables.cell_count + 1
+        while (frontier and stop_cell not in dist and len(dist) - self._body_reached - body_reached < empty_limit
+               and expanded < max_expanded):
+            level += 1
+            next_frontier = []
+            for cell in frontier:
+                for neighbor_cell in neighbors[cell]:
+                    if neighbor_cell not in dist:
+                        wait = free_after.get(neighbor_cell, 0)
+                        if level >= wait:
+                            dist[neighbor_cell] = level
+                            parent[neighbor_cell] = cell
+                            next_frontier.append(neighbor_cell)
+                            if wait > start_level:
+                                body_reached += 1
+            expanded += len(frontier)
+            frontier = next_frontier
+        self._frontier, self._level = frontier, level
+        self._body_reached += body_reached
+        self.path_find.expansions += expanded
+
+    @property
+    def complete(self) -> bool:
+        """Обход дошел до конца: все достижимые клетки найдены."""
+        return not self._frontier
+
+    def distance(self, pos: Tuple[int, int], max_expanded: Optional[int] = None) -> Optional[int]:
+        """
+        Число ходов до pos или None, если клетка недостижима. С max_expanded (см. _expand) None
+        значит "пока не найдена", если обход еще не complete.
+        """
+        cell = self.tables.cell(pos)
+        self._expand(cell, max_expanded=max_expanded)
+        return self.dist.get(cell)
+
+    def path_to(self, pos: Tuple[int, int]) -> List[Tuple[int, int]]:
+        """Кратчайший путь от start до pos включительно (как find_path) или [], если пути нет."""
+        cell = self.tables.cell(pos)
+        self._expand(cell)
+        if cell not in self.dist:
+            return []
+        xs, ys, parent = self.tables.xs, self.tables.ys, self.parent
+        path = []
+        while cell is not None:
+            path.append((xs[cell], ys[cell]))
+            cell = parent[cell]
+        path.reverse()
+        return path
+
+    def reachable_empty(self, limit: Optional[int] = None, max_expanded: Optional[int] = None) -> int:
+        """
+        Сколько свободных сейчас клеток змейка может достичь (с учетом освобождающихся клеток тела).
+        С limit обход останавливается, набрав limit клеток, и результат не больше limit;
+        с max_expanded (см. _expand) это число найденных пока клеток, если обход еще не complete.
+        """
+        self._expand(empty_limit=limit, max_expanded=max_expanded)
+        reached = len(self.dist) - self._body_reached
+        return reached if limit is None else min(reached, limit)
+
+class LookaheadPlanner:
+    """
+    Поиск по лучу на несколько ходов вперед для автопилота. Позиция поиска - путь головы от корня
+    (позиции, с которой поиск начат) и момент поедания еды; тело не копируется. Время считается в ходах
+    от корня за вычетом роста: клетка тела свободна с хода free_after, клетка, в которую голова вошла
+    на ходу s, - с хода s + длина. Позиция оценивается полем расстояний (достижимая область до
+    LOOKAHEAD_REGION_CAP клеток и путь до хвоста); на каждой глубине остаются beam_width лучших, причем
+    лучшая позиция для каждого следующего хода - всегда.
+
+    Поиск возобновляемый: это генератор, advance(deadline) продолжает его с места остановки, так что
+    поиск, не уложившийся в шаг, идет дальше в следующих кадрах. Тем временем змейка ходит по выбору
+    автопилота; сделанные ходы (observe) отсекают несовпадающие позиции, а suggest советует ход после
+    них по последней полностью пройденной глубине.
+    """
+
+    DIRECTIONS = (UP, DOWN, LEFT, RIGHT) # В порядке GridTables.neighbors; обратный к i - i ^ 1
+
+    def __init__(self, path_find: PathFind, beam_width: int = LOOKAHEAD_BEAM_WIDTH, max_depth: int = LOOKAHEAD_MAX_DEPTH):
+        self.path_find = path_find
+        self.beam_width = beam_width
+        self.max_depth = max_depth
+        self.last_depth = 0 # Последняя полностью пройденная глубина текущего поиска
+        self.overrides = 0 # Сколько раз планировщик заменил ход автопилота
+        self._search: Optional[Iterator[None]] = None # Генератор идущего поиска (None - завершен или не начат)
+        self._played: Tuple[int, ...] = () # Клетки, в которые змейка пошла после корня поиска
+        self._beam: List[tuple] = [] # (оценка, позиция) последней пройденной глубины
+        self._selected_at: List[int] = [] # Сколько ходов было сделано при отборе луча на каждой глубине
+        self._started = False
+        self._finished_at = 0 # Сколько ходов было сделано к завершению поиска
+
+    def reset(self):
+        """Забывает поиск (тело змейки заменено или еда переместилась)."""
+        self._search = None
+        self._played = ()
+        self._beam = []
+        self._selected_at = []
+        self._started = False
+        self._finished_at = 0
+        self.last_depth = 0
+
+    def start(self, body: 'SnakeBody', free_after: Dict[int, int], direction: Tuple[int, int], food_pos: Optional[Tuple[int, int]]):
+        """
+        Начинает поиск от текущей позиции. free_after - словарь освобождения клеток тела из поля
+        расстояний хода; поиск забирает его себе (на время оценок меняет и восстанавливает).
+        """
+        self.reset()
+        self._search = self._run(body.cell_indices(), free_after, direction, food_pos)
+        self._started = True
+
+    def needs_restart(self) -> bool:
+        """Поиск пора начать заново: не начат, завершен и уже использован, отстал или разошелся с ходами змейки."""
+        if not self._started:
+            return True
+        played = len(self._played)
+        if (self._search is None and played > self._finished_at) or played > self.max_depth // 2:
+            return True
+        return bool(self._beam) and not any(self._matches(node[1]) for _, node in self._beam)
+
+    def advance(self, deadline: float) -> bool:
+        """Продолжает поиск до срока deadline. True, если поиск завершен."""
+        search = self._search
+        if search is None:
+            return True
+        clock = time.perf_counter
+        if clock() >= deadline:
+            return False
+        for _ in search:
+            if clock() >= deadline:
+                return False
+        self._search = None
+        self._finished_at = len(self._played)
+        return True
+
+    def observe(self, cell: int, ate: bool):
+        """Змейка сделала ход в клетку cell. Съеденная еда переместится - такой поиск уже не годится."""
+        if ate:
+            self.reset()
+        elif self._started:
+            self._played += (cell,)
+
+    def suggest(self, preferred: Tuple[int, int]) -> Tuple[int, int]:
+        """
+        Совет для хода после сделанных: preferred (выбор автопилота), если после него есть
+        жизнеспособное продолжение, иначе - ход лучшей найденной позиции. Без результатов - preferred.
+        """
+        k = len(self._played)
+        best: Dict[Tuple[int, int], tuple] = {}
+        for score, node in self._beam:
+            if len(node[1]) > k and self._matches(node[1]):
+                move = self.DIRECTIONS[node[2][k]]
+                if move not in best or score > best[move]:
+                    best[move] = score
+        # Отсутствие preferred в луче значит, что после него не выжить, только если на всех глубинах
+        # дальше сделанных ходов луч отбирался с лучшей позицией для каждого хода после тех же k ходов
+        if preferred not in best and any(played != k for played in self._selected_at[k:]):
+            return preferred
+        return self._decide(best, preferred)
+
+    def _matches(self, path: Tuple[int, ...]) -> bool:
+        """Совпадает ли путь позиции со сделанными ходами (на общей длине)."""
+        n = min(len(path), len(self._played))
+        return path[:n] == self._played[:n]
+
+    def _run(self, body_cells: array, free_after: Dict[int, int], direction: Tuple[int, int],
+             food_pos: Optional[Tuple[int, int]]) -> Iterator[None]:
+        """Сам поиск по глубинам; уступает управление после оценки каждой позиции."""
+        tables = self.path_find.tables
+        neighbors = tables.neighbors
+        length = len(body_cells)
+        food_cell = tables.cell(food_pos) if food_pos is not None else -1
+        directions = self.DIRECTIONS
+        root_reverse = directions.index(direction) ^ 1 if length > 1 and direction in directions else -1
+
+        # Позиция: (голова, путь головы, индексы направлений ходов, {клетка: ход входа}, ход поедания или 0)
+        beam = [(body_cells[0], (), (), {}, 0)]
+        for depth in range(1, self.max_depth + 1):
+            children = []
+            for head, path, moves, entries, eaten_at in beam:
+                if not self._matches(path):
+                    continue
+                played = self._played
+                reverse = moves[-1] ^ 1 if moves else root_reverse
+                for index, cell in enumerate(neighbors[head]):
+                    if index == reverse or (depth <= len(played) and cell != played[depth - 1]):
+                        continue
+                    eats = not eaten_at and cell == food_cell
+                    now = depth - (1 if eaten_at or eats else 0)
+                    entered = entries.get(cell)
+                    if now < (free_after.get(cell, 0) if entered is None else entered + length):
+                        continue
+                    child = (cell, path + (cell,), moves + (index,), {**entries, cell: depth}, depth if eats else eaten_at)
+                    score = yield from self._evaluate(child, depth, body_cells, free_after, food_cell)
+                    children.append((score, child))
+                    yield
+            if not children:
+                return
+            children.sort(key=lambda child: child[0], reverse=True)
+            # Лучшая позиция для каждого следующего хода змейки остается в луче в любом случае
+            k = len(self._played)
+            leaders: Dict[Optional[int], int] = {}
+            for i, (_, node) in enumerate(children):
+                leaders.setdefault(node[2][k] if len(node[2]) > k else None, i)
+            kept = sorted(leaders.values())
+            others = [i for i in range(len(children)) if i not in leaders.values()]
+            kept += others[:max(0, self.beam_width - len(kept))]
+            self._beam = [children[i] for i in kept]
+            self._selected_at.append(k)
+            beam = [node for _, node in self._beam]
+            self.last_depth = depth
+
+    def _evaluate(self, node: tuple, depth: int, body_cells: array, free_after: Dict[int, int], food_cell: int) -> Iterator[None]:
+        """
+        Оценка позиции: (жизнеспособна, достижимая область, еда съедена, -расстояние до еды) - результат
+        генератора. Обход поля идет кусками по LOOKAHEAD_SLICE_CELLS узлов с уступкой управления между ними.
+        """
+        head, path, _, entries, eaten_at = node
+        grown = 1 if eaten_at else 0
+        length = len(body_cells)
+        # Клетки пути на время оценки вписываются в free_after, затем прежние значения возвращаются
+        saved = [(cell, free_after.get(cell)) for cell in entries]
+        for cell, entered in entries.items():
+            free_after[cell] = entered + length
+        try:
+            field = DistanceField(self.path_find, head, free_after=free_after, start_level=depth - grown)
+            # Достаточно области длиной в змейку, но не больше LOOKAHEAD_REGION_CAP и всех свободных клеток
+            limit = min(length + grown, LOOKAHEAD_REGION_CAP, self.path_find.tables.cell_count - length - grown)
+            region = field.reachable_empty(limit, LOOKAHEAD_SLICE_CELLS)
+            while region < limit and not field.complete:
+                yield
+                region = field.reachable_empty(limit, LOOKAHEAD_SLICE_CELLS)
+            viable = region >= limit
+            if not viable:
+                tail_entered = depth - length - grown + 1 # Ход, на котором голова вошла в нынешний хвост
+                tail = self.path_find.tables.position(path[tail_entered - 1] if tail_entered > 0 else body_cells[-tail_entered])
+                tail_distance = field.distance(tail, LOOKAHEAD_SLICE_CELLS)
+                while tail_distance is None and not field.complete:
+                    yield
+                    tail_distance = field.distance(tail, LOOKAHEAD_SLICE_CELLS)
+                viable = tail_distance is not None
+        finally:
+            for cell, wait in saved:
+                if wait is None:
+                    del free_after[cell]
+                else:
+                    free_after[cell] = wait
+        food_distance = 0 if grown or food_cell < 0 else self.path_find.tables.distance(head, food_cell)
+        return (viable, region, grown, -food_distance)
+
+    @staticmethod
+    def _decide(completed: Dict[Tuple[int, int], tuple], preferred: Tuple[int, int]) -> Tuple[int, int]:
+        """Ход по лучшим оценкам для каждого хода: preferred, если он жизнеспособен (или жизнеспособных нет вовсе)."""
+        if not completed:
+            return preferred
+        viable = [first for first, score in completed.items() if score[0]]
+        if preferred in viable or (not viable and preferred in completed):
+            return preferred
+        return max(viable or completed, key=completed.get)
+
 def generate_accordion_snake(percentage: int, grid_width: int, grid_height: int) -> Tuple[Deque[Tuple[int, int]], Tuple[int, int]]:
     """Генерирует начальную позицию змейки 'гармошкой' заданной длины."""
     target_length = max(1, int((grid_width * grid_height) * percentage / 100))
@@ -663,28 +1929,205 @@ def generate_accordion_snake(percentage: int, grid_width: int, grid_height: int)
 
     return positions, direction
 
+GRADIENT_LUT_SIZE = 64 # Число ступеней градиента тела змейки
+
+# Таблицы цветов градиента по темам: строятся один раз на тему
+_gradient_lut_cache: Dict[str, List[pygame.Color]] = {}
+
+def get_gradient_lut(theme_name=None) -> List[pygame.Color]:
+    """Возвращает таблицу цветов градиента голова -> тело -> хвост для темы."""
+    if theme_name is None:
+        theme_name = current_theme
+    lut = _gradient_lut_cache.get(theme_name)
+    if lut is None:
+        palette = current_colors if theme_name == current_theme else THEME_DEFINITIONS[theme_name]["palette"]
+        head_color = palette['snake_head_gradient']
+        body_color = palette['snake']
+        tail_color = palette['snake_tail']
+        lut = []
+        for step in range(GRADIENT_LUT_SIZE):
+            progress = step / GRADIENT_LUT_SIZE
+            if progress < 0.5:
+                lut.append(head_color.lerp(body_color, progress / 0.5))
+            else:
+                lut.append(body_color.lerp(tail_color, (progress - 0.5) / 0.5))
+        _gradient_lut_cache[theme_name] = lut
+    return lut
+
+def gradient_step(index: int, num_segments: int) -> int:
+    """Ступень градиента для сегмента index (1..num_segments-1) по его относительной позиции."""
+    return (index - 1) * GRADIENT_LUT_SIZE // (num_segments - 1)
+
+def gradient_boundaries(num_segments: int) -> List[int]:
+    """Индексы сегментов, с которых начинается каждая ступень градиента, кроме первой."""
+    if num_segments < 2:
+        return []
+    span = num_segments - 1
+    return [-(-step * span // GRADIENT_LUT_SIZE) + 1 for step in range(1, GRADIENT_LUT_SIZE)]
+
+class SnakeBody:
+    """
+    Тело змейки: кольцевой буфер номеров клеток (y * ширина + x) и счетчик сегментов на каждой
+    клетке поля. Новая голова, снятие хвоста и проверка "клетка под телом" - O(1).
+    Снаружи ведет себя как прежний deque координат от головы к хвосту:
+    body[0] - голова, body[-1] - хвост, pos in body, перебор и len.
+    """
+
+    def __init__(self, positions: Iterable[Tuple[int, int]] = (), width: Optional[int] = None, height: Optional[int] = None):
+        self.width = GRID_WIDTH if width is None else width
+        self.height = GRID_HEIGHT if height is None else height
+        cells = [y * self.width + x for x, y in positions]
+        self._capacity = max(len(cells), self.width * self.height) + 1
+        self._ring = array('i', [0]) * self._capacity
+        self._occupancy = bytearray(self.width * self.height)
+        self._head = -1 # Индекс головы в кольце; хвост - на (длина - 1) позиций раньше
+        self._length = 0
+        for cell in reversed(cells):
+            self._push_cell(cell)
+
+    def _push_cell(self, cell: int):
+        if self._length == self._capacity:
+            self._grow()
+        self._head = (self._head + 1) % self._capacity
+        self._ring[self._head] = cell
+        self._occupancy[cell] += 1
+        self._length += 1
+
+    def _grow(self):
+        """Удваивает кольцо (нужно, только если змейка длиннее поля, например после победного хода)."""
+        cells = self.cell_indices()
+        cells.reverse()
+        self._ring = cells + array('i', [0]) * self._capacity
+        self._capacity *= 2
+        self._head = len(cells) - 1
+
+    def appendleft(self, pos: Tuple[int, int]):
+        """Добавляет новую голову."""
+        self._push_cell(pos[1] * self.width + pos[0])
+
+    def pop(self) -> Tuple[int, int]:
+        """Снимает и возвращает хвост."""
+        if not self._length:
+            raise IndexError("pop from an empty SnakeBody")
+        cell = self._ring[(self._head - self._length + 1) % self._capacity]
+        self._occupancy[cell] -= 1
+        self._length -= 1
+        return cell % self.width, cell // self.width
+
+    def occupies(self, cell: int) -> bool:
+        """Лежит ли сегмент в клетке с номером cell (y * ширина + x)."""
+        return self._occupancy[cell] != 0
+
+    def count(self, pos: Tuple[int, int]) -> int:
+        """Сколько сегментов лежит в клетке (больше одного - только при самопересечении)."""
+        return self._occupancy[pos[1] * self.width + pos[0]]
+
+    def cell_indices(self) -> array:
+        """Номера клеток от головы к хвосту (копия)."""
+        if not self._length:
+            return array('i')
+        start = (self._head - self._length + 1) % self._capacity
+        if start <= self._head:
+            cells = self._ring[start:self._head + 1]
+        else:
+            cells = self._ring[start:] + self._ring[:self._head + 1]
+        cells.reverse()
+        return cells
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __contains__(self, pos: Tuple[int, int]) -> bool:
+        return self._occupancy[pos[1] * self.width + pos[0]] != 0
+
+    def __getitem__(self, index: int) -> Tuple[int, int]:
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError("SnakeBody index out of range")
+        cell = self._ring[(self._head - index) % self._capacity]
+        return cell % self.width, cell // self.width
+
+    def __iter__(self) -> Iterator[Tuple[int, int]]:
+        width = self.width
+        for cell in self.cell_indices():
+            yield cell % width, cell // width
+
+    def __repr__(self) -> str:
+        return f"SnakeBody({list(self)!r})"
+
+class MoveHistory:
+    """
+    Последние ходы змейки для реплея. Вместо копии всего тела на каждом шаге хранится только
+    изменение: новая голова, снятый хвост (None, если змейка выросла) и еда на этом ходу.
+    snapshot() фиксирует текущее тело; по снимку состояния восстанавливаются откатом ходов.
+    """
+
+    def __init__(self, maxlen: int):
+        self.moves: Deque[Tuple[Tuple[int, int], Optional[Tuple[int, int]], Optional[Tuple[int, int]]]] = deque(maxlen=maxlen)
+        self.final_body: Optional[List[Tuple[int, int]]] = None
+
+    def record(self, new_head: Tuple[int, int], removed_tail: Optional[Tuple[int, int]], food_pos: Optional[Tuple[int, int]]):
+        self.moves.append((new_head, removed_tail, food_pos))
+
+    def clear(self):
+        self.moves.clear()
+
+    def snapshot(self, body: Iterable[Tuple[int, int]]) -> 'MoveHistory':
+        """Копия истории вместе с текущим телом: состояния 0..len-1 - до каждого хода и после последнего."""
+        frozen = MoveHistory(self.moves.maxlen)
+        frozen.moves.extend(self.moves)
+        frozen.final_body = list(body)
+        return frozen
+
+    def __len__(self) -> int:
+        if self.final_body is None or not self.moves:
+            return 0
+        return len(self.moves) + 1
+
+    def __getitem__(self, index: int) -> Tuple[List[Tuple[int, int]], Optional[Tuple[int, int]]]:
+        """(тело от головы к хвосту, еда) для состояния index снимка."""
+        if not 0 <= index < len(self):
+            raise IndexError("MoveHistory index out of range")
+        moves = self.moves
+        body = deque(self.final_body)
+        for _, removed_tail, _ in itertools.islice(reversed(moves), len(moves) - index):
+            body.popleft()
+            if removed_tail is not None:
+                body.append(removed_tail)
+        food_pos = moves[index][2] if index < len(moves) else moves[-1][2]
+        return list(body), food_pos
+
 class Snake:
     def __init__(self, mode='manual', initial_fill_percentage=0):
         self.length = 1
         initial_pos = ((GRID_WIDTH) // 2, (GRID_HEIGHT) // 2)
-        self.positions: Deque[Tuple[int, int]] = deque([initial_pos])
+        self.positions = SnakeBody([initial_pos])
         self.direction = random.choice([UP, DOWN, LEFT, RIGHT])
         self.color = current_colors['snake']
         self.mode = mode
         self.next_direction = self.direction
-        self.path = []
         self.path_find = PathFind()
+        self.planner = LookaheadPlanner(self.path_find)
         self.speed = 10
-        self.history: deque[Tuple[List[Tuple[int, int]], Optional[Tuple[int, int]]]] = deque(maxlen=1001)
+        self.history = MoveHistory(REPLAY_MOVES)
         self.current_food_pos = None
         self.recalculate_path = True
-        self.current_path: List[Tuple[int, int]] = []
-        self.positions_set: set[Tuple[int, int]] = set(self.positions)
+        self.current_path: Deque[Tuple[int, int]] = deque()
+        self.path_cells: Set[Tuple[int, int]] = set() # Клетки current_path для отрисовки пути
         self.survival_mode_steps_remaining = 0
-        self._segments_colors_cache = []
-        self._last_cache_segments = 0
-        self._colors_theme_cache = current_theme
-        self._neighboring_segments_cache: Dict[Tuple[int, int], Set[Tuple[int, int]]] = {}
+        self._head_field: Optional[DistanceField] = None # Поле расстояний от головы на текущем ходу
+        self._gradient_lut = get_gradient_lut()
+        # Порядковые номера сегментов по клеткам: индекс сегмента = _head_serial - номер
+        self._cell_serials: Dict[Tuple[int, int], int] = {}
+        self._head_serial = 0
+        # Журнал изменений для BoardRenderer (клетки, вид которых мог поменяться)
+        self._dirty_cells: Set[Tuple[int, int]] = set()
+        self._needs_full_redraw = True
+        self._steps_since_redraw = 0
+        self._drawn_length = 0
+        self._layer: Optional[Surface] = None
+        self._layer_theme: Optional[str] = None
         self.hamiltonian_path: List[Tuple[int, int]] = self._generate_hamiltonian_cycle_path()
 
         if initial_fill_percentage > 0:
@@ -692,126 +2135,168 @@ class Snake:
                 initial_fill_percentage, GRID_WIDTH, GRID_HEIGHT
             )
             if generated_positions:
-                self.positions = generated_positions
+                self.positions = SnakeBody(generated_positions)
                 self.length = len(generated_positions)
                 self.direction = generated_direction
                 self.next_direction = generated_direction
-                self.positions_set = set(self.positions)
             else:
                  print(f"Warning: Failed to generate snake for {initial_fill_percentage}%, starting with default.")
-    
-    def _update_colors_cache(self, num_segments):
-        """Обновляет кэш цветов для сегментов змейки."""
-        if (num_segments != self._last_cache_segments or 
-            self._colors_theme_cache != current_theme):
-            
-            self._segments_colors_cache = []
-            head_color = current_colors['snake_head_gradient']
-            body_color = current_colors['snake']
-            tail_color = current_colors['snake_tail']
-            
-            for i in range(1, num_segments):
-                progress = (i - 1) / (num_segments - 1) if num_segments > 1 else 0
-                segment_color = pygame.Color(0, 0, 0)
-                
-                if progress < 0.5:
-                    local_progress = progress / 0.5
-                    segment_color = head_color.lerp(body_color, local_progress)
-                else:
-                    local_progress = (progress - 0.5) / 0.5
-                    segment_color = body_color.lerp(tail_color, local_progress)
-                
-                self._segments_colors_cache.append(segment_color)
-            
-            self._last_cache_segments = num_segments
-            self._colors_theme_cache = current_theme
-            
-    def _update_neighboring_segments_cache(self):
-        """Обновляет кэш соседних сегментов (оптимизированная версия)."""
-        self._neighboring_segments_cache = {}
-        num_segments = len(self.positions)
-        if num_segments <= 1:
-            return # Нет соседей для змейки из 0 или 1 сегмента
 
-        # Используем итератор для эффективного доступа к соседним элементам
-        iter_pos = iter(self.positions)
+        self._rebuild_cell_serials()
+
+    def set_body(self, positions: Iterable[Tuple[int, int]]):
+        """Заменяет тело целиком (координаты от головы к хвосту)."""
+        self.positions = SnakeBody(positions)
+        self.length = len(self.positions)
+        self.planner.reset()
+        self._rebuild_cell_serials()
+
+    def _rebuild_cell_serials(self):
+        """Пересчитывает номера сегментов по клеткам после полной замены self.positions."""
+        self._head_serial = len(self.positions) - 1
+        self._cell_serials = {}
+        # От хвоста к голове: при повторе клетки побеждает сегмент ближе к голове
+        for serial, pos in enumerate(reversed(self.positions)):
+            self._cell_serials[pos] = serial
+        self._needs_full_redraw = True
+
+    def _mark_cell_dirty(self, pos: Tuple[int, int]):
+        """Отмечает клетку и соседей слева/сверху, чьи внутренние границы от нее зависят."""
+        x, y = pos
+        self._dirty_cells.add(pos)
+        self._dirty_cells.add(((x - 1) % GRID_WIDTH, y))
+        self._dirty_cells.add((x, (y - 1) % GRID_HEIGHT))
+
+    def pop_dirty_cells(self) -> Optional[Set[Tuple[int, int]]]:
+        """
+        Возвращает клетки, вид которых мог измениться с прошлого вызова,
+        или None, если змейку нужно перерисовать целиком.
+        """
+        num_segments = len(self.positions)
+        steps = self._steps_since_redraw
+        self._steps_since_redraw = 0
+
+        if self._needs_full_redraw:
+            self._needs_full_redraw = False
+            self._dirty_cells = set()
+            self._drawn_length = num_segments
+            return None
+
+        dirty = self._dirty_cells
+        self._dirty_cells = set()
+
+        old_boundaries = gradient_boundaries(self._drawn_length)
+        new_boundaries = gradient_boundaries(num_segments)
+        if (steps or num_segments != self._drawn_length) and new_boundaries:
+            if not old_boundaries:
+                dirty.update(self.positions)
+            else:
+                # Сегмент, сдвинувшийся на steps позиций, сменил ступень градиента, только если
+                # оказался между старой (сдвинутой) и новой границей одной и той же ступени
+                ranges = []
+                total = 0
+                for old_boundary, new_boundary in zip(old_boundaries, new_boundaries):
+                    shifted = old_boundary + steps
+                    start = max(1, min(shifted, new_boundary))
+                    stop = min(num_segments, max(shifted, new_boundary))
+                    if start < stop:
+                        ranges.append((start, stop))
+                        total += stop - start
+                if total >= num_segments:
+                    dirty.update(self.positions)
+                else:
+                    for start, stop in ranges:
+                        for i in range(start, stop):
+                            dirty.add(self.positions[i])
 
-        prev_pos = None
-        current_pos = next(iter_pos)
-        # Пытаемся получить следующий элемент для обработки змейки > 1 сегмента
-        try:
-            next_pos = next(iter_pos)
-            # Голова имеет только следующего соседа
-            self._neighboring_segments_cache[current_pos] = {next_pos}
-            prev_pos = current_pos
-            current_pos = next_pos
-        except StopIteration:
-            # Это произойдет только если змейка состоит из 2 сегментов
-            # В оригинальной версии prev_pos головы был None, а у хвоста была только голова.
-            # Чтобы сохранить консистентность, второй сегмент (хвост) должен иметь соседа - голову.
-            # Голова уже обработана выше.
-            if prev_pos is not None: # Убедимся, что prev_pos (голова) существует
-                self._neighboring_segments_cache[current_pos] = {prev_pos}
-            return # Завершаем, если было всего 2 сегмента
-
-        # Обрабатываем средние сегменты
-        while True:
-            try:
-                next_pos = next(iter_pos)
-                # Текущий сегмент имеет предыдущий и следующий
-                self._neighboring_segments_cache[current_pos] = {prev_pos, next_pos}
-                prev_pos = current_pos
-                current_pos = next_pos
-            except StopIteration: # Дошли до последнего сегмента (хвоста)
-                # Последний сегмент (current_pos) имеет только предыдущего (prev_pos)
-                self._neighboring_segments_cache[current_pos] = {prev_pos}
-                break # Завершаем цикл
+        self._drawn_length = num_segments
+        return dirty
 
     def _update_caches(self):
-        """Обновляет все кэши."""
-        num_segments = len(self.positions)
-        self._update_colors_cache(num_segments)
-        self._update_neighboring_segments_cache()
+        """Обновляет все кэши (таблицу градиента текущей темы)."""
+        self._gradient_lut = get_gradient_lut()
 
-    def draw(self, surface):
-        num_segments = len(self.positions)
-        if num_segments == 0:
-            return
+    def update_layer(self) -> Optional[Set[Tuple[int, int]]]:
+        """
+        Доводит постоянный слой змейки до текущего состояния, перерисовывая только
+        клетки из журнала изменений (голова, хвост, границы градиента).
+        Возвращает перерисованные клетки или None, если слой перерисован целиком.
+        """
+        dirty = self.pop_dirty_cells()
+        layer_size = (GRID_WIDTH * GRIDSIZE, GRID_HEIGHT * GRIDSIZE)
+        if self._layer is None or self._layer.get_size() != layer_size:
+            self._layer = pygame.Surface(layer_size, pygame.SRCALPHA)
+            dirty = None
+        if self._layer_theme != current_theme:
+            self._update_caches()
+            self._layer_theme = current_theme
+            dirty = None
+
+        if dirty is None:
+            self._layer.fill((0, 0, 0, 0))
+            for pos in self.positions:
+                self.draw_segment(self._layer, pos)
+            return None
+
+        for pos in dirty:
+            self._layer.fill((0, 0, 0, 0), pygame.Rect(pos[0] * GRIDSIZE, pos[1] * GRIDSIZE, GRIDSIZE, GRIDSIZE))
+            self.draw_segment(self._layer, pos)
+        return dirty
+
+    def discard_layer(self):
+        """Сбрасывает слой змейки, если журнал изменений прочитан в обход update_layer()."""
+        self._layer = None
+
+    @property
+    def layer(self) -> Surface:
+        """Постоянный слой с телом змейки (прозрачный вне ее клеток)."""
+        if self._layer is None:
+            self.update_layer()
+        return self._layer
 
-        head_pos = self.positions[0]
-        draw_object(surface, current_colors['snake_head'], head_pos)
+    def draw(self, surface):
+        self.update_layer()
+        surface.blit(self._layer, (0, 0))
 
-        if num_segments <= 1:
-            return
+    def draw_segment(self, surface, pos) -> bool:
+        """
+        Рисует один сегмент в клетке pos вместе с его внутренними границами.
+        Возвращает False, если клетка не занята змейкой.
+        """
+        serial = self._cell_serials.get(pos)
+        if serial is None:
+            return False
 
-        segment_positions = list(itertools.islice(self.positions, 1, None))
-        for i, current_pos in enumerate(segment_positions):
-            segment_color = self._segments_colors_cache[i]
-            draw_object(surface, segment_color, current_pos)
+        index = self._head_serial - serial
+        num_segments = len(self.positions)
+        if index == 0:
+            color = current_colors['snake_head']
+        elif index < num_segments:
+            color = self._gradient_lut[gradient_step(index, num_segments)]
+        else:
+            color = current_colors['snake_tail']
+        draw_object(surface, color, pos)
 
+        # Граница рисуется между соседними по полю, но не соседними по телу сегментами
         internal_border_color = current_colors['grid']
         line_width = 1
-        for current_pos in self.positions:
-            x, y = current_pos
-            x_px, y_px = x * GRIDSIZE, y * GRIDSIZE
-            neighbor_right = ((x + 1) % GRID_WIDTH, y)
-            neighbor_down = (x, (y + 1) % GRID_HEIGHT)
-            
-            neighbors = self._neighboring_segments_cache.get(current_pos, set())
-            
-            if (neighbor_right in self.positions_set and 
-                neighbor_right not in neighbors):
-                pygame.draw.line(surface, internal_border_color,
-                                (x_px + GRIDSIZE - line_width, y_px),
-                                (x_px + GRIDSIZE - line_width, y_px + GRIDSIZE - 1),
-                                line_width)
-            
-            if (neighbor_down in self.positions_set and 
-                neighbor_down not in neighbors):
-                pygame.draw.line(surface, internal_border_color,
-                                (x_px, y_px + GRIDSIZE - line_width),
-                                (x_px + GRIDSIZE - 1, y_px + GRIDSIZE - line_width),
-                                line_width)
+        x, y = pos
+        x_px, y_px = x * GRIDSIZE, y * GRIDSIZE
+
+        right_serial = self._cell_serials.get(((x + 1) % GRID_WIDTH, y))
+        if right_serial is not None and abs(right_serial - serial) != 1:
+            pygame.draw.line(surface, internal_border_color,
+                             (x_px + GRIDSIZE - line_width, y_px),
+                             (x_px + GRIDSIZE - line_width, y_px + GRIDSIZE - 1),
+                             line_width)
+
+        down_serial = self._cell_serials.get((x, (y + 1) % GRID_HEIGHT))
+        if down_serial is not None and abs(down_serial - serial) != 1:
+            pygame.draw.line(surface, internal_border_color,
+                             (x_px, y_px + GRIDSIZE - line_width),
+                             (x_px + GRIDSIZE - 1, y_px + GRIDSIZE - line_width),
+                             line_width)
+        return True
 
     def get_head_position(self):
         return self.positions[0]
@@ -824,18 +2309,17 @@ class Snake:
         if new_head not in self.positions:
              self.next_direction = point
 
-    def move(self, food_pos):
-        """Основная функция движения: выбирает направление (если авто) и делает ход."""
+    def move(self, food_pos, deadline: Optional[float] = None):
+        """
+        Основная функция движения: выбирает направление (если авто) и делает ход.
+        deadline - срок бюджета логики кадра, дальше которого не идет поиск вперед.
+        """
         self.current_food_pos = food_pos
         collision = False
         if self.mode == 'auto':
-            collision = self.auto_move(food_pos)
+            collision = self.auto_move(food_pos, deadline)
         else:
             collision = self.manual_move()
-
-        if self.positions:
-             self.history.append((list(self.positions), self.current_food_pos))
-
         return collision
 
     def manual_move(self):
@@ -846,9 +2330,11 @@ class Snake:
         new_head_pos = ((cur[0] + x) % GRID_WIDTH, (cur[1] + y) % GRID_HEIGHT)
         return self.move_forward(new_head_pos)
 
-    def auto_move(self, food_pos):
+    def auto_move(self, food_pos, deadline: Optional[float] = None):
         """Выбор направления и движение вперед в авто-режиме."""
+        tick_start = time.perf_counter()
         head = self.get_head_position()
+        self._head_field = None # Тело сдвинулось с прошлого хода - поле строится заново
         fill_percentage = self.length / (GRID_WIDTH * GRID_HEIGHT)
         force_survival_fill_mode = fill_percentage > 0.80 # Используем твой порог 80%
 
@@ -859,8 +2345,7 @@ class Snake:
         if force_survival_fill_mode:
             # --- Режим Следования Гамильтонову Циклу (>80%) ---
             # ВСЕГДА пытаемся найти безопасный путь к циклу
-            self.current_path = [] 
-            self.path = []
+            self._clear_path()
             self.recalculate_path = False
             self.survival_mode_steps_remaining = 0
 
@@ -870,12 +2355,11 @@ class Snake:
                 for lookahead_steps in [1, 2]: # Пробуем +1 и +2 шага
                     target_index = (head_index + lookahead_steps) % len(self.hamiltonian_path)
                     target_cell = self.hamiltonian_path[target_index]
-                    path_to_cycle_target = self.path_find.find_path(head, target_cell, list(self.positions), is_target_food=False)
+                    path_to_cycle_target = self.head_distance_field().path_to(target_cell)
 
                     # ВСЕГДА проверяем безопасность пути к цели
                     if path_to_cycle_target and self._is_path_to_target_safe(path_to_cycle_target):
-                        self.current_path = path_to_cycle_target
-                        self.path = path_to_cycle_target
+                        self._set_path(path_to_cycle_target)
                         if len(self.current_path) > 1:
                             # Расчет направления (как было)
                             next_step = self.current_path[1]
@@ -918,16 +2402,16 @@ class Snake:
                  survival_direction = self._find_standard_survival_move()
                  if not survival_direction: survival_direction = self.find_immediate_safe_direction()
                  self.next_direction = survival_direction or self.direction
-                 self.current_path = []; self.path = []; self.recalculate_path = False
+                 self._clear_path(); self.recalculate_path = False
              else:
                  if self.recalculate_path or not self.current_path:
-                      path_to_food = self.path_find.find_path(head, food_pos, list(self.positions), is_target_food=True)
+                      path_to_food = self.head_distance_field().path_to(food_pos)
                       if path_to_food and self.is_path_safe_to_food(path_to_food):
-                          self.current_path = path_to_food; self.path = self.current_path; self.recalculate_path = False
+                          self._set_path(path_to_food); self.recalculate_path = False
                           if len(self.current_path) > 1: self.next_direction = self.get_direction_to(self.current_path[1])
-                          else: self.next_direction = self._find_standard_survival_move() or self.direction; self.recalculate_path = True; self.current_path = []; self.path = []
+                          else: self.next_direction = self._find_standard_survival_move() or self.direction; self.recalculate_path = True; self._clear_path()
                       else:
-                          self.current_path = []; self.path = []
+                          self._clear_path()
                           survival_direction = self._find_standard_survival_move()
                           if survival_direction:
                               self.next_direction = survival_direction; self.survival_mode_steps_remaining = SURVIVAL_MODE_DURATION; self.recalculate_path = False
@@ -935,8 +2419,21 @@ class Snake:
                               self.next_direction = self.find_immediate_safe_direction() or self.direction; self.recalculate_path = True
                  else:
                       if len(self.current_path) > 1: self.next_direction = self.get_direction_to(self.current_path[1])
-                      else: self.recalculate_path = True; self.current_path = []; self.path = []; self.next_direction = self._find_standard_survival_move() or self.direction
-
+                      else: self.recalculate_path = True; self._clear_path(); self.next_direction = self._find_standard_survival_move() or self.direction
+
+        # --- Проверка выбранного хода поиском вперед (если включен) ---
+        # Поиск, не уложившийся в шаг, продолжится в следующих кадрах; до его результатов ход автопилота не меняется
+        if lookahead_enabled:
+            planner_deadline = tick_start + lookahead_budget(self.speed)
+            if deadline is not None:
+                planner_deadline = min(planner_deadline, deadline)
+            self.plan_ahead(food_pos, planner_deadline)
+            planned_direction = self.planner.suggest(self.next_direction)
+            if planned_direction != self.next_direction:
+                self.planner.overrides += 1
+                self.next_direction = planned_direction
+                self._clear_path(); self.recalculate_path = True
+                path_calculated_for_cycle = False
 
         # --- Общее для всех режимов: Движение ---
         self.direction = self.next_direction
@@ -944,57 +2441,81 @@ class Snake:
         x, y = self.direction
         new_head_pos = ((cur[0] + x) % GRID_WIDTH, (cur[1] + y) % GRID_HEIGHT)
         collision = self.move_forward(new_head_pos)
+        if lookahead_enabled:
+            self.planner.observe(self.path_find.tables.cell(new_head_pos), new_head_pos == food_pos)
 
         # --- Обновление пути (если это был НЕ путь по циклу) ---
         if not path_calculated_for_cycle and self.survival_mode_steps_remaining == 0 and not self.recalculate_path and self.current_path and not collision:
              if self.current_path and self.current_path[0] == cur:
-                 self.current_path.pop(0)
+                 self._advance_path()
              elif self.recalculate_path is False:
                  self.recalculate_path = True
-                 self.current_path = []; self.path = []
+                 self._clear_path()
 
         return collision
 
-    def move_forward(self, new_head_pos):
-        """Обновляет позицию змейки: добавляет голову, удаляет хвост (если не растет), проверяет коллизии."""
-        collision = False
-        tail_pos = self.positions[-1] if len(self.positions) > 0 else None
-        
-        grows = (new_head_pos == self.current_food_pos)
-        structure_changed = grows
-        if not grows and self.positions:
-             removed_tail = self.positions[-1]
-             if removed_tail != new_head_pos:
-                 structure_changed = True
-        elif not self.positions:
-             structure_changed = True
-        
-        if new_head_pos in self.positions_set and new_head_pos != tail_pos:
-             collision = True
+    def plan_ahead(self, food_pos, deadline: float) -> bool:
+        """
+        Продолжает поиск вперед до срока deadline (или начинает новый от текущей позиции, если прежний
+        использован или устарел). Вызывается из шага и главным циклом - на остаток бюджета логики кадра.
+        True, если поиск завершен.
+        """
+        if deadline - time.perf_counter() < LOOKAHEAD_MIN_SECONDS:
+            return False
+        if self.planner.needs_restart():
+            self.planner.start(self.positions, self.head_distance_field().free_after, self.direction, food_pos)
+        return self.planner.advance(deadline)
+
+    def head_distance_field(self) -> DistanceField:
+        """Поле расстояний от головы: строится один раз за ход и общее для всех запросов хода."""
+        if self._head_field is None:
+            self._head_field = self.path_find.distance_field(self.get_head_position(), self.positions.cell_indices())
+        return self._head_field
+
+    def _set_path(self, path):
+        """
+        Запоминает новый план пути. Множество path_cells создается заново: слои поля
+        сравнивают его по ссылке и перерисовывают путь только после перепланирования.
+        """
+        self.current_path = deque(path)
+        self.path_cells = set(self.current_path)
 
-        history_positions = list(self.positions)
-        history_food_pos = self.current_food_pos
+    def _clear_path(self):
+        self._set_path(())
 
-        self.positions_set.add(new_head_pos)
-        self.positions.appendleft(new_head_pos)
+    def _advance_path(self):
+        """Снимает пройденную клетку с начала пути за O(1) (клетка уже под змейкой)."""
+        self.path_cells.discard(self.current_path.popleft())
 
+    def move_forward(self, new_head_pos):
+        """Обновляет позицию змейки: добавляет голову, удаляет хвост (если не растет), проверяет коллизии. Все за O(1)."""
+        positions = self.positions
+        tail_pos = positions[-1] if positions else None
+        grows = (new_head_pos == self.current_food_pos)
+        self._head_field = None # Поле расстояний было для тела до хода
+        collision = new_head_pos in positions and new_head_pos != tail_pos
+
+        if positions:
+            self._dirty_cells.add(positions[0]) # Бывшая голова перекрашивается в цвет тела
+        positions.appendleft(new_head_pos)
+        self._head_serial += 1
+        self._cell_serials[new_head_pos] = self._head_serial
+        self._mark_cell_dirty(new_head_pos)
+        self._steps_since_redraw += 1
+
+        removed_tail = None
         if not grows:
-            if self.positions:
-                removed_tail = self.positions.pop()
-                if removed_tail in self.positions_set:
-                     if removed_tail not in self.positions:
-                           self.positions_set.remove(removed_tail)
-        elif grows:
+            removed_tail = positions.pop()
+            if removed_tail != new_head_pos:
+                self._cell_serials.pop(removed_tail, None)
+                self._mark_cell_dirty(removed_tail)
+        else:
              self.length += 1
              self.survival_mode_steps_remaining = 0
              self.recalculate_path = True
-             self.current_path = []
-             self.path = []
+             self._clear_path()
 
-        self.history.append((history_positions, history_food_pos))
-        
-        if structure_changed:
-            self._update_caches()
+        self.history.record(new_head_pos, removed_tail, self.current_food_pos)
 
         return collision
 
@@ -1045,69 +2566,19 @@ class Snake:
 
         return None
 
-    def _get_all_empty_cells(self, obstacles: Set[Tuple[int, int]]) -> Set[Tuple[int, int]]:
-        """Возвращает множество всех пустых клеток на поле."""
-        # Можно оптимизировать, кэшируя all_cells, если GRID_WIDTH/HEIGHT не меняются
-        all_cells = set((x, y) for x in range(GRID_WIDTH) for y in range(GRID_HEIGHT))
-        return all_cells - obstacles
-
-    def _calculate_fragmentation_score(self, obstacles: Set[Tuple[int, int]]) -> int:
-        """
-        Вычисляет 'счет фрагментации' - количество несвязанных регионов пустых клеток.
-        Меньше -> лучше. Использует BFS для обхода.
-        """
-        empty_cells = self._get_all_empty_cells(obstacles)
-        if not empty_cells:
-            return 0 # Нет пустых клеток - нет фрагментации
-
-        visited_overall = set()
-        region_count = 0
-
-        # Продолжаем, пока не посетим все пустые клетки
-        while len(visited_overall) < len(empty_cells):
-            region_count += 1
-            # Находим стартовую клетку для нового региона (любую не посещенную)
-            try:
-                 # iter(empty_cells - visited_overall) создает итератор по разности множеств
-                 start_node = next(iter(empty_cells - visited_overall))
-            except StopIteration:
-                 # Этого не должно произойти, если while условие верно, но для безопасности
-                 break 
-
-            # Запускаем BFS для поиска всех клеток в текущем регионе
-            q = deque([start_node])
-            visited_overall.add(start_node) # Отмечаем как посещенную глобально
-
-            while q:
-                current_pos = q.popleft()
-                # Проверяем соседей
-                for neighbor_pos in self.path_find.get_neighbors(current_pos):
-                    # Сосед должен быть пустым и еще не посещенным глобально
-                    if neighbor_pos in empty_cells and neighbor_pos not in visited_overall:
-                        visited_overall.add(neighbor_pos)
-                        q.append(neighbor_pos)
-                        
-        # Возвращаем количество найденных регионов
-        return region_count
-
     def _find_standard_survival_move(self) -> Tuple[int, int] | None:
         """
-        Стандартный режим выживания:
-        1. Максимизирует достижимую пустую область от головы.
-        2. При равенстве областей, максимизирует путь до хвоста.
-        3. Если все эвристики равны, выбирает случайно из лучших.
+        Стандартный режим выживания: ход с самым длинным путем до хвоста после хода (змейка тянет
+        время, пока хвост освобождает место); при равенстве выбирает случайно из лучших.
         """
-        candidate_directions_data = {} # direction -> (freedom, tail_path_len)
-        max_freedom = -1
-
         head = self.get_head_position()
         possible_directions = []
-        current_positions_set = self.positions_set
+        body = self.positions
         tail_pos = self.positions[-1] if len(self.positions) > 1 else None
         for d in [UP, DOWN, LEFT, RIGHT]:
             if len(self.positions) > 1 and d == (self.direction[0] * -1, self.direction[1] * -1): continue
             next_head = ((head[0] + d[0]) % GRID_WIDTH, (head[1] + d[1]) % GRID_HEIGHT)
-            is_collision = next_head in current_positions_set and next_head != tail_pos
+            is_collision = next_head in body and next_head != tail_pos
             if not is_collision: possible_directions.append(d)
 
         if not possible_directions:
@@ -1118,54 +2589,26 @@ class Snake:
              return None
         if len(possible_directions) == 1: return possible_directions[0]
 
-        current_positions_list = list(self.positions)
-        safe_directions_after_sim = set(possible_directions) # Начнем со всех возможных
-
-        for direction in possible_directions:
-            next_head = ((head[0] + direction[0]) % GRID_WIDTH, (head[1] + direction[1]) % GRID_HEIGHT)
-            sim_snake_list = self.simulate_move([head, next_head], grows=False, initial_state=current_positions_list)
-            if sim_snake_list is None:
-                safe_directions_after_sim.discard(direction)
-                continue
-
-            sim_head = sim_snake_list[0]
-            sim_obstacles = set(sim_snake_list)
-            freedom = self._calculate_reachable_empty_space(sim_head, sim_obstacles)
-
-            if freedom >= max_freedom:
-                sim_tail = sim_snake_list[-1]
-                path_to_tail = self.path_find.find_path(sim_head, sim_tail, sim_snake_list, is_target_food=False) # Цель - хвост, не еда
-                tail_path_len = len(path_to_tail) if path_to_tail else 0
-
-                if freedom > max_freedom:
-                     max_freedom = freedom
-                candidate_directions_data[direction] = (freedom, tail_path_len)
-
-        # --- Фильтрация кандидатов ---
-        # Убираем направления, которые симуляция посчитала небезопасными
-        valid_candidates = {d: data for d, data in candidate_directions_data.items() if d in safe_directions_after_sim}
-
-        if not valid_candidates:
-             return random.choice(list(safe_directions_after_sim)) if safe_directions_after_sim else (self.find_immediate_safe_direction() or self.direction)
-
-        # Оставляем только тех, у кого максимальный freedom
-        current_max_freedom = -1
-        for free, _ in valid_candidates.values():
-             if free > current_max_freedom: current_max_freedom = free
-        best_freedom_candidates = {d: data for d, data in valid_candidates.items() if data[0] == current_max_freedom}
-
-        if not best_freedom_candidates: return random.choice(list(safe_directions_after_sim)) if safe_directions_after_sim else (self.find_immediate_safe_direction() or self.direction)
-        if len(best_freedom_candidates) == 1: return list(best_freedom_candidates.keys())[0]
-
-        # Фильтруем по максимальной длине пути до хвоста
-        max_tail_len = -1
-        for _, tail_len in best_freedom_candidates.values():
-             if tail_len > max_tail_len: max_tail_len = tail_len
-        best_tail_len_candidates = {d: data for d, data in best_freedom_candidates.items() if data[1] == max_tail_len}
-
-        # --- Финальный случайный выбор ---
-        final_choices = list(best_tail_len_candidates.keys())
-        return random.choice(final_choices) if final_choices else (self.find_immediate_safe_direction() or self.direction)
+        # Путь до хвоста после хода (хвост - предпоследний сегмент) для каждого кандидата. Поля расстояний
+        # берут время освобождения тела из поля головы: ход в кандидата - первый, поэтому обход начинается
+        # с уровня 1, и расстояние до хвоста сразу равно длине пути вместе с клеткой кандидата
+        tail_lens = {}
+        if len(self.positions) == 1:
+            tail_lens = {d: 1 for d in possible_directions} # Хвост - сама новая голова
+        else:
+            tables = self.path_find.tables
+            free_after = self.head_distance_field().free_after
+            sim_tail = self.positions[-2]
+            for direction in possible_directions:
+                next_head = ((head[0] + direction[0]) % GRID_WIDTH, (head[1] + direction[1]) % GRID_HEIGHT)
+                field = DistanceField(self.path_find, tables.cell(next_head), free_after=free_after, start_level=1)
+                tail_distance = field.distance(sim_tail) # Цель - хвост, не еда
+                tail_lens[direction] = tail_distance if tail_distance is not None else 0
+
+        # --- Финальный случайный выбор среди ходов с самым длинным путем до хвоста ---
+        max_tail_len = max(tail_lens.values())
+        final_choices = [d for d in possible_directions if tail_lens[d] == max_tail_len]
+        return random.choice(final_choices)
 
     def _is_path_to_target_safe(self, path_to_target: List[Tuple[int, int]]) -> bool:
          """Проверяет, безопасен ли путь к ЦЕЛИ (не еде)."""
@@ -1178,66 +2621,6 @@ class Snake:
              return bool(path_to_tail_after_reach)
          return False
 
-    def _find_empty_regions(self, obstacles: Set[Tuple[int, int]]) -> List[List[Tuple[int, int]]]:
-        """Находит все несвязанные регионы пустых клеток."""
-        empty_cells = self._get_all_empty_cells(obstacles)
-        if not empty_cells:
-            return []
-
-        visited_overall = set()
-        regions = []
-
-        while len(visited_overall) < len(empty_cells):
-            current_region = []
-            # Находим стартовую клетку для нового региона
-            try:
-                 start_node = next(iter(empty_cells - visited_overall))
-            except StopIteration:
-                 break
-
-            q = deque([start_node])
-            visited_overall.add(start_node)
-            current_region.append(start_node)
-
-            while q:
-                current_pos = q.popleft()
-                for neighbor_pos in self.path_find.get_neighbors(current_pos):
-                    if neighbor_pos in empty_cells and neighbor_pos not in visited_overall:
-                        visited_overall.add(neighbor_pos)
-                        q.append(neighbor_pos)
-                        current_region.append(neighbor_pos)
-
-            if current_region:
-                regions.append(current_region)
-
-        return regions
-
-    def _find_closest_cell_in_region(self, start_pos: Tuple[int, int], region_cells: List[Tuple[int, int]]) -> Optional[Tuple[int, int]]:
-        """Находит ближайшую клетку из region_cells к start_pos с помощью BFS."""
-        if not region_cells: return None
-        region_set = set(region_cells) # Для быстрой проверки принадлежности
-        q = deque([(start_pos, 0)]) # (position, distance)
-        visited = {start_pos}
-
-        while q:
-            current_pos, dist = q.popleft()
-
-            if current_pos in region_set:
-                return current_pos # Нашли первую (ближайшую)
-
-            # Ищем соседей, не являющихся препятствиями (в данном контексте препятствия - это тело змеи)
-            for neighbor_pos in self.path_find.get_neighbors(current_pos):
-                # Не проверяем на столкновение с хвостом здесь, только базовый BFS
-                if neighbor_pos not in self.positions_set and neighbor_pos not in visited:
-                    visited.add(neighbor_pos)
-                    q.append((neighbor_pos, dist + 1))
-                # Если сосед - это искомая клетка региона
-                elif neighbor_pos in region_set and neighbor_pos not in visited:
-                     return neighbor_pos # Нашли ближайшего соседа в регионе
-
-        # Если BFS завершился, а клетка не найдена (маловероятно, если регион существует)
-        return None # Или можно вернуть случайную из региона? Пока None
-
     def is_path_safe_to_food(self, path_to_food: List[Tuple[int, int]]) -> bool:
         """
         Проверяет, является ли путь к еде "безопасным":
@@ -1288,56 +2671,64 @@ class Snake:
     def reset(self, initial_fill_percentage=0):
         self.length = 1
         initial_pos = ((GRID_WIDTH) // 2, (GRID_HEIGHT) // 2)
-        self.positions = deque([initial_pos])
+        self.positions = SnakeBody([initial_pos])
         self.direction = random.choice([UP, DOWN, LEFT, RIGHT])
         self.next_direction = self.direction
-        self.path = []
         self.speed = 10
         self.history.clear()
         self.current_food_pos = None
         self.recalculate_path = True
-        self.current_path = []
-        self.path = []
-        self.positions_set = set(self.positions)
+        self._clear_path()
         self.survival_mode_steps_remaining = 0
+        self.planner.reset()
 
         if initial_fill_percentage > 0:
             generated_positions, generated_direction = generate_accordion_snake(
                 initial_fill_percentage, GRID_WIDTH, GRID_HEIGHT
             )
             if generated_positions:
-                self.positions = generated_positions
+                self.positions = SnakeBody(generated_positions)
                 self.length = len(generated_positions)
                 self.direction = generated_direction
                 self.next_direction = generated_direction
-                self.positions_set = set(self.positions)
             else:
                  print(f"Warning: Failed to generate snake for {initial_fill_percentage}%, starting with default.")
 
+        self._rebuild_cell_serials()
         self._update_caches()
 
-    def _calculate_reachable_empty_space(self, start_pos: Tuple[int, int], obstacles: Set[Tuple[int, int]]) -> int:
-        """
-        Вычисляет количество достижимых пустых клеток от start_pos с помощью BFS,
-        избегая клеток из obstacles.
-        """
-        if start_pos in obstacles:
-            return 0
-
-        q = deque([start_pos])
-        visited = {start_pos}
-        count = 0
-
-        while q:
-            current_pos = q.popleft()
-            count += 1
+    def export_state(self, food_pos: Optional[Tuple[int, int]]) -> Dict[str, Any]:
+        """Состояние змейки и еды для фикстуры (JSON-совместимый словарь, тело - от головы к хвосту)."""
+        return {
+            'version': FIXTURE_VERSION,
+            'grid': [GRID_WIDTH, GRID_HEIGHT],
+            'mode': self.mode,
+            'speed': self.speed,
+            'body': [list(pos) for pos in self.positions],
+            'direction': list(self.direction),
+            'next_direction': list(self.next_direction),
+            'food': list(food_pos) if food_pos is not None else None,
+            'survival_mode_steps_remaining': self.survival_mode_steps_remaining,
+            'recalculate_path': self.recalculate_path,
+            'current_path': [list(pos) for pos in self.current_path],
+        }
 
-            # Используем существующий метод get_neighbors из PathFind
-            for neighbor_pos in self.path_find.get_neighbors(current_pos):
-                if neighbor_pos not in obstacles and neighbor_pos not in visited:
-                    visited.add(neighbor_pos)
-                    q.append(neighbor_pos)
-        return count
+    def load_state(self, state: Dict[str, Any]):
+        """Восстанавливает змейку из словаря export_state (размер поля должен уже совпадать, режим не меняется)."""
+        self.speed = state.get('speed', self.speed)
+        self.positions = SnakeBody(tuple(pos) for pos in state['body'])
+        self.length = len(self.positions)
+        self.direction = tuple(state['direction'])
+        self.next_direction = tuple(state.get('next_direction', state['direction']))
+        food = state.get('food')
+        self.current_food_pos = tuple(food) if food is not None else None
+        self.survival_mode_steps_remaining = state.get('survival_mode_steps_remaining', 0)
+        self.recalculate_path = state.get('recalculate_path', True)
+        self._set_path(tuple(pos) for pos in state.get('current_path', ()))
+        self.history.clear()
+        self.planner.reset()
+        self._rebuild_cell_serials()
+        self._update_caches()
 
     def _generate_hamiltonian_cycle_path(self) -> List[Tuple[int, int]]:
         """Генерирует простой змеевидный Гамильтонов цикл для всего поля."""
@@ -1358,9 +2749,10 @@ class Food:
         self.color = current_colors['food']  # Сохраняем атрибут color
         self.randomize_position([])
 
-    def randomize_position(self, snake_positions: List[Tuple[int, int]] | Deque[Tuple[int, int]]):
+    def randomize_position(self, snake_positions: List[Tuple[int, int]] | SnakeBody):
         # Проверка на полное заполнение поля
-        occupied = set(snake_positions)
+        # Тело змейки само отвечает на "клетка занята" за O(1), множество нужно только для списков
+        occupied = snake_positions if isinstance(snake_positions, SnakeBody) else set(snake_positions)
         fill_percentage = len(occupied) / (GRID_WIDTH * GRID_HEIGHT)
         
         # Защита от ошибки: если все клетки заняты, не пытаемся найти позицию
@@ -1400,7 +2792,7 @@ class Food:
         # находим первую свободную клетку последовательным перебором
         self._find_sequential(occupied)
     
-    def _find_sequential(self, occupied: Set[Tuple[int, int]]):
+    def _find_sequential(self, occupied: Set[Tuple[int, int]] | SnakeBody):
         """Оптимизированный последовательный поиск свободной клетки."""
         for x in range(GRID_WIDTH):
             for y in range(GRID_HEIGHT):
@@ -1412,6 +2804,356 @@ class Food:
     def draw(self, surface):
         draw_object(surface, self.color, self.position)
 
+# Путь не показывается. Слои поля запоминают множество клеток пути по ссылке: Snake создает
+# новое множество при каждом перепланировании, а пройденные клетки убирает из него на месте
+NO_PATH_CELLS: frozenset = frozenset()
+
+class BoardRenderer:
+    """
+    Слой игрового поля в удерживаемом режиме.
+    Хранит последний отрисованный кадр поля и перерисовывает только клетки,
+    изменившиеся с прошлого вызова render(), возвращая их прямоугольники для display.update.
+    """
+
+    def __init__(self, size: Optional[Tuple[int, int]] = None):
+        if size is None:
+            size = (GRID_WIDTH * GRIDSIZE, GRID_HEIGHT * GRIDSIZE)
+        self.surface = pygame.Surface(size)
+        self._theme: Optional[str] = None
+        self._food_pos: Optional[Tuple[int, int]] = None
+        self._path_cells: Set[Tuple[int, int]] = NO_PATH_CELLS
+        self._needs_full_redraw = True
+
+    def invalidate(self):
+        """Требует полной перерисовки слоя при следующем render()."""
+        self._needs_full_redraw = True
+
+    def render(self, snake: 'Snake', food_pos: Optional[Tuple[int, int]], path_cells: Optional[Set[Tuple[int, int]]]) -> Optional[List[pygame.Rect]]:
+        """
+        Обновляет слой поля (food_pos = None - без еды, path_cells = None - без пути).
+        Возвращает прямоугольники перерисованных клеток или None, если слой перерисован целиком.
+        """
+        path_cells = path_cells if path_cells is not None else NO_PATH_CELLS
+        dirty = snake.update_layer()
+
+        if dirty is None or self._needs_full_redraw or self._theme != current_theme:
+            self._redraw_all(snake, food_pos, path_cells)
+            return None
+
+        if food_pos != self._food_pos:
+            if self._food_pos is not None:
+                dirty.add(self._food_pos)
+            if food_pos is not None:
+                dirty.add(food_pos)
+            self._food_pos = food_pos
+
+        if path_cells is not self._path_cells: # Путь перепланирован (или показ пути переключен)
+            dirty |= path_cells ^ self._path_cells
+            self._path_cells = path_cells
+
+        return [self._draw_cell(cell, snake, food_pos, path_cells) for cell in dirty]
+
+    def _redraw_all(self, snake: 'Snake', food_pos: Optional[Tuple[int, int]], path_cells: Set[Tuple[int, int]]):
+        background = get_board_background(*self.surface.get_size())
+        self.surface.blit(background, (0, 0))
+        for pos in path_cells:
+            draw_object(self.surface, current_colors['path_visualization'], pos)
+        self.surface.blit(snake.layer, (0, 0))
+        if food_pos is not None:
+            draw_object(self.surface, current_colors['food'], food_pos)
+
+        self._theme = current_theme
+        self._food_pos = food_pos
+        self._path_cells = path_cells
+        self._needs_full_redraw = False
+
+    def _draw_cell(self, pos: Tuple[int, int], snake: 'Snake', food_pos: Optional[Tuple[int, int]], path_cells: Set[Tuple[int, int]]) -> pygame.Rect:
+        """Перерисовывает одну клетку слоя (содержимое клетки не выходит за ее границы)."""
+        rect = pygame.Rect(pos[0] * GRIDSIZE, pos[1] * GRIDSIZE, GRIDSIZE, GRIDSIZE)
+        if pos == food_pos:
+            pygame.draw.rect(self.surface, current_colors['food'], rect)
+        elif pos in snake.positions:
+            self.surface.blit(snake.layer, rect, rect) # Сегменты на слое змейки непрозрачны
+        elif pos in path_cells:
+            pygame.draw.rect(self.surface, current_colors['path_visualization'], rect)
+        else:
+            self.surface.blit(get_board_background(*self.surface.get_size()), rect, rect)
+        return rect
+
+class NumpyBoardRenderer:
+    """
+    Слой игрового поля для больших досок.
+    Хранит поле как массив индексов цветов по клеткам (обновляется по журналу изменений змейки).
+    Поле целиком строится одним поиском по палитре в маленькую поверхность (клетка = пиксель),
+    дальше в ней меняются только пиксели измененных клеток; на слой она выводится
+    одним масштабированием. Сетка и границы сегментов не рисуются.
+    """
+
+    CODE_BACKGROUND = 0
+    CODE_FOOD = 1
+    CODE_PATH = 2
+    CODE_HEAD = 3
+    CODE_GRADIENT = 4 # Ступени градиента: CODE_GRADIENT + ступень
+    CODE_TAIL = CODE_GRADIENT + GRADIENT_LUT_SIZE
+
+    def __init__(self, size: Optional[Tuple[int, int]] = None):
+        if size is None:
+            size = (GRID_WIDTH * GRIDSIZE, GRID_HEIGHT * GRIDSIZE)
+        self.surface = pygame.Surface(size)
+        if size == (GRID_WIDTH, GRID_HEIGHT):
+            self._cell_surface = self.surface # Клетка в один пиксель: масштабировать нечего
+        else:
+            self._cell_surface = pygame.Surface((GRID_WIDTH, GRID_HEIGHT), 0, self.surface)
+        self._cells = np.zeros((GRID_WIDTH, GRID_HEIGHT), dtype=np.uint8)
+        self._palette = np.zeros(self.CODE_TAIL + 1, dtype=np.uint32) # Цвета в формате пикселей self.surface
+        self._theme: Optional[str] = None
+        self._food_pos: Optional[Tuple[int, int]] = None
+        self._path_cells: Set[Tuple[int, int]] = NO_PATH_CELLS
+        self._needs_full_redraw = True
+
+    def invalidate(self):
+        """Требует полной перерисовки слоя при следующем render()."""
+        self._needs_full_redraw = True
+
+    def render(self, snake: 'Snake', food_pos: Optional[Tuple[int, int]], path_cells: Optional[Set[Tuple[int, int]]]) -> Optional[List[pygame.Rect]]:
+        """
+        Обновляет слой поля.
+        Возвращает пустой список, если кадр не изменился, иначе None (слой перестроен целиком).
+        """
+        changed = self._update_cells(snake, food_pos, path_cells)
+        if changed is None:
+            pixels = pygame.surfarray.pixels2d(self._cell_surface)
+            pixels[...] = self._palette[self._cells]
+            del pixels # Снимает блокировку поверхности
+        else:
+            xs, ys, codes = changed
+            if not len(codes):
+                return []
+            pixels = pygame.surfarray.pixels2d(self._cell_surface)
+            pixels[xs, ys] = self._palette[codes]
+            del pixels
+
+        if self._cell_surface is not self.surface:
+            pygame.transform.scale(self._cell_surface, self.surface.get_size(), self.surface)
+        return None
+
+    def _update_cells(self, snake: 'Snake', food_pos: Optional[Tuple[int, int]], path_cells: Optional[Set[Tuple[int, int]]]):
+        """
+        Доводит массив индексов клеток до текущего состояния по журналу изменений змейки.
+        Возвращает None, если массив перестроен целиком, иначе (xs, ys, codes) измененных клеток.
+        """
+        path_cells = path_cells if path_cells is not None else NO_PATH_CELLS
+        dirty = snake.pop_dirty_cells()
+        snake.discard_layer() # Журнал прочитан здесь, слой змейки больше не актуален
+
+        if self._theme != current_theme:
+            self._update_palette()
+            self._needs_full_redraw = True
+
+        if dirty is None or self._needs_full_redraw:
+            self._rebuild_cells(snake, food_pos, path_cells)
+            return None
+
+        if food_pos != self._food_pos:
+            if self._food_pos is not None:
+                dirty.add(self._food_pos)
+            if food_pos is not None:
+                dirty.add(food_pos)
+            self._food_pos = food_pos
+        if path_cells is not self._path_cells: # Путь перепланирован (или показ пути переключен)
+            dirty |= path_cells ^ self._path_cells
+            self._path_cells = path_cells
+        if not dirty:
+            return (), (), np.zeros(0, dtype=np.uint8)
+        xs, ys = zip(*dirty)
+        codes = np.array([self._cell_code(cell, snake, food_pos, path_cells) for cell in dirty], dtype=np.uint8)
+        self._cells[xs, ys] = codes
+        return xs, ys, codes
+
+    def _update_palette(self):
+        map_rgb = self.surface.map_rgb
+        self._palette[self.CODE_BACKGROUND] = map_rgb(current_colors['background'])
+        self._palette[self.CODE_FOOD] = map_rgb(current_colors['food'])
+        self._palette[self.CODE_PATH] = map_rgb(current_colors['path_visualization'])
+        self._palette[self.CODE_HEAD] = map_rgb(current_colors['snake_head'])
+        for step, color in enumerate(get_gradient_lut()):
+            self._palette[self.CODE_GRADIENT + step] = map_rgb(color)
+        self._palette[self.CODE_TAIL] = map_rgb(current_colors['snake_tail'])
+        self._theme = current_theme
+
+    def _rebuild_cells(self, snake: 'Snake', food_pos: Optional[Tuple[int, int]], path_cells: Set[Tuple[int, int]]):
+        cells = self._cells
+        cells.fill(self.CODE_BACKGROUND)
+        if path_cells:
+            xs, ys = zip(*path_cells)
+            cells[xs, ys] = self.CODE_PATH
+
+        serials = snake._cell_serials
+        if serials:
+            xs, ys = zip(*serials.keys())
+            indices = snake._head_serial - np.fromiter(serials.values(), dtype=np.int64, count=len(serials))
+            num_segments = len(snake.positions)
+            if num_segments > 1:
+                codes = self.CODE_GRADIENT + (indices - 1) * GRADIENT_LUT_SIZE // (num_segments - 1)
+                codes[indices >= num_segments] = self.CODE_TAIL
+            else:
+                codes = np.full(len(indices), self.CODE_TAIL)
+            codes[indices == 0] = self.CODE_HEAD
+            cells[xs, ys] = codes
+
+        if food_pos is not None:
+            cells[food_pos] = self.CODE_FOOD
+        self._food_pos = food_pos
+        self._path_cells = path_cells
+        self._needs_full_redraw = False
+
+    def _cell_code(self, pos: Tuple[int, int], snake: 'Snake', food_pos: Optional[Tuple[int, int]], path_cells: Set[Tuple[int, int]]) -> int:
+        """Индекс цвета клетки с тем же приоритетом, что и в BoardRenderer._draw_cell."""
+        if pos == food_pos:
+            return self.CODE_FOOD
+        serial = snake._cell_serials.get(pos)
+        if serial is not None:
+            index = snake._head_serial - serial
+            num_segments = len(snake.positions)
+            if index == 0:
+                return self.CODE_HEAD
+            if index < num_segments:
+                return self.CODE_GRADIENT + gradient_step(index, num_segments)
+            return self.CODE_TAIL
+        if pos in path_cells:
+            return self.CODE_PATH
+        return self.CODE_BACKGROUND
+
+MIN_CAMERA_CELL_SIZE = 1
+MAX_CAMERA_CELL_SIZE = 40
+CAMERA_ZOOM_STEP = 1.25
+VIEWPORT_GRID_MIN_CELL_SIZE = 6 # При более мелких клетках сетка в окне просмотра не рисуется
+
+class Camera:
+    """Окно просмотра поля: масштаб (пикселей на клетку) и левый верхний угол в клетках."""
+
+    def __init__(self, view_size: Tuple[int, int], cell_size: Optional[int] = None):
+        self.view_width, self.view_height = view_size
+        self.cell_size = GRIDSIZE if cell_size is None else cell_size
+        self.x = 0.0
+        self.y = 0.0
+        self.follow = True # Держать голову змейки в центре
+
+    def state(self) -> Tuple[float, float, int]:
+        return self.x, self.y, self.cell_size
+
+    def _clamp(self):
+        max_x = max(0.0, GRID_WIDTH - self.view_width / self.cell_size)
+        max_y = max(0.0, GRID_HEIGHT - self.view_height / self.cell_size)
+        self.x = max(0.0, min(self.x, max_x))
+        self.y = max(0.0, min(self.y, max_y))
+
+    def center_on(self, pos: Tuple[int, int]):
+        self.x = pos[0] + 0.5 - self.view_width / (2 * self.cell_size)
+        self.y = pos[1] + 0.5 - self.view_height / (2 * self.cell_size)
+        self._clamp()
+
+    def pan(self, dx_px: int, dy_px: int):
+        """Сдвигает поле вслед за курсором на (dx_px, dy_px) пикселей и отключает слежение за головой."""
+        self.x -= dx_px / self.cell_size
+        self.y -= dy_px / self.cell_size
+        self.follow = False
+        self._clamp()
+
+    def zoom(self, steps: int, anchor_px: Tuple[int, int]):
+        """Меняет масштаб на steps ступеней, оставляя клетку под anchor_px на месте."""
+        new_size = self.cell_size
+        for _ in range(abs(steps)):
+            if steps > 0:
+                new_size = max(new_size + 1, int(round(new_size * CAMERA_ZOOM_STEP)))
+            else:
+                new_size = min(new_size - 1, int(round(new_size / CAMERA_ZOOM_STEP)))
+        new_size = max(MIN_CAMERA_CELL_SIZE, min(new_size, MAX_CAMERA_CELL_SIZE))
+        anchor_x = self.x + anchor_px[0] / self.cell_size
+        anchor_y = self.y + anchor_px[1] / self.cell_size
+        self.cell_size = new_size
+        self.x = anchor_x - anchor_px[0] / new_size
+        self.y = anchor_y - anchor_px[1] / new_size
+        self._clamp()
+
+    def reset(self):
+        self.cell_size = GRIDSIZE
+        self.follow = True
+
+    def visible_cells(self) -> Tuple[int, int, int, int]:
+        """Диапазон видимых клеток [x0, x1) x [y0, y1)."""
+        x0, y0 = int(self.x), int(self.y)
+        x1 = min(GRID_WIDTH, math.ceil(self.x + self.view_width / self.cell_size))
+        y1 = min(GRID_HEIGHT, math.ceil(self.y + self.view_height / self.cell_size))
+        return x0, y0, x1, y1
+
+class ViewportRenderer(NumpyBoardRenderer):
+    """
+    Слой поля для досок, которые не помещаются в окно.
+    Массив индексов клеток ведется так же, как в NumpyBoardRenderer, но в кадр попадает
+    только его срез под камерой, поэтому стоимость кадра ограничена числом видимых клеток.
+    """
+
+    def __init__(self, camera: Camera):
+        self.camera = camera
+        super().__init__((camera.view_width, camera.view_height))
+        self._cell_surface = None # Вместо поверхности всего поля - поверхность видимого среза
+        self._view_surface: Optional[Surface] = None
+        self._view_state: Optional[Tuple[float, float, int]] = None
+
+    def render(self, snake: 'Snake', food_pos: Optional[Tuple[int, int]], path_cells: Optional[Set[Tuple[int, int]]]) -> Optional[List[pygame.Rect]]:
+        """
+        Обновляет слой поля под камерой.
+        Возвращает пустой список, если кадр не изменился, иначе None (слой перерисован целиком).
+        """
+        changed = self._update_cells(snake, food_pos, path_cells)
+        camera = self.camera
+        if camera.follow and snake.positions:
+            camera.center_on(snake.get_head_position())
+        view_state = camera.state()
+        if changed is not None and not len(changed[2]) and view_state == self._view_state:
+            return []
+        self._view_state = view_state
+        self._draw_view()
+        return None
+
+    def _draw_view(self):
+        camera = self.camera
+        cell_size = camera.cell_size
+        x0, y0, x1, y1 = camera.visible_cells()
+        view_cells = self._cells[x0:x1, y0:y1]
+        if self._view_surface is None or self._view_surface.get_size() != view_cells.shape:
+            self._view_surface = pygame.Surface(view_cells.shape, 0, self.surface)
+        pixels = pygame.surfarray.pixels2d(self._view_surface)
+        pixels[...] = self._palette[view_cells]
+        del pixels
+
+        offset_x = int((x0 - camera.x) * cell_size)
+        offset_y = int((y0 - camera.y) * cell_size)
+        scaled_size = ((x1 - x0) * cell_size, (y1 - y0) * cell_size)
+        self.surface.fill(current_colors['background'])
+        self.surface.blit(pygame.transform.scale(self._view_surface, scaled_size), (offset_x, offset_y))
+
+        if cell_size >= VIEWPORT_GRID_MIN_CELL_SIZE:
+            grid_color = current_colors['grid']
+            bottom = offset_y + scaled_size[1]
+            right = offset_x + scaled_size[0]
+            for x in range(offset_x, right, cell_size):
+                pygame.draw.line(self.surface, grid_color, (x, offset_y), (x, bottom))
+            for y in range(offset_y, bottom, cell_size):
+                pygame.draw.line(self.surface, grid_color, (offset_x, y), (right, y))
+
+def board_fits_window() -> bool:
+    return GRID_WIDTH * GRIDSIZE <= SCREEN_WIDTH and GRID_HEIGHT * GRIDSIZE <= SCREEN_HEIGHT
+
+def create_board_renderer(use_numpy_renderer: bool = False):
+    """Слой поля для текущего размера доски: с камерой, если поле не помещается в окно."""
+    if not board_fits_window():
+        return ViewportRenderer(Camera((SCREEN_WIDTH, SCREEN_HEIGHT)))
+    if use_numpy_renderer:
+        return NumpyBoardRenderer((SCREEN_WIDTH, SCREEN_HEIGHT))
+    return BoardRenderer((SCREEN_WIDTH, SCREEN_HEIGHT))
+
 class StatsCache(TypedDict):
     snake_length: Optional[int]
     current_speed: Optional[int]
@@ -1425,14 +3167,12 @@ stats_cache: StatsCache = {
     "font": None
 }
 
-def display_statistics(surface, snake_length, current_speed):
+def display_statistics(surface, snake_length, current_speed) -> List[pygame.Rect]:
+    """Рисует площадь и скорость в левом верхнем углу. Возвращает прямоугольники надписей."""
     global stats_cache
 
     if stats_cache["font"] is None:
-        try:
-            stats_cache["font"] = pygame.font.SysFont(FONT_NAME_PRIMARY, FONT_SIZE_MEDIUM)
-        except:
-            stats_cache["font"] = pygame.font.SysFont('arial', FONT_SIZE_MEDIUM - 2)
+        stats_cache["font"] = get_font(FONT_SIZE_MEDIUM)
     font = stats_cache["font"]
 
     y_offset = 10
@@ -1450,10 +3190,13 @@ def display_statistics(surface, snake_length, current_speed):
         stats_cache["speed_surf"] = font.render(f'Speed: {rounded_speed}', True, current_colors['text_white'])
     texts_to_render.append(stats_cache["speed_surf"])
 
+    drawn_rects = []
     for text_surf in texts_to_render:
         text_rect = text_surf.get_rect(topleft=(15, y_offset))
         surface.blit(text_surf, text_rect)
+        drawn_rects.append(text_rect)
         y_offset += font.get_height() + 2
+    return drawn_rects
 
 def button_animation(surface, button, color, text):
     button_rect = pygame.Rect(button)
@@ -1475,19 +3218,47 @@ def button_animation(surface, button, color, text):
         pygame.display.update(button_rect)
         pygame.time.Clock().tick(60)
 
-def replay_screen(surface, clock, history: deque):
+class RetainedCanvas:
+    """
+    Холст экрана в удерживаемом режиме.
+    Элементы регистрируются с областью, функцией отрисовки и функцией состояния;
+    refresh() перерисовывает только элементы, чье состояние изменилось с прошлого раза.
+    """
+
+    def __init__(self, size: Tuple[int, int]):
+        self.surface = pygame.Surface(size)
+        self._items: List[list] = [] # [область, draw(surface), state() -> значение, последнее состояние]
+        self._theme: Optional[str] = None
+
+    def add(self, area: pygame.Rect, draw, state=lambda: None):
+        self._items.append([area, draw, state, None])
+
+    def refresh(self) -> bool:
+        """Перерисовывает изменившиеся элементы. Возвращает True, если холст изменился."""
+        if self._theme != current_theme:
+            self._theme = current_theme
+            self.surface.fill(current_colors['background'])
+            for item in self._items:
+                item[3] = self # Заведомо не совпадет ни с одним состоянием
+        changed = False
+        for item in self._items:
+            area, draw, state, last_state = item
+            new_state = state()
+            if new_state != last_state or last_state is self:
+                self.surface.set_clip(area)
+                self.surface.fill(current_colors['background'])
+                draw(self.surface)
+                self.surface.set_clip(None)
+                item[3] = new_state
+                changed = True
+        return changed
+
+def replay_screen(surface, clock, history: MoveHistory):
     """Экран перемотки последних ходов после Game Over."""
     if not history:
         return False
 
-    try:
-        font_title = pygame.font.SysFont(FONT_NAME_PRIMARY, FONT_SIZE_LARGE, bold=True)
-        font_info = pygame.font.SysFont(FONT_NAME_PRIMARY, FONT_SIZE_MEDIUM)
-    except:
-        font_title = pygame.font.SysFont('arial', FONT_SIZE_LARGE - 2, bold=True)
-        font_info = pygame.font.SysFont('arial', FONT_SIZE_MEDIUM - 2)
-
-    title_surf = font_title.render("Game Replay", True, current_colors['text_highlight'])
+    title_surf = render_text("Game Replay", FONT_SIZE_LARGE, current_colors['text_highlight'], bold=True)
     title_rect = title_surf.get_rect(center=(SCREEN_WIDTH // 2, 40))
 
     history_len = len(history)
@@ -1517,7 +3288,9 @@ def replay_screen(surface, clock, history: deque):
     main_menu_clicked = False
 
     replay_snake = Snake()
-    replay_food = Food()
+    replay_food_pos: Optional[Tuple[int, int]] = None
+    replay_renderer = create_board_renderer()
+    shown_replay_index = -1 # Кадр истории, загруженный в replay_snake
 
     running = True
     while running:
@@ -1558,11 +3331,10 @@ def replay_screen(surface, clock, history: deque):
                         main_menu_clicked = True
             elif event.type == pygame.MOUSEBUTTONUP:
                 if retry_clicked and is_retry_hovered:
-                    if eat_sound: eat_sound.play()
+                    play_sound('eat')
                     return True
                 elif main_menu_clicked and is_main_menu_hovered:
-                    if eat_sound:
-                        eat_sound.play()
+                    play_sound('eat')
                     return False
                 retry_clicked = False
                 main_menu_clicked = False
@@ -1574,20 +3346,16 @@ def replay_screen(surface, clock, history: deque):
         if replay_index != prev_replay_index:
              replay_slider.label = f"Step: {replay_index+1}/{history_len}"
 
-        current_snake_positions_list, current_food_pos = history[replay_index]
-        replay_snake.positions = deque(current_snake_positions_list)
-        replay_snake.positions_set = set(replay_snake.positions)
-        replay_snake._update_caches()
-        replay_food.position = current_food_pos if current_food_pos else (-1, -1)
+        if replay_index != shown_replay_index:
+            current_snake_positions_list, current_food_pos = history[replay_index]
+            replay_snake.set_body(current_snake_positions_list)
+            replay_food_pos = current_food_pos
+            shown_replay_index = replay_index
 
-        surface.fill(current_colors['background'])
-        draw_grid(surface)
+        replay_renderer.render(replay_snake, replay_food_pos, None)
+        surface.blit(replay_renderer.surface, (0, 0))
         surface.blit(title_surf, title_rect)
 
-        replay_snake.draw(surface)
-        if replay_food.position != (-1, -1):
-             replay_food.draw(surface)
-
         replay_slider.draw(surface)
         draw_button(surface, retry_button_rect, current_colors['button'], "Retry Game", is_retry_hovered, is_retry_clicked)
         draw_button(surface, quit_button_rect, current_colors['button'], "Main Menu", is_main_menu_hovered, is_main_menu_clicked)
@@ -1595,17 +3363,12 @@ def replay_screen(surface, clock, history: deque):
         pygame.display.update()
         clock.tick(60) # Высокий FPS для экрана повтора чтобы UI был отзывчивым
 
-def game_over_screen(surface, clock, snake_length, current_speed, history: deque):
+def game_over_screen(surface, clock, snake_length, current_speed, history: MoveHistory):
     """Экран Game Over теперь просто вызывает replay_screen."""
     return replay_screen(surface, clock, history)
 
-def settings_screen(surface, clock, current_speed, current_volume, mute, current_fill_percent, current_show_path, current_theme="default", current_max_fps=60) -> Tuple[int, int, bool, int, bool, str, int]:
-    try:
-        font_title = pygame.font.SysFont(FONT_NAME_PRIMARY, FONT_SIZE_XLARGE, bold=True)
-    except:
-        font_title = pygame.font.SysFont('arial', FONT_SIZE_XLARGE - 4, bold=True)
-
-    title_surf = font_title.render("Settings", True, current_colors['text_white'])
+def settings_screen(surface, clock, current_speed, current_volume, mute, current_fill_percent, current_show_path, current_theme="default", current_max_fps=60, current_numpy_renderer=False) -> Tuple[int, int, bool, int, bool, str, int, bool]:
+    title_surf = render_text("Settings", FONT_SIZE_XLARGE, current_colors['text_white'], bold=True)
     title_rect = title_surf.get_rect(center=(SCREEN_WIDTH // 2, 60))
 
     slider_width = 350
@@ -1632,6 +3395,9 @@ def settings_screen(surface, clock, current_speed, current_volume, mute, current
     show_path_checkbox = Checkbox(widget_x, y_pos, checkbox_size, "Show AI Path", current_show_path)
     y_pos += 45
 
+    numpy_renderer_checkbox = Checkbox(widget_x, y_pos, checkbox_size, "NumPy Renderer", current_numpy_renderer)
+    y_pos += 45
+
     theme_selector = ThemeSelector(widget_x, y_pos, slider_width, current_theme_name=current_theme)
     y_pos += theme_selector.total_height + 40
 
@@ -1650,6 +3416,7 @@ def settings_screen(surface, clock, current_speed, current_volume, mute, current
     scroll_y = 0
     content_height = y_pos + button_height + 40
     view_height = SCREEN_HEIGHT
+    shown_scroll_y: Optional[int] = None
     scrollbar_width = 15
     scrollbar_margin = 5
     scrollbar_x = SCREEN_WIDTH - scrollbar_width - scrollbar_margin
@@ -1675,26 +3442,65 @@ def settings_screen(surface, clock, current_speed, current_volume, mute, current
     original_show_path = current_show_path
     original_theme = current_theme
     original_max_fps = current_max_fps
+    original_numpy_renderer = current_numpy_renderer
     
     settings_just_applied = False
 
-    running = True
-    while running:
-        mouse_pos = pygame.mouse.get_pos()
-        
-        scroll_mouse_pos = (mouse_pos[0], mouse_pos[1] + scroll_y)
-        
+    is_back_hovered = is_apply_hovered = is_reset_hovered = False
+    scroll_mouse_pos = (0, 0)
+
+    def get_scrollbar_geometry(scroll_y):
+        """Доля прокрутки, полоса прокрутки и ее ручка для смещения scroll_y."""
+        scroll_ratio = 0
         if content_height > view_height:
             scrollbar_height = int(view_height - 2 * scrollbar_margin)
             handle_height = int(max(20, round(scrollbar_height * (view_height / content_height))))
-            scroll_ratio = scroll_y / (content_height - view_height) if content_height > view_height else 0
+            scroll_ratio = scroll_y / (content_height - view_height)
             handle_y = int(scrollbar_margin + int(scroll_ratio * (scrollbar_height - handle_height)))
-            
+
             scrollbar_rect = pygame.Rect(int(scrollbar_x), int(scrollbar_margin), int(scrollbar_width), scrollbar_height)
             scrollbar_handle_rect = pygame.Rect(int(scrollbar_x), handle_y, int(scrollbar_width), handle_height)
         else:
             scrollbar_rect = pygame.Rect(int(scrollbar_x), int(scrollbar_margin), int(scrollbar_width), 0)
             scrollbar_handle_rect = pygame.Rect(int(scrollbar_x), int(scrollbar_margin), int(scrollbar_width), 0)
+        return scroll_ratio, scrollbar_rect, scrollbar_handle_rect
+
+    # Холст со всеми элементами рисуется один раз; дальше перерисовываются только изменившиеся
+    canvas = RetainedCanvas((SCREEN_WIDTH, content_height))
+    canvas.add(title_rect.inflate(40, 10),
+               lambda s: s.blit(render_text("Settings", FONT_SIZE_XLARGE, current_colors['text_white'], bold=True), title_rect))
+    for slider in (speed_slider, max_fps_slider, volume_slider, fill_slider):
+        canvas.add(pygame.Rect(0, slider.rect.top - 40, SCREEN_WIDTH, slider.rect.height + 41),
+                   slider.draw, lambda slider=slider: int(slider.value))
+    for checkbox in (mute_checkbox, show_path_checkbox, numpy_renderer_checkbox):
+        canvas.add(pygame.Rect(0, checkbox.rect.top - 5, SCREEN_WIDTH, checkbox.rect.height + 10),
+                   checkbox.draw, lambda checkbox=checkbox: checkbox.checked)
+    canvas.add(theme_selector.rect,
+               lambda s: theme_selector.draw(s, mouse_pos=scroll_mouse_pos),
+               lambda: (theme_selector.selected_index, theme_selector.item_at(scroll_mouse_pos)))
+    canvas.add(back_button_rect,
+               lambda s: draw_button(s, back_button_rect, current_colors['button'], "Back", is_back_hovered, back_clicked),
+               lambda: (is_back_hovered, back_clicked))
+    canvas.add(apply_button_rect,
+               lambda s: draw_button(s, apply_button_rect, current_colors['button'], "Apply", is_apply_hovered, apply_clicked),
+               lambda: (is_apply_hovered, apply_clicked))
+    canvas.add(reset_button_rect,
+               lambda s: draw_button(s, reset_button_rect, current_colors['text_highlight'], "Reset", is_reset_hovered, reset_clicked),
+               lambda: (is_reset_hovered, reset_clicked))
+
+    running = True
+    while running:
+        if notification_active or dragging_scrollbar:
+            events = pygame.event.get()
+        else:
+            # Без анимаций экран ждет событий вместо холостой перерисовки
+            events = [pygame.event.wait(MENU_IDLE_WAIT_MS)] + pygame.event.get()
+
+        mouse_pos = pygame.mouse.get_pos()
+        
+        scroll_mouse_pos = (mouse_pos[0], mouse_pos[1] + scroll_y)
+        
+        scroll_ratio, scrollbar_rect, scrollbar_handle_rect = get_scrollbar_geometry(scroll_y)
 
         is_back_hovered = back_button_rect.collidepoint(scroll_mouse_pos)
         is_back_clicked = back_clicked
@@ -1703,11 +3509,12 @@ def settings_screen(surface, clock, current_speed, current_volume, mute, current
         is_reset_hovered = reset_button_rect.collidepoint(scroll_mouse_pos)
         is_reset_clicked = reset_clicked
 
-        for event in pygame.event.get():
+        for event in events:
             if event.type == pygame.QUIT:
                 if confirmation_dialog(surface, clock, "Quit Game?"):
                     pygame.quit()
                     sys.exit()
+                shown_scroll_y = None # Диалог рисовал поверх экрана
             
             elif event.type == pygame.MOUSEBUTTONDOWN:
                 if event.button in [1, 2, 3]:
@@ -1722,8 +3529,7 @@ def settings_screen(surface, clock, current_speed, current_volume, mute, current
                         reset_clicked = True
             elif event.type == pygame.MOUSEBUTTONUP:
                 if back_clicked and is_back_hovered:
-                    if eat_sound:
-                        eat_sound.play()
+                    play_sound('eat')
 
                     selected_speed = speed_slider.value
                     selected_volume = volume_slider.value
@@ -1732,6 +3538,7 @@ def settings_screen(surface, clock, current_speed, current_volume, mute, current
                     should_show_path = show_path_checkbox.checked
                     selected_theme = theme_selector.current_theme_name
                     selected_max_fps = max_fps_slider.value
+                    selected_numpy_renderer = numpy_renderer_checkbox.checked
 
                     settings_changed = (
                         selected_speed != original_speed or
@@ -1740,11 +3547,13 @@ def settings_screen(surface, clock, current_speed, current_volume, mute, current
                         selected_fill_percent != original_fill_percent or
                         should_show_path != original_show_path or
                         selected_theme != original_theme or
-                        selected_max_fps != original_max_fps
+                        selected_max_fps != original_max_fps or
+                        selected_numpy_renderer != original_numpy_renderer
                     )
 
                     if settings_changed and not settings_just_applied:
                         dialog_result = unsaved_settings_dialog(surface, clock)
+                        shown_scroll_y = None
 
                         if dialog_result == "save":
                             original_speed = selected_speed
@@ -1754,24 +3563,21 @@ def settings_screen(surface, clock, current_speed, current_volume, mute, current
                             original_show_path = should_show_path
                             original_theme = selected_theme
                             original_max_fps = selected_max_fps
+                            original_numpy_renderer = selected_numpy_renderer
 
-                            if eat_sound:
-                                eat_sound.set_volume(0 if is_muted else selected_volume / 100)
+                            set_sound_volume('eat', 0 if is_muted else selected_volume / 100)
 
                             running = False
                         elif dialog_result == "discard":
                             set_theme(original_theme)
-                            if eat_sound:
-                                eat_sound.set_volume(0 if original_mute else original_volume / 100)
+                            set_sound_volume('eat', 0 if original_mute else original_volume / 100)
                             running = False
                     else:
                         set_theme(original_theme)
-                        if eat_sound:
-                            eat_sound.set_volume(0 if original_mute else original_volume / 100)
+                        set_sound_volume('eat', 0 if original_mute else original_volume / 100)
                         running = False
                 elif apply_clicked and is_apply_hovered:
-                    if eat_sound:
-                        eat_sound.play()
+                    play_sound('eat')
                     
                     current_speed = speed_slider.value
                     current_volume = volume_slider.value
@@ -1780,6 +3586,7 @@ def settings_screen(surface, clock, current_speed, current_volume, mute, current
                     current_show_path = show_path_checkbox.checked
                     current_theme = theme_selector.current_theme_name
                     current_max_fps = max_fps_slider.value
+                    current_numpy_renderer = numpy_renderer_checkbox.checked
                     
                     original_speed = current_speed
                     original_volume = current_volume
@@ -1788,9 +3595,9 @@ def settings_screen(surface, clock, current_speed, current_volume, mute, current
                     original_show_path = current_show_path
                     original_theme = current_theme
                     original_max_fps = current_max_fps
+                    original_numpy_renderer = current_numpy_renderer
                     
-                    if eat_sound:
-                        eat_sound.set_volume(0 if mute else current_volume / 100)
+                    set_sound_volume('eat', 0 if mute else current_volume / 100)
                         
                     notification_active = True
                     notification_text = "Settings Applied!"
@@ -1800,8 +3607,7 @@ def settings_screen(surface, clock, current_speed, current_volume, mute, current
                     settings_just_applied = True
                         
                 elif reset_clicked and is_reset_hovered:
-                    if eat_sound:
-                        eat_sound.play()
+                    play_sound('eat')
                     selected_speed = 15
                     selected_volume = 1
                     is_muted = False
@@ -1809,6 +3615,7 @@ def settings_screen(surface, clock, current_speed, current_volume, mute, current
                     should_show_path = False
                     selected_theme = "default"
                     selected_max_fps = 60
+                    selected_numpy_renderer = False
                     
                     theme_selector.current_theme_name = selected_theme
                     for i, theme in enumerate(theme_selector.themes):
@@ -1827,11 +3634,11 @@ def settings_screen(surface, clock, current_speed, current_volume, mute, current
                     fill_slider.update_handle_pos()
                     mute_checkbox.checked = is_muted
                     show_path_checkbox.checked = should_show_path
+                    numpy_renderer_checkbox.checked = selected_numpy_renderer
                     max_fps_slider.value = selected_max_fps
                     max_fps_slider.update_handle_pos()
                     
-                    if eat_sound:
-                        eat_sound.set_volume(0 if is_muted else selected_volume / 100)
+                    set_sound_volume('eat', 0 if is_muted else selected_volume / 100)
                 dragging_scrollbar = False
                 back_clicked = False
                 apply_clicked = False
@@ -1862,6 +3669,7 @@ def settings_screen(surface, clock, current_speed, current_volume, mute, current
             fill_slider.handle_event(adjusted_event)
             mute_checkbox.handle_event(adjusted_event)
             show_path_checkbox.handle_event(adjusted_event)
+            numpy_renderer_checkbox.handle_event(adjusted_event)
             max_fps_slider.handle_event(adjusted_event)
 
             theme_selector.handle_event(adjusted_event)
@@ -1875,6 +3683,7 @@ def settings_screen(surface, clock, current_speed, current_volume, mute, current
                     should_show_path = show_path_checkbox.checked
                     selected_theme = theme_selector.current_theme_name
                     selected_max_fps = max_fps_slider.value
+                    selected_numpy_renderer = numpy_renderer_checkbox.checked
 
                     settings_changed = (
                         selected_speed != original_speed or
@@ -1883,11 +3692,13 @@ def settings_screen(surface, clock, current_speed, current_volume, mute, current
                         selected_fill_percent != original_fill_percent or
                         should_show_path != original_show_path or
                         selected_theme != original_theme or
-                        selected_max_fps != original_max_fps
+                        selected_max_fps != original_max_fps or
+                        selected_numpy_renderer != original_numpy_renderer
                     )
 
                     if settings_changed and not settings_just_applied:
                         dialog_result = unsaved_settings_dialog(surface, clock)
+                        shown_scroll_y = None
                         if dialog_result == "save":
                             original_speed = selected_speed
                             original_volume = selected_volume
@@ -1896,18 +3707,16 @@ def settings_screen(surface, clock, current_speed, current_volume, mute, current
                             original_show_path = should_show_path
                             original_theme = selected_theme
                             original_max_fps = selected_max_fps
-                            if eat_sound:
-                                eat_sound.set_volume(0 if is_muted else selected_volume / 100)
+                            original_numpy_renderer = selected_numpy_renderer
+                            set_sound_volume('eat', 0 if is_muted else selected_volume / 100)
                             running = False
                         elif dialog_result == "discard":
                             set_theme(original_theme)
-                            if eat_sound:
-                                eat_sound.set_volume(0 if original_mute else original_volume / 100)
+                            set_sound_volume('eat', 0 if original_mute else original_volume / 100)
                             running = False
                     else:
                         set_theme(original_theme)
-                        if eat_sound:
-                            eat_sound.set_volume(0 if original_mute else original_volume / 100)
+                        set_sound_volume('eat', 0 if original_mute else original_volume / 100)
                         running = False
 
         selected_speed = speed_slider.value
@@ -1917,77 +3726,29 @@ def settings_screen(surface, clock, current_speed, current_volume, mute, current
         should_show_path = show_path_checkbox.checked
         selected_theme = theme_selector.current_theme_name
         selected_max_fps = max_fps_slider.value
+        selected_numpy_renderer = numpy_renderer_checkbox.checked
         
-        if eat_sound:
-            eat_sound.set_volume(0 if is_muted else selected_volume / 100)
+        set_sound_volume('eat', 0 if is_muted else selected_volume / 100)
 
-        surface.fill(current_colors['background'])
-        
-        content_surface = pygame.Surface((SCREEN_WIDTH, content_height))
-        content_surface.fill(current_colors['background'])
-        
-        title_rect_onscreen = title_surf.get_rect(center=(SCREEN_WIDTH // 2, 60))
-        surface.blit(title_surf, title_rect_onscreen)
-        
-        y_pos_draw = title_rect_onscreen.bottom + 50
-        
-        original_speed_rect = speed_slider.rect.copy()
-        speed_slider.rect.topleft = (widget_x, y_pos_draw)
-        speed_slider.draw(content_surface)
-        speed_slider.rect = original_speed_rect
-        y_pos_draw += 70
-        
-        original_max_fps_rect = max_fps_slider.rect.copy()
-        max_fps_slider.rect.topleft = (widget_x, y_pos_draw)
-        max_fps_slider.draw(content_surface)
-        max_fps_slider.rect = original_max_fps_rect
-        y_pos_draw += 70
-        
-        original_volume_rect = volume_slider.rect.copy()
-        volume_slider.rect.topleft = (widget_x, y_pos_draw)
-        volume_slider.draw(content_surface)
-        volume_slider.rect = original_volume_rect
-        y_pos_draw += 70
-        
-        original_fill_rect = fill_slider.rect.copy()
-        fill_slider.rect.topleft = (widget_x, y_pos_draw)
-        fill_slider.draw(content_surface)
-        fill_slider.rect = original_fill_rect
-        y_pos_draw += 70
-        
-        original_mute_rect = mute_checkbox.rect.copy()
-        mute_checkbox.rect.topleft = (widget_x, y_pos_draw)
-        mute_checkbox.draw(content_surface)
-        mute_checkbox.rect = original_mute_rect
-        y_pos_draw += 45
-        
-        original_show_path_rect = show_path_checkbox.rect.copy()
-        show_path_checkbox.rect.topleft = (widget_x, y_pos_draw)
-        show_path_checkbox.draw(content_surface)
-        show_path_checkbox.rect = original_show_path_rect
-        y_pos_draw += 45
-        
-        original_theme_rect = theme_selector.rect.copy()
-        theme_selector.rect.topleft = (widget_x, y_pos_draw)
-        theme_selector.draw(content_surface, scroll_y=int(scroll_y), mouse_pos=scroll_mouse_pos)
-        theme_selector.rect = original_theme_rect
-        y_pos_draw += theme_selector.total_height + 40
-        
-        original_reset_rect = reset_button_rect.copy()
-        original_apply_rect = apply_button_rect.copy()
-        original_back_rect = back_button_rect.copy()
-        reset_button_rect.topleft = (SCREEN_WIDTH // 2 - total_width // 2, y_pos_draw)
-        apply_button_rect.topleft = (reset_button_rect.right + button_spacing, y_pos_draw)
-        back_button_rect.topleft = (apply_button_rect.right + button_spacing, y_pos_draw)
-        draw_button(content_surface, back_button_rect, current_colors['button'], "Back", is_back_hovered, is_back_clicked)
-        draw_button(content_surface, apply_button_rect, current_colors['button'], "Apply", is_apply_hovered, is_apply_clicked)
-        draw_button(content_surface, reset_button_rect, current_colors['text_highlight'], "Reset", is_reset_hovered, is_reset_clicked)
-        reset_button_rect = original_reset_rect
-        apply_button_rect = original_apply_rect
-        back_button_rect = original_back_rect
+        # Область под курсором пересчитывается после обработки событий (прокрутка могла сместить ее)
+        scroll_mouse_pos = (mouse_pos[0], mouse_pos[1] + scroll_y)
+        is_back_hovered = back_button_rect.collidepoint(scroll_mouse_pos)
+        is_apply_hovered = apply_button_rect.collidepoint(scroll_mouse_pos)
+        is_reset_hovered = reset_button_rect.collidepoint(scroll_mouse_pos)
+
+        canvas_changed = canvas.refresh()
+        if not (canvas_changed or notification_active or int(scroll_y) != shown_scroll_y):
+            # Кадр не изменился: экран не перерисовывается. Тик ограничивает цикл и тогда, когда
+            # события не ожидаются (перетаскивание ползунка прокрутки), иначе он крутится вхолостую
+            clock.tick(current_max_fps)
+            continue
+        shown_scroll_y = int(scroll_y)
+        scroll_ratio, scrollbar_rect, scrollbar_handle_rect = get_scrollbar_geometry(scroll_y)
 
+        surface.fill(current_colors['background'])
+        # Прокрутка - один blit видимой части холста
         visible_content_rect = pygame.Rect(0, int(scroll_y), SCREEN_WIDTH - (scrollbar_width + 2 * scrollbar_margin if scrollbar_rect.height > 0 else 0), view_height)
-        surface.blit(content_surface, (0, 0), visible_content_rect)
+        surface.blit(canvas.surface, (0, 0), visible_content_rect)
         
         if scrollbar_rect.height > 0:
             pygame.draw.rect(surface, current_colors['slider_bg'], scrollbar_rect, border_radius=7)
@@ -2005,12 +3766,8 @@ def settings_screen(surface, clock, current_speed, current_volume, mute, current
                 else:
                     notification_alpha = 255
                 
-                try:
-                    notification_font = pygame.font.SysFont(FONT_NAME_PRIMARY, FONT_SIZE_LARGE, bold=True)
-                except:
-                    notification_font = pygame.font.SysFont('arial', FONT_SIZE_LARGE - 2, bold=True)
-                
-                notification_surf = notification_font.render(notification_text, True, current_colors['text_highlight'])
+                # Своя копия надписи: ниже ей меняется альфа
+                notification_surf = get_font(FONT_SIZE_LARGE, bold=True).render(notification_text, True, current_colors['text_highlight'])
                 notification_surf.set_alpha(notification_alpha)
                 
                 padding = 20
@@ -2034,20 +3791,10 @@ def settings_screen(surface, clock, current_speed, current_volume, mute, current
         pygame.display.update()
         clock.tick(current_max_fps)
 
-    return original_speed, original_volume, original_mute, original_fill_percent, original_show_path, original_theme, original_max_fps
+    return original_speed, original_volume, original_mute, original_fill_percent, original_show_path, original_theme, original_max_fps, original_numpy_renderer
 
-def start_screen(surface, clock, initial_speed, initial_volume, initial_mute, initial_fill_percent, initial_show_path, initial_theme="default", initial_max_fps=60) -> Tuple[str, int, int, bool, int, bool, str, int]:
-    try:
-        font_title = pygame.font.SysFont(FONT_NAME_PRIMARY, FONT_SIZE_XLARGE, bold=True)
-    except:
-        font_title = pygame.font.SysFont('arial', FONT_SIZE_XLARGE - 4, bold=True)
-
-    try:
-        font_small = pygame.font.SysFont(FONT_NAME_PRIMARY, FONT_SIZE_MEDIUM)
-    except:
-        font_small = pygame.font.SysFont('arial', FONT_SIZE_MEDIUM - 2)
-
-    title_surf = font_title.render("Modern Snake", True, current_colors['text_white'])
+def start_screen(surface, clock, initial_speed, initial_volume, initial_mute, initial_fill_percent, initial_show_path, initial_theme="default", initial_max_fps=60, initial_numpy_renderer=False, initial_board_state=None) -> Tuple[str, int, int, bool, int, bool, str, int, bool, Optional[Dict[str, Any]]]:
+    title_surf = render_text("Modern Snake", FONT_SIZE_XLARGE, current_colors['text_white'], bold=True)
     title_rect = title_surf.get_rect(center=(SCREEN_WIDTH // 2, SCREEN_HEIGHT // 3))
 
     button_width = 250
@@ -2079,8 +3826,12 @@ def start_screen(surface, clock, initial_speed, initial_volume, initial_mute, in
     show_path_visualization = initial_show_path
     current_theme = initial_theme
     current_max_fps = initial_max_fps
+    use_numpy_renderer = initial_numpy_renderer
+    board_state = initial_board_state # Состояние поля, с которого начнется игра (файл перетаскивается в окно)
+    board_state_error: Optional[str] = None
     set_theme(current_theme)
     waiting = True
+    startup_profiler.mark('start screen setup')
 
     while waiting:
         mouse_pos = pygame.mouse.get_pos()
@@ -2100,29 +3851,37 @@ def start_screen(surface, clock, initial_speed, initial_volume, initial_mute, in
             if event.type == pygame.MOUSEBUTTONUP:
                 for key, data in buttons.items():
                     if data["clicked"] and hover_states[key]:
-                        if eat_sound and not mute:
-                            eat_sound.play()
+                        if not mute:
+                            play_sound('eat')
 
                         if key == 'manual':
-                            return 'manual', int(current_speed), int(current_volume), mute, current_fill_percent, show_path_visualization, current_theme, int(current_max_fps)
+                            return 'manual', int(current_speed), int(current_volume), mute, current_fill_percent, show_path_visualization, current_theme, int(current_max_fps), use_numpy_renderer, board_state
                         elif key == 'auto':
-                            return 'auto', int(current_speed), int(current_volume), mute, current_fill_percent, show_path_visualization, current_theme, int(current_max_fps)
+                            return 'auto', int(current_speed), int(current_volume), mute, current_fill_percent, show_path_visualization, current_theme, int(current_max_fps), use_numpy_renderer, board_state
                         elif key == 'settings':
-                            current_speed, current_volume, mute, current_fill_percent, show_path_visualization, current_theme, current_max_fps = settings_screen(
-                                surface, clock, current_speed, current_volume, mute, current_fill_percent, show_path_visualization, current_theme, current_max_fps
+                            current_speed, current_volume, mute, current_fill_percent, show_path_visualization, current_theme, current_max_fps, use_numpy_renderer = settings_screen(
+                                surface, clock, current_speed, current_volume, mute, current_fill_percent, show_path_visualization, current_theme, current_max_fps, use_numpy_renderer
                             )
-                            if eat_sound:
-                                eat_sound.set_volume(0 if mute else current_volume / 100)
+                            set_sound_volume('eat', 0 if mute else current_volume / 100)
                             buttons["manual"]["color"] = current_colors['button']
                             buttons["auto"]["color"] = current_colors['button']
                             buttons["settings"]["color"] = current_colors['text_highlight']
                             buttons["quit"]["color"] = current_colors['button']
-                            title_surf = font_title.render("Modern Snake", True, current_colors['text_white'])
+                            title_surf = render_text("Modern Snake", FONT_SIZE_XLARGE, current_colors['text_white'], bold=True)
                         elif key == 'quit':
                             if confirmation_dialog(surface, clock, "Quit Game?"):
                                 pygame.quit()
                                 sys.exit()
                     buttons[key]["clicked"] = False
+            if event.type == pygame.DROPFILE:
+                try:
+                    board_state = load_board_fixture(event.file)
+                    board_state_error = None
+                except (OSError, ValueError, KeyError, TypeError) as e:
+                    board_state_error = f"Could not load {os.path.basename(event.file)}: {e}"
+            if event.type == pygame.KEYDOWN and event.key in (pygame.K_DELETE, pygame.K_BACKSPACE):
+                board_state = None
+                board_state_error = None
 
         surface.fill(current_colors['background'])
         surface.blit(title_surf, title_rect)
@@ -2130,9 +3889,21 @@ def start_screen(surface, clock, initial_speed, initial_volume, initial_mute, in
         for key, data in buttons.items():
             draw_button(surface, data['rect'], data['color'], data['text'], hover_states[key], click_states[key])
 
+        if board_state_error:
+            state_text, state_color = board_state_error, current_colors['food']
+        elif board_state is not None:
+            width, height = board_state['grid']
+            state_text = f"Start position: {width}x{height}, length {len(board_state['body'])} (Del to clear)"
+            state_color = current_colors['text_highlight']
+        else:
+            state_text, state_color = "Drop a saved state file here to start from it", current_colors['text']
+        state_surf = render_text(state_text, FONT_SIZE_TINY, state_color)
+        surface.blit(state_surf, state_surf.get_rect(center=(SCREEN_WIDTH // 2, SCREEN_HEIGHT - 20)))
+
         pygame.display.update()
+        startup_profiler.first_frame()
         clock.tick(current_max_fps)
-    return 'manual', 15, 1, False, 0, False, "default", 60
+    return 'manual', 15, 1, False, 0, False, "default", 60, False, None
 
 def pause_screen(surface, clock):
     overlay = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT))
@@ -2140,20 +3911,11 @@ def pause_screen(surface, clock):
     overlay.fill(current_colors['background'])
     surface.blit(overlay, (0, 0))
 
-    try:
-        font = pygame.font.SysFont(FONT_NAME_PRIMARY, FONT_SIZE_XLARGE, bold=True)
-    except:
-        font = pygame.font.SysFont('arial', FONT_SIZE_XLARGE - 4, bold=True)
-
-    pause_text = font.render("Paused", True, current_colors['text_white'])
+    pause_text = render_text("Paused", FONT_SIZE_XLARGE, current_colors['text_white'], bold=True)
     pause_rect = pause_text.get_rect(center=(SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2))
     surface.blit(pause_text, pause_rect)
 
-    try:
-        font_hint = pygame.font.SysFont(FONT_NAME_PRIMARY, FONT_SIZE_MEDIUM)
-    except:
-        font_hint = pygame.font.SysFont('arial', FONT_SIZE_MEDIUM - 2)
-    hint_text = font_hint.render("Press 'P' or Space to resume", True, current_colors['text'])
+    hint_text = render_text("Press 'P' or Space to resume", FONT_SIZE_MEDIUM, current_colors['text'])
     hint_rect = hint_text.get_rect(center=(SCREEN_WIDTH // 2, pause_rect.bottom + 40))
     surface.blit(hint_text, hint_rect)
 
@@ -2177,14 +3939,7 @@ def confirmation_dialog(surface, clock, question) -> bool:
     overlay.fill(current_colors['background'])
     surface.blit(overlay, (0, 0))
 
-    try:
-        font_question = pygame.font.SysFont(FONT_NAME_PRIMARY, FONT_SIZE_LARGE)
-        font_button = pygame.font.SysFont(FONT_NAME_PRIMARY, FONT_SIZE_MEDIUM)
-    except:
-        font_question = pygame.font.SysFont('arial', FONT_SIZE_LARGE - 2)
-        font_button = pygame.font.SysFont('arial', FONT_SIZE_MEDIUM - 2)
-
-    question_surf = font_question.render(question, True, current_colors['text_white'])
+    question_surf = render_text(question, FONT_SIZE_LARGE, current_colors['text_white'])
     question_rect = question_surf.get_rect(center=(SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2 - 60))
     surface.blit(question_surf, question_rect)
 
@@ -2222,11 +3977,11 @@ def confirmation_dialog(surface, clock, question) -> bool:
                         no_clicked = True
             if event.type == pygame.MOUSEBUTTONUP:
                 if yes_clicked and is_yes_hovered:
-                    if eat_sound: eat_sound.play()
+                    play_sound('eat')
                     pygame.time.wait(150)
                     return True
                 elif no_clicked and is_no_hovered:
-                    if eat_sound: eat_sound.play()
+                    play_sound('eat')
                     pygame.time.wait(150)
                     return False
                 yes_clicked = False
@@ -2259,124 +4014,211 @@ def get_direction_vector(pos1: Tuple[int, int], pos2: Tuple[int, int]) -> Tuple[
 
     return dx, dy
 
-# --- Функция для отрисовки графика LPS (бывший FPS) ---
-def draw_lps_graph(surface: Surface, history: Deque[TimestampedValue], x: int, y: int, width: int, height: int, color: pygame.Color, font: Font):
-    """Рисует простой линейный график на основе истории значений (LPS) и добавляет подпись."""
-    if not history:
-        return
-    history_len = len(history)
-    max_lps_hist = 1.0
-    if history_len > 0:
-        # Фильтруем только последние 5 секунд для графика
-        recent_values = get_values_in_timespan(history, 5.0)
-        if recent_values:
-            # Масштабируем по недавним РЕАЛЬНЫМ значениям
-            max_lps_hist = max(15.0, max(recent_values) * 1.1) # Минимум 15 для адекватного вида
-    # Dynamic scaling based on logic speed
-    dynamic_max_y = max(30.0, max_lps_hist) # Убрал множитель 1.1, т.к. уже есть в max_lps_hist
-
-    points = []
-    for i, item in enumerate(history):
-        lps = item.value # Actual LPS value
-        # Normalize based on dynamic_max_y for logic speed
-        normalized_y = 1.0 - max(0.0, min(1.0, lps / dynamic_max_y if dynamic_max_y > 1e-6 else 0.0))
-        point_x = x + int((i / (history_len - 1 if history_len > 1 else 1)) * width)
-        point_y = y + int(normalized_y * height)
-        points.append((point_x, point_y))
-
-    if len(points) >= 2:
-        pygame.draw.lines(surface, color, False, points, 1)
-    elif len(points) == 1:
-        pygame.draw.circle(surface, color, points[0], 2)
-
-    # Добавляем подпись "LPS"
-    label_surf = font.render("LPS", True, color.lerp((255,255,255), 0.5))
-    label_rect = label_surf.get_rect(bottomleft=(x + 3, y + height - 3))
-    surface.blit(label_surf, label_rect)
-
-# --- Функция для отрисовки графика FPS (аналогично LPS) ---
-def draw_fps_graph(surface: Surface, history: Deque[TimestampedValue], x: int, y: int, width: int, height: int, color: pygame.Color, target_fps: float, font: Font):
-    """Рисует простой линейный график для FPS и добавляет подпись."""
-    if not history:
-        return
-    history_len = len(history)
-    max_fps_hist = 1.0
-    if history_len > 0:
-        # Фильтруем только последние 5 секунд для графика
-        recent_values = get_values_in_timespan(history, 5.0)
-        if recent_values:
-            # Scale based on target FPS and actual recent history max
-            max_fps_hist = max(target_fps * 1.1, max(recent_values) * 1.1)
-    # Ensure a minimum sensible scale
-    dynamic_max_y = max(30.0, max_fps_hist)
-
-    points = []
-    for i, item in enumerate(history):
-        fps = item.value
-        # Normalize based on dynamic_max_y for FPS values
-        normalized_y = 1.0 - max(0.0, min(1.0, fps / dynamic_max_y if dynamic_max_y > 1e-6 else 0.0))
-        point_x = x + int((i / (history_len - 1 if history_len > 1 else 1)) * width)
-        point_y = y + int(normalized_y * height)
-        points.append((point_x, point_y))
-
-    if len(points) >= 2:
-        pygame.draw.lines(surface, color, False, points, 1)
-    elif len(points) == 1:
-        pygame.draw.circle(surface, color, points[0], 2)
-
-    # Добавляем подпись "FPS"
-    label_surf = font.render("FPS", True, color.lerp((255,255,255), 0.5))
-    label_rect = label_surf.get_rect(bottomleft=(x + 3, y + height - 3))
-    surface.blit(label_surf, label_rect)
+# --- Виджет графика LPS/FPS с min/avg/max ---
+def quantize_graph_scale(value: float) -> float:
+    """Округляет верх шкалы графика вверх до ступени в четверть октавы, чтобы график перестраивался редко."""
+    return 2.0 ** (math.ceil(math.log2(max(value, 1e-6)) * 4) / 4)
+
+class StatsGraphWidget:
+    """
+    Полупрозрачный виджет: график истории значений и min/avg/max справа от него.
+    Поверхности удерживаются между кадрами: новые точки дорисовываются со сдвигом графика,
+    целиком он перестраивается только при смене шкалы, а надписи - только при смене целого значения.
+    """
+
+    GRAPH_WIDTH = 100
+    TEXT_WIDTH = 45
+    PADDING = 5
+    HEIGHT = 50
+    TEXT_MARGIN = 3
+
+    def __init__(self, topleft: Tuple[int, int], label: str, label_font: Font, value_font: Font):
+        self.rect = pygame.Rect(topleft, (self.GRAPH_WIDTH + self.PADDING + self.TEXT_WIDTH, self.HEIGHT))
+        self.surface = pygame.Surface(self.rect.size, pygame.SRCALPHA)
+        self._plot = pygame.Surface((self.GRAPH_WIDTH, self.HEIGHT), pygame.SRCALPHA)
+        self.label = label
+        self.label_font = label_font
+        self.value_font = value_font
+        self._label_surf: Optional[Surface] = None
+        self._value_surfs: Dict[str, Tuple[int, Surface]] = {} # 'max'/'avg'/'min' -> (значение, надпись)
+        self._theme: Optional[str] = None
+        self._scale = 0.0
+        self._last_total: Optional[int] = None # series.total на прошлом кадре
+        self._last_y: Optional[int] = None
+        self._x_remainder = 0.0
+        self._alpha: Optional[int] = None
+        self._needs_compose = True
+
+    def _y_for(self, value: float) -> int:
+        normalized_y = 1.0 - max(0.0, min(1.0, value / self._scale))
+        return int(normalized_y * (self.HEIGHT - 1))
+
+    def _x_step(self, series: TimeSeries) -> float:
+        return self.GRAPH_WIDTH / max(1, series.capacity - 1)
+
+    def _replot(self, series: TimeSeries, color: pygame.Color):
+        """Перестраивает график целиком (последняя точка у правого края)."""
+        self._plot.fill((0, 0, 0, 0))
+        step = self._x_step(series)
+        right = self.GRAPH_WIDTH - 1
+        values = series.values()
+        last = len(values) - 1
+        points = [(right - int((last - i) * step), self._y_for(value)) for i, value in enumerate(values)]
+        if len(points) >= 2:
+            pygame.draw.lines(self._plot, color, False, points, 1)
+        elif len(points) == 1:
+            pygame.draw.circle(self._plot, color, points[0], 2)
+        self._last_y = points[-1][1] if points else None
+        self._x_remainder = 0.0
+
+    def _append_samples(self, samples: np.ndarray, step: float, color: pygame.Color):
+        """Сдвигает график влево и дорисовывает новые точки у правого края."""
+        right = self.GRAPH_WIDTH - 1
+        for value in samples:
+            self._x_remainder += step
+            shift = int(self._x_remainder)
+            self._x_remainder -= shift
+            if shift:
+                self._plot.scroll(-shift, 0)
+                self._plot.fill((0, 0, 0, 0), pygame.Rect(self.GRAPH_WIDTH - shift, 0, shift, self.HEIGHT))
+            y = self._y_for(value)
+            if self._last_y is not None:
+                pygame.draw.line(self._plot, color, (right - shift, self._last_y), (right, y), 1)
+            self._last_y = y
+
+    def _new_samples(self, series: TimeSeries) -> Optional[np.ndarray]:
+        """Значения, добавленные после прошлого кадра, или None, если связь с прошлым кадром потеряна."""
+        if self._last_total is None:
+            return None
+        new_count = series.total - self._last_total
+        if not 0 <= new_count < len(series):
+            return None
+        return series.latest(new_count)
+
+    def _value_surf(self, key: str, value: float) -> Surface:
+        rounded = int(round(value))
+        cached = self._value_surfs.get(key)
+        if cached is None or cached[0] != rounded:
+            cached = (rounded, self.value_font.render(f"{rounded}", True, current_colors['text']))
+            self._value_surfs[key] = cached
+            self._needs_compose = True
+        return cached[1]
+
+    def update(self, series: TimeSeries, scale_floor: float):
+        """Доводит график и надписи min/avg/max (за окно статистики ряда) до текущего ряда."""
+        color = current_colors['text_highlight']
+        if self._theme != current_theme:
+            self._theme = current_theme
+            self._label_surf = self.label_font.render(self.label, True, color.lerp((255, 255, 255), 0.5))
+            self._value_surfs.clear()
+            self._scale = 0.0 # Перестроить график в цветах новой темы
+
+        min_value, avg_value, max_value = series.stats()
+        if series.total:
+            scale = quantize_graph_scale(max(30.0, scale_floor, max_value * 1.1))
+            samples = self._new_samples(series)
+            if scale != self._scale or samples is None:
+                self._scale = scale
+                self._replot(series, color)
+                self._needs_compose = True
+            elif len(samples):
+                self._append_samples(samples, self._x_step(series), color)
+                self._needs_compose = True
+            self._last_total = series.total
+
+        self._value_surf('max', max_value)
+        self._value_surf('avg', avg_value)
+        self._value_surf('min', min_value)
+
+    def draw(self, surface: Surface, alpha: int) -> pygame.Rect:
+        if self._needs_compose:
+            self._compose()
+        if alpha != self._alpha:
+            self.surface.set_alpha(alpha)
+            self._alpha = alpha
+        surface.blit(self.surface, self.rect.topleft)
+        return self.rect
+
+    def _compose(self):
+        self.surface.fill((0, 0, 0, 0))
+        pygame.draw.rect(self.surface, COLOR_PANEL_BG, self.surface.get_rect(), border_radius=4)
+        self.surface.blit(self._plot, (0, 0))
+        if self._label_surf is not None:
+            self.surface.blit(self._label_surf, self._label_surf.get_rect(bottomleft=(3, self.HEIGHT - 3)))
+
+        text_right = self.GRAPH_WIDTH + self.PADDING + self.TEXT_WIDTH - self.TEXT_MARGIN
+        anchors = {
+            'max': {'topright': (text_right, self.TEXT_MARGIN)},
+            'avg': {'midright': (text_right, self.HEIGHT // 2)},
+            'min': {'bottomright': (text_right, self.HEIGHT - self.TEXT_MARGIN)},
+        }
+        for key, anchor in anchors.items():
+            cached = self._value_surfs.get(key)
+            if cached is not None:
+                self.surface.blit(cached[1], cached[1].get_rect(**anchor))
+        self._needs_compose = False
+
+class LatencyPanel:
+    """
+    Таблица p50/p95/p99/max по фазам кадра в миллисекундах (включается клавишей F3).
+    Поверхность пересобирается только при новом снимке LatencyRecorder.
+    """
+
+    PADDING = 6
+    NAME_WIDTH = 58
+    COLUMN_WIDTH = 44
+
+    def __init__(self, topleft: Tuple[int, int]):
+        self.rect = pygame.Rect(topleft, (0, 0))
+        self.surface: Optional[Surface] = None
+        self._snapshot: Optional[Dict[str, Tuple[float, ...]]] = None
+        self._theme: Optional[str] = None
+
+    def update(self, snapshot: Dict[str, Tuple[float, ...]]):
+        if snapshot is self._snapshot and self._theme == current_theme:
+            return
+        self._snapshot = snapshot
+        self._theme = current_theme
+        header = ['ms'] + [f'p{p}' for p in LATENCY_PERCENTILES] + ['max']
+        rows = [header] + [[phase] + [f"{value * 1000:.1f}" for value in values] for phase, values in snapshot.items()]
+        line_height = get_font(FONT_SIZE_TINY).get_height()
+        self.rect.size = (2 * self.PADDING + self.NAME_WIDTH + self.COLUMN_WIDTH * (len(header) - 1),
+                          2 * self.PADDING + line_height * len(rows))
+        self.surface = pygame.Surface(self.rect.size, pygame.SRCALPHA)
+        pygame.draw.rect(self.surface, COLOR_PANEL_BG, self.surface.get_rect(), border_radius=4)
+        for row_index, row in enumerate(rows):
+            color = current_colors['text_highlight'] if row_index == 0 else current_colors['text']
+            y = self.PADDING + row_index * line_height
+            self.surface.blit(render_text(row[0], FONT_SIZE_TINY, color), (self.PADDING, y))
+            for column, cell in enumerate(row[1:], start=1):
+                text_surf = render_text(cell, FONT_SIZE_TINY, color)
+                right = self.PADDING + self.NAME_WIDTH + self.COLUMN_WIDTH * column
+                self.surface.blit(text_surf, text_surf.get_rect(topright=(right, y)))
+
+    def draw(self, surface: Surface) -> pygame.Rect:
+        if self.surface is not None:
+            surface.blit(self.surface, self.rect.topleft)
+        return self.rect
 
 MAX_LOGIC_TIME_PER_FRAME = 0.85 # Max % of frame time for logic
 STATS_DISPLAY_SECONDS = 5.0 # Display stats for the last 5 seconds
+LATENCY_OVERLAY_SECONDS = 2.0 # Окно перцентилей на оверлее задержек
+MAX_DIRTY_RECTS_PER_FRAME = 150 # Above this, present the whole frame instead of dirty rects
 
-def main():
+def main(metrics_sink: Optional[MetricsSink] = None, watchdog: Optional[SlowStepWatchdog] = None,
+         board_state: Optional[Dict[str, Any]] = None):
     pygame.display.set_caption('Modern Snake Game')
     screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
     clock = pygame.time.Clock()
-    eat_sound = None
-    melody_sound = None # Initialize melody_sound
+    startup_profiler.mark('create window')
 
     # --- Font Initialization ---
-    try:
-        font_icon = pygame.font.SysFont(FONT_NAME_PRIMARY, FONT_SIZE_MEDIUM)
-        font_panel = pygame.font.SysFont(FONT_NAME_PRIMARY, FONT_SIZE_SMALL)
-        font_tiny = pygame.font.SysFont(FONT_NAME_PRIMARY, FONT_SIZE_TINY)
-        font_graph_label = pygame.font.SysFont(FONT_NAME_PRIMARY, FONT_SIZE_TINY - 2) # Шрифт для подписей графиков
-    except Exception as e:
-        print(f"Primary font ('{FONT_NAME_PRIMARY}') not found, using fallback 'arial'. Error: {e}")
-        try:
-            font_icon = pygame.font.SysFont('arial', FONT_SIZE_MEDIUM - 2)
-            font_panel = pygame.font.SysFont('arial', FONT_SIZE_SMALL - 2)
-            font_tiny = pygame.font.SysFont('arial', FONT_SIZE_TINY - 1)
-            font_graph_label = pygame.font.SysFont('arial', FONT_SIZE_TINY - 3)
-        except Exception as fallback_e:
-            print(f"Fallback font 'arial' also not found. Text rendering might fail. Error: {fallback_e}")
-            # As a last resort, use Pygame's default font
-            font_icon = pygame.font.Font(None, FONT_SIZE_MEDIUM)
-            font_panel = pygame.font.Font(None, FONT_SIZE_SMALL)
-            font_tiny = pygame.font.Font(None, FONT_SIZE_TINY)
-            font_graph_label = pygame.font.Font(None, FONT_SIZE_TINY - 2)
-
-    # --- Sound Initialization ---
-    try:
-        pygame.mixer.init()
-        sound_file_path = os.path.join(script_dir, 'eat.wav') # Use script_dir
-        eat_sound = pygame.mixer.Sound(sound_file_path)
-        eat_sound.set_volume(0.05)
-    except Exception as e:
-        print(f"Could not load eat sound ('{sound_file_path}'): {e}")
-        eat_sound = None
+    font_panel = get_font(FONT_SIZE_SMALL)
+    font_tiny = get_font(FONT_SIZE_TINY)
+    font_graph_label = get_font(FONT_SIZE_TINY - 2) # Шрифт для подписей графиков
+    startup_profiler.mark('fonts')
 
-    try:
-        melody_sound_path = os.path.join(script_dir, 'melody.wav') # Use script_dir
-        melody_sound = pygame.mixer.Sound(melody_sound_path)
-        melody_sound.set_volume(0.1)
-    except Exception as e:
-        print(f"Could not load melody sound ('{melody_sound_path}'): {e}")
-        melody_sound = None
+    assets.start() # Звуки догружаются в фоне, пока рисуется меню
 
     current_speed = 15
     current_volume = 50
@@ -2385,15 +4227,17 @@ def main():
     show_path_visualization = False
     current_theme = "default"
     current_max_fps = 60 # Initialize max FPS
-    target_lps_history: Deque[TimestampedValue] = deque(maxlen=300) # History of target speed with timestamp
-    actual_lps_history: Deque[TimestampedValue] = deque(maxlen=300) # Увеличен размер истории LPS до соответствия с FPS
-    render_fps_history: Deque[TimestampedValue] = deque(maxlen=300) # History for actual render FPS
+    use_numpy_renderer = False
+    target_lps_history = TimeSeries(300, STATS_DISPLAY_SECONDS) # History of target speed with timestamp
+    actual_lps_history = TimeSeries(300, STATS_DISPLAY_SECONDS) # Увеличен размер истории LPS до соответствия с FPS
+    render_fps_history = TimeSeries(300, STATS_DISPLAY_SECONDS) # History for actual render FPS
     last_lps_values = deque(maxlen=30)  # Буфер для сглаживания LPS по 30 последним значениям
     for _ in range(30):  # Заполняем начальными нулевыми значениями
         last_lps_values.append(0.0)
+    startup_profiler.mark('main() setup')
 
     while True:
-        mode, updated_speed, updated_volume, updated_mute, updated_fill_percent, updated_show_path, updated_theme, updated_max_fps = start_screen( # Receive max FPS
+        mode, updated_speed, updated_volume, updated_mute, updated_fill_percent, updated_show_path, updated_theme, updated_max_fps, updated_numpy_renderer, board_state = start_screen( # Receive max FPS
             screen,
             clock,
             current_speed,
@@ -2402,7 +4246,9 @@ def main():
             current_fill_percent,
             show_path_visualization,
             current_theme,
-            current_max_fps # Передаем ТЕКУЩЕЕ значение, а не будущее
+            current_max_fps, # Передаем ТЕКУЩЕЕ значение, а не будущее
+            use_numpy_renderer,
+            board_state
         )
         current_speed = updated_speed
         current_volume = updated_volume
@@ -2411,18 +4257,27 @@ def main():
         show_path_visualization = updated_show_path
         current_theme = updated_theme
         current_max_fps = updated_max_fps # Присваиваем обновленное значение FPS
+        use_numpy_renderer = updated_numpy_renderer
         set_theme(current_theme)
 
         initial_current_speed = current_speed
         min_speed = 5
 
-        if eat_sound:
-            eat_sound.set_volume(0 if mute else current_volume / 100)
+        set_sound_volume('eat', 0 if mute else current_volume / 100)
 
-        snake = Snake(mode, initial_fill_percentage=current_fill_percent)
+        use_board_grid(board_state)
+        if board_state is not None:
+            snake = snake_from_fixture(board_state, mode)
+            restore_rng_state(board_state)
+        else:
+            snake = Snake(mode, initial_fill_percentage=current_fill_percent)
         snake.speed = initial_current_speed
         food = Food()
-        food.randomize_position(snake_positions=snake.positions)
+        place_food(food, snake, board_state)
+
+        board_renderer = create_board_renderer(use_numpy_renderer)
+        camera = board_renderer.camera if isinstance(board_renderer, ViewportRenderer) else None
+        overlay_rects: List[pygame.Rect] = [] # Области виджетов прошлого кадра поверх поля
 
         panel_width = 160
         panel_height = 70
@@ -2441,6 +4296,23 @@ def main():
                                    power=5)
 
         panel_alpha = 76
+        speed_panel_surface = pygame.Surface(speed_panel_rect.size, pygame.SRCALPHA)
+        speed_panel_key = None # (значение ползунка, прозрачность, тема), с которыми панель нарисована
+
+        # Виджеты графиков LPS (справа внизу) и FPS (слева внизу)
+        widget_margin = 10
+        lps_widget = StatsGraphWidget((0, 0), "LPS", font_graph_label, font_tiny)
+        lps_widget.rect.bottomright = (SCREEN_WIDTH - widget_margin, SCREEN_HEIGHT - widget_margin)
+        fps_widget = StatsGraphWidget((0, 0), "FPS", font_graph_label, font_tiny)
+        fps_widget.rect.bottomleft = (widget_margin, SCREEN_HEIGHT - widget_margin)
+
+        # Задержки по фазам кадра: сводка в консоль в конце игры, таблица на экране по F3
+        latency = LatencyRecorder(LATENCY_OVERLAY_SECONDS)
+        latency_panel = LatencyPanel((widget_margin, 72))
+        show_latency_panel = False
+        previous_frame_start: Optional[float] = None # None - прошлый кадр прерван экраном/диалогом
+        metrics_sampler = MetricsSampler(metrics_sink) if metrics_sink is not None else None
+
         time_since_last_logic_update = 0.0 # Time accumulator for logic steps
         # Variables for actual LPS calculation
         lps_steps_since_last_calc = 0
@@ -2453,10 +4325,13 @@ def main():
             # Limit rendering loop by max_fps setting
             dt_ms = clock.tick(current_max_fps) # Use the user-defined max FPS
             dt_seconds = dt_ms / 1000.0
+            if previous_frame_start is not None:
+                latency.record('frame', frame_start_time - previous_frame_start)
+            previous_frame_start = frame_start_time
 
             # Calculate actual render FPS and add to history with timestamp
             current_render_fps = clock.get_fps()
-            render_fps_history.append(TimestampedValue(current_render_fps))
+            render_fps_history.append(current_render_fps)
 
             # Расчет LPS с той же частотой, что и FPS
             current_time = time.perf_counter()
@@ -2467,7 +4342,7 @@ def main():
                 last_lps_values.append(current_actual_lps)  # Добавляем новое значение (старое автоматически удаляется)
                 smoothed_lps = sum(last_lps_values) / len(last_lps_values)  # Среднее за последние 30 значений
                 actual_lps_display = smoothed_lps  # Обновляем отображаемое значение
-                actual_lps_history.append(TimestampedValue(smoothed_lps))  # Сохраняем сглаженное значение
+                actual_lps_history.append(smoothed_lps)  # Сохраняем сглаженное значение
                 lps_steps_since_last_calc = 0  # Сбрасываем счетчик шагов логики
                 last_frame_time = current_time  # Обновляем время предыдущего кадра
 
@@ -2485,6 +4360,7 @@ def main():
             game_speed_slider.value = snake.speed
             game_speed_slider.update_handle_pos()
 
+            event_start_time = time.perf_counter()
             events = pygame.event.get()
             panel_interacted_this_frame = False # Flag to check if slider was moved
             for event in events:
@@ -2492,6 +4368,8 @@ def main():
                     if confirmation_dialog(screen, clock, "Quit Game?"):
                         pygame.quit()
                         sys.exit()
+                    board_renderer.invalidate()
+                    previous_frame_start = None
 
                 # Handle speed panel interaction first
                 if is_panel_hovered:
@@ -2504,6 +4382,18 @@ def main():
                          panel_interacted_this_frame = True
 
 
+                # Камера (только для полей больше окна): колесо - масштаб, правая кнопка - сдвиг,
+                # F - следить за головой, Home - вернуть масштаб и слежение
+                if camera is not None and not is_panel_hovered:
+                    if event.type == pygame.MOUSEWHEEL:
+                        camera.zoom(event.y, mouse_pos)
+                    elif event.type == pygame.MOUSEMOTION and event.buttons[2]:
+                        camera.pan(*event.rel)
+                    elif event.type == pygame.KEYDOWN and event.key == pygame.K_f:
+                        camera.follow = not camera.follow
+                    elif event.type == pygame.KEYDOWN and event.key == pygame.K_HOME:
+                        camera.reset()
+
                 if not panel_interacted_this_frame and event.type == pygame.KEYDOWN: # Process other keys only if panel wasn't interacted with
                     if event.key == pygame.K_ESCAPE:
                         game_running = False # Exit current game loop to show start screen
@@ -2530,6 +4420,8 @@ def main():
                     # Pause
                     if event.key == pygame.K_p or event.key == pygame.K_SPACE:
                         pause_screen(screen, clock)
+                        board_renderer.invalidate()
+                        previous_frame_start = None
                         # Reset time accumulator after unpausing to avoid sudden jump
                         time_since_last_logic_update = 0.0
                         
@@ -2557,11 +4449,25 @@ def main():
                             snake._update_caches()
                             food.color = current_colors['food']
 
+                    if event.key == pygame.K_F3:
+                        show_latency_panel = not show_latency_panel
+
+                    # Сохранение текущего состояния поля (загружается в меню или через --state)
+                    if event.key == pygame.K_F5:
+                        state_path = os.path.join(STATE_DIR, f"state_{time.strftime('%Y%m%d_%H%M%S')}.snake")
+                        try:
+                            save_board_fixture(state_path, snake.export_state(food.position))
+                            print(f"Board state saved to '{state_path}'")
+                        except (OSError, KeyError) as e:
+                            print(f"Could not save board state ('{state_path}'): {e}")
+
                 if not game_running: # Check again if ESC was pressed
                     break
 
             if not game_running: # Break outer loop if necessary
                 break
+            if previous_frame_start is not None:
+                latency.record('event', time.perf_counter() - event_start_time)
 
             # --- Time-Budgeted Game Logic Loop ---
             logic_time_step = 1.0 / snake.speed if snake.speed > 0 else float('inf')
@@ -2588,7 +4494,14 @@ def main():
                    time_spent_on_logic_this_frame < max_logic_time_this_frame):
 
                 # Process one step of game logic
-                collision = snake.move(food.position)
+                if watchdog is not None:
+                    watchdog.before_step(snake, food.position)
+                step_start_time = time.perf_counter()
+                collision = snake.move(food.position, logic_start_time + max_logic_time_this_frame)
+                step_time = time.perf_counter() - step_start_time
+                latency.record('step', step_time)
+                if watchdog is not None:
+                    watchdog.after_step(snake, step_time, collision)
                 lps_steps_since_last_calc += 1 # Increment counter for actual LPS calculation
 
                 if collision:
@@ -2597,8 +4510,8 @@ def main():
                     food.randomize_position(snake_positions=snake.positions)
                     if snake.mode == 'auto':
                          snake.current_food_pos = food.position
-                    if eat_sound and not mute:
-                        eat_sound.play()
+                    if not mute:
+                        queue_sound('eat')
 
                 # Decrement accumulator *after* processing the step
                 time_since_last_logic_update = max(0.0, time_since_last_logic_update - logic_time_step)
@@ -2606,21 +4519,35 @@ def main():
                 # Update time spent on logic
                 time_spent_on_logic_this_frame = time.perf_counter() - logic_start_time
 
+            # Свободная часть бюджета логики кадра - поиску вперед; не уложившийся поиск продолжится в следующем кадре
+            if lookahead_enabled and snake.mode == 'auto' and not collision_detected_in_frame:
+                snake.plan_ahead(food.position, logic_start_time + max_logic_time_this_frame * LOOKAHEAD_BUDGET_SHARE)
+                time_spent_on_logic_this_frame = time.perf_counter() - logic_start_time
+
+            if time_spent_on_logic_this_frame > 0:
+                latency.record('logic', time_spent_on_logic_this_frame)
+            audio.drain() # Звуки, накопленные шагами логики за кадр
+            if metrics_sampler is not None:
+                metrics_sampler.frame(time.perf_counter(), dt_seconds, lps_steps_since_last_calc,
+                                      time_spent_on_logic_this_frame, snake)
+
             # --- Handle Collision (after logic loop for the frame) ---
             if collision_detected_in_frame:
-                final_history = deque(snake.history)
+                final_history = snake.history.snapshot(snake.positions)
 
-                if melody_sound and not mute:
-                    melody_sound.play()
+                if not mute:
+                    play_sound('melody')
 
                 current_speed_on_death = int(snake.speed)
+                report_latency(latency)
+                previous_frame_start = None
 
                 should_restart = game_over_screen(screen, clock, snake.length, current_speed_on_death, final_history)
 
                 if should_restart:
-                    snake.reset(initial_fill_percentage=current_fill_percent)
+                    restart_board(snake, food, current_fill_percent, board_state)
                     snake.speed = initial_current_speed
-                    food.randomize_position(snake_positions=snake.positions)
+                    board_renderer.invalidate()
                     game_controls_active = True
                 else:
                     game_running = False
@@ -2628,13 +4555,9 @@ def main():
             # Проверка на победу - змейка заполнила всё поле
             elif snake.length >= GRID_WIDTH * GRID_HEIGHT:
                 # ВАЖНО: Сначала отрисовываем финальный кадр с полным полем
-                screen.fill(current_colors['background'])
-                draw_grid(screen)
-                
-                if snake.mode == 'auto' and show_path_visualization and snake.path:
-                    draw_path(screen, snake.path)
-                
-                snake.draw(screen)
+                board_renderer.invalidate()
+                board_renderer.render(snake, None, snake.path_cells if snake.mode == 'auto' and show_path_visualization else None)
+                screen.blit(board_renderer.surface, (0, 0))
                 display_statistics(screen, snake.length, snake.speed)
                 
                 # Отрисовываем виджеты (если они активны)
@@ -2643,18 +4566,20 @@ def main():
                 # Небольшая задержка перед показом экрана победы
                 pygame.time.delay(500)  # 500 мс = 0.5 секунды
                 
-                if melody_sound and not mute:
-                    melody_sound.play()
+                if not mute:
+                    play_sound('melody')
                 
                 current_speed_on_victory = int(snake.speed)
+                report_latency(latency)
+                previous_frame_start = None
                 
                 # Вызываем экран победы
                 should_restart = win_screen(screen, clock, snake.length, current_speed_on_victory)
                 
                 if should_restart:
-                    snake.reset(initial_fill_percentage=current_fill_percent)
+                    restart_board(snake, food, current_fill_percent, board_state)
                     snake.speed = initial_current_speed
-                    food.randomize_position(snake_positions=snake.positions)
+                    board_renderer.invalidate()
                     game_controls_active = True
                 else:
                     game_running = False
@@ -2664,19 +4589,15 @@ def main():
                 if snake.length + 1 >= GRID_WIDTH * GRID_HEIGHT:
                     snake.length += 1  # Увеличиваем длину для победы
                     
-                    # ВАЖНО: Сначала отрисовываем финальный кадр с полным полем
-                    screen.fill(current_colors['background'])
-                    draw_grid(screen)
-                    
                     # Обновляем положения змейки для отрисовки полного поля
                     # Добавляем последнюю съеденную клетку в голову змеи
                     snake.positions.appendleft(snake.get_head_position())
-                    snake._update_caches()
-                    
-                    if snake.mode == 'auto' and show_path_visualization and snake.path:
-                        draw_path(screen, snake.path)
+                    snake._rebuild_cell_serials()
                     
-                    snake.draw(screen)
+                    # ВАЖНО: Сначала отрисовываем финальный кадр с полным полем
+                    board_renderer.invalidate()
+                    board_renderer.render(snake, None, snake.path_cells if snake.mode == 'auto' and show_path_visualization else None)
+                    screen.blit(board_renderer.surface, (0, 0))
                     display_statistics(screen, snake.length, snake.speed)
                     
                     # Отрисовываем виджеты FPS/LPS, если они активны
@@ -2686,18 +4607,20 @@ def main():
                     # Небольшая задержка, чтобы игрок успел увидеть заполненное поле
                     pygame.time.delay(500)  # 500 мс = 0.5 секунды
                     
-                    if melody_sound and not mute:
-                        melody_sound.play()
+                    if not mute:
+                        play_sound('melody')
                     
                     current_speed_on_victory = int(snake.speed)
+                    report_latency(latency)
+                    previous_frame_start = None
                     
                     # Вызываем экран победы
                     should_restart = win_screen(screen, clock, snake.length, current_speed_on_victory)
                     
                     if should_restart:
-                        snake.reset(initial_fill_percentage=current_fill_percent)
+                        restart_board(snake, food, current_fill_percent, board_state)
                         snake.speed = initial_current_speed
-                        food.randomize_position(snake_positions=snake.positions)
+                        board_renderer.invalidate()
                         game_controls_active = True
                     else:
                         game_running = False
@@ -2706,161 +4629,82 @@ def main():
                     if snake.mode == 'auto':
                          snake.current_food_pos = food.position
 
-                    if eat_sound and not mute:
-                        eat_sound.play()
-
-            screen.fill(current_colors['background'])
-            draw_grid(screen)
+                    if not mute:
+                        queue_sound('eat')
+                        audio.drain() # Очередь кадра уже проиграна выше: повтор за тот же кадр сольется с ней
+
+            # --- Поле: перерисовываются только изменившиеся клетки ---
+            render_start_time = time.perf_counter()
+            path_cells_to_draw = snake.path_cells if snake.mode == 'auto' and show_path_visualization else None
+            board_rects = board_renderer.render(snake, food.position, path_cells_to_draw)
+            if board_rects is not None and len(board_rects) > MAX_DIRTY_RECTS_PER_FRAME:
+                board_rects = None # Дешевле один полный blit, чем сотни мелких
+            if board_rects is None:
+                screen.blit(board_renderer.surface, (0, 0))
+            else:
+                for rect in board_rects:
+                    screen.blit(board_renderer.surface, rect, rect)
 
-            if snake.mode == 'auto' and show_path_visualization and snake.path:
-                draw_path(screen, snake.path)
+            # Виджеты полупрозрачные - перед отрисовкой возвращаем под ними чистое поле
+            for rect in overlay_rects:
+                screen.blit(board_renderer.surface, rect, rect)
 
-            snake.draw(screen)
-            food.draw(screen)
-            display_statistics(screen, snake.length, snake.speed)
+            stats_rects = display_statistics(screen, snake.length, snake.speed)
 
             # --- LPS/FPS Widget ---
             # Add the *target* logic speed (snake.speed) to the history for graphing with timestamp
-            target_lps_history.append(TimestampedValue(snake.speed))
-
-            graph_width = 100
-            text_width = 45
-            padding = 5
-            total_width = graph_width + padding + text_width
-            graph_height = 50
-            margin_right = 10
-            margin_bottom = 10
-
-            widget_x = SCREEN_WIDTH - total_width - margin_right
-            widget_y = SCREEN_HEIGHT - graph_height - margin_bottom
-            # Renamed rect for clarity
-            lps_widget_rect = pygame.Rect(widget_x, widget_y, total_width, graph_height)
-
-            graph_x_rel = 0
-            graph_y_rel = 0
-            text_x_rel = graph_width + padding
-            text_y_rel = 0
-
-            # Renamed variables for clarity
-            is_lps_widget_hovered = lps_widget_rect.collidepoint(mouse_pos)
-            lps_widget_alpha = 255 if is_lps_widget_hovered else 76
-            lps_bg_color_opaque = COLOR_PANEL_BG # Use existing panel color
-
-            # Renamed surface for clarity
-            lps_widget_surface = pygame.Surface(lps_widget_rect.size, pygame.SRCALPHA)
-
-            # Draw background for the LPS widget
-            pygame.draw.rect(lps_widget_surface, lps_bg_color_opaque, lps_widget_surface.get_rect(), border_radius=4)
-
-            # Draw the graph using the history of *actual* calculated LPS
-            draw_lps_graph(lps_widget_surface, actual_lps_history, graph_x_rel, graph_y_rel, graph_width, graph_height, color=current_colors['text_highlight'], font=font_graph_label)
-
-            # Display Min/Avg/Max based on the *actual* calculated LPS history
-            # Filter for only the last 5 seconds
-            min_actual_lps = 0.0
-            max_actual_lps = 0.0
-            avg_actual_lps = 0.0
-
-            recent_actual_lps = get_values_in_timespan(actual_lps_history, STATS_DISPLAY_SECONDS)
-            if recent_actual_lps:
-                min_actual_lps = min(recent_actual_lps)
-                max_actual_lps = max(recent_actual_lps)
-                avg_actual_lps = sum(recent_actual_lps) / len(recent_actual_lps)
-
-            text_margin_in_area = 3
-
-            # Display Max Actual LPS
-            max_text_surf = font_tiny.render(f"{max_actual_lps:.0f}", True, current_colors['text'])
-            max_text_rect = max_text_surf.get_rect(topright=(text_x_rel + text_width - text_margin_in_area, graph_y_rel + text_margin_in_area))
-            lps_widget_surface.blit(max_text_surf, max_text_rect)
-
-            # Displaying Average Actual LPS
-            avg_text_surf = font_tiny.render(f"{avg_actual_lps:.0f}", True, current_colors['text'])
-            avg_text_rect = avg_text_surf.get_rect(midright=(text_x_rel + text_width - text_margin_in_area, graph_y_rel + graph_height // 2))
-            lps_widget_surface.blit(avg_text_surf, avg_text_rect)
-
-            # Display Min Actual LPS
-            min_text_surf = font_tiny.render(f"{min_actual_lps:.0f}", True, current_colors['text'])
-            min_text_rect = min_text_surf.get_rect(bottomright=(text_x_rel + text_width - text_margin_in_area, graph_y_rel + graph_height - text_margin_in_area))
-            lps_widget_surface.blit(min_text_surf, min_text_rect)
-
-            # Set alpha and blit the LPS widget
-            lps_widget_surface.set_alpha(lps_widget_alpha)
-            screen.blit(lps_widget_surface, lps_widget_rect.topleft)
+            target_lps_history.append(snake.speed)
+
+            # Display Min/Avg/Max based on the *actual* calculated LPS history (last 5 seconds)
+            lps_widget.update(actual_lps_history, 15.0)
+            lps_widget_alpha = 255 if lps_widget.rect.collidepoint(mouse_pos) else 76
+            lps_widget.draw(screen, lps_widget_alpha)
 
             # --- FPS Widget (Bottom Left) ---
-            fps_widget_width = total_width # Same size as LPS widget
-            fps_widget_height = graph_height
-            fps_widget_margin_left = 10
-            fps_widget_margin_bottom = 10
-            fps_widget_x = fps_widget_margin_left
-            fps_widget_y = SCREEN_HEIGHT - fps_widget_height - fps_widget_margin_bottom
-            fps_widget_rect = pygame.Rect(fps_widget_x, fps_widget_y, fps_widget_width, fps_widget_height)
-
-            is_fps_widget_hovered = fps_widget_rect.collidepoint(mouse_pos)
-            fps_widget_alpha = 255 if is_fps_widget_hovered else 76
-            fps_bg_color_opaque = COLOR_PANEL_BG # Use panel background color
-
-            fps_widget_surface = pygame.Surface(fps_widget_rect.size, pygame.SRCALPHA)
-            # Draw background for the FPS widget
-            pygame.draw.rect(fps_widget_surface, fps_bg_color_opaque, fps_widget_surface.get_rect(), border_radius=4)
-
-            # Draw the graph using the history of actual render FPS
-            draw_fps_graph(fps_widget_surface, render_fps_history, graph_x_rel, graph_y_rel, graph_width, graph_height, color=current_colors['text_highlight'], target_fps=current_max_fps, font=font_graph_label)
-
-            # Display Min/Avg/Max based on the actual render FPS history (last 5 seconds)
-            min_render_fps = 0.0
-            max_render_fps = 0.0
-            avg_render_fps = 0.0
-
-            recent_render_fps = get_values_in_timespan(render_fps_history, STATS_DISPLAY_SECONDS)
-            if recent_render_fps:
-                min_render_fps = min(recent_render_fps)
-                max_render_fps = max(recent_render_fps)
-                avg_render_fps = sum(recent_render_fps) / len(recent_render_fps)
-
-            # Display Max Render FPS
-            max_fps_text_surf = font_tiny.render(f"{max_render_fps:.0f}", True, current_colors['text'])
-            max_fps_text_rect = max_fps_text_surf.get_rect(topright=(text_x_rel + text_width - text_margin_in_area, graph_y_rel + text_margin_in_area))
-            fps_widget_surface.blit(max_fps_text_surf, max_fps_text_rect)
-
-            # Displaying Average Render FPS
-            avg_fps_text_surf = font_tiny.render(f"{avg_render_fps:.0f}", True, current_colors['text'])
-            avg_fps_text_rect = avg_fps_text_surf.get_rect(midright=(text_x_rel + text_width - text_margin_in_area, graph_y_rel + graph_height // 2))
-            fps_widget_surface.blit(avg_fps_text_surf, avg_fps_text_rect)
-
-            # Display Min Render FPS
-            min_fps_text_surf = font_tiny.render(f"{min_render_fps:.0f}", True, current_colors['text'])
-            min_fps_text_rect = min_fps_text_surf.get_rect(bottomright=(text_x_rel + text_width - text_margin_in_area, graph_y_rel + graph_height - text_margin_in_area))
-            fps_widget_surface.blit(min_fps_text_surf, min_fps_text_rect)
-
-            # Set alpha and blit the FPS widget
-            fps_widget_surface.set_alpha(fps_widget_alpha)
-            screen.blit(fps_widget_surface, fps_widget_rect.topleft)
-
-            # --- Speed Control Panel (remains the same) ---
-            panel_bg_color_tuple = (current_colors['panel_bg'].r, current_colors['panel_bg'].g, current_colors['panel_bg'].b, panel_alpha)
-            panel_surface = pygame.Surface(speed_panel_rect.size, pygame.SRCALPHA)
-            pygame.draw.rect(panel_surface, panel_bg_color_tuple, panel_surface.get_rect(), border_radius=4)
-
-            panel_title_surf = font_panel.render("Speed (LPS)", True, current_colors['text_white']) # Changed label
-            panel_title_rect = panel_title_surf.get_rect(centerx=panel_surface.get_rect().centerx, top=8)
-            panel_surface.blit(panel_title_surf, panel_title_rect)
-
-            # Draw slider within the panel surface (relative coordinates)
-            original_slider_rect = game_speed_slider.rect.copy()
-            game_speed_slider.rect.topleft = (slider_margin_h, slider_margin_top)
-            game_speed_slider.draw(panel_surface)
-            game_speed_slider.rect = original_slider_rect # Restore original rect if needed elsewhere
-
-            panel_surface.set_alpha(panel_alpha)
-            screen.blit(panel_surface, speed_panel_rect.topleft)
+            fps_widget.update(render_fps_history, current_max_fps * 1.1)
+            fps_widget_alpha = 255 if fps_widget.rect.collidepoint(mouse_pos) else 76
+            fps_widget.draw(screen, fps_widget_alpha)
+
+            # --- Speed Control Panel ---
+            # Панель перерисовывается только при смене значения ползунка, наведения или темы
+            panel_key = (int(game_speed_slider.value), panel_alpha, current_theme)
+            if panel_key != speed_panel_key:
+                if speed_panel_key is None or speed_panel_key[2] != current_theme:
+                    panel_title_surf = font_panel.render("Speed (LPS)", True, current_colors['text_white'])
+                    panel_title_rect = panel_title_surf.get_rect(centerx=speed_panel_surface.get_rect().centerx, top=8)
+                speed_panel_key = panel_key
+                panel_bg_color_tuple = (current_colors['panel_bg'].r, current_colors['panel_bg'].g, current_colors['panel_bg'].b, panel_alpha)
+                speed_panel_surface.set_alpha(panel_alpha)
+                speed_panel_surface.fill((0, 0, 0, 0))
+                pygame.draw.rect(speed_panel_surface, panel_bg_color_tuple, speed_panel_surface.get_rect(), border_radius=4)
+                speed_panel_surface.blit(panel_title_surf, panel_title_rect)
+
+                # Draw slider within the panel surface (relative coordinates)
+                original_slider_rect = game_speed_slider.rect.copy()
+                game_speed_slider.rect.topleft = (slider_margin_h, slider_margin_top)
+                game_speed_slider.draw(speed_panel_surface)
+                game_speed_slider.rect = original_slider_rect # Restore original rect if needed elsewhere
+            screen.blit(speed_panel_surface, speed_panel_rect.topleft)
             # --- End Speed Control Panel ---
 
+            new_overlay_rects = stats_rects + [lps_widget.rect, fps_widget.rect, speed_panel_rect]
+            latency.roll_window(render_start_time)
+            if show_latency_panel:
+                latency_panel.update(latency.snapshot)
+                new_overlay_rects.append(latency_panel.draw(screen).copy())
 
-            pygame.display.update()
+            present_start_time = time.perf_counter()
+            latency.record('render', present_start_time - render_start_time)
+            if board_rects is None:
+                pygame.display.update()
+            else:
+                pygame.display.update(board_rects + overlay_rects + new_overlay_rects)
+            latency.record('present', time.perf_counter() - present_start_time)
+            overlay_rects = new_overlay_rects
             # clock.tick(current_max_fps) is already called at the top
 
+        report_latency(latency)
+
 def unsaved_settings_dialog(surface, clock):
     overlay = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT))
     overlay.set_alpha(210)
@@ -2870,12 +4714,7 @@ def unsaved_settings_dialog(surface, clock):
 
     surface.blit(overlay, (0, 0))
 
-    try:
-        font_title = pygame.font.SysFont(FONT_NAME_PRIMARY, FONT_SIZE_LARGE, bold=True)
-    except:
-        font_title = pygame.font.SysFont('arial', FONT_SIZE_LARGE - 2, bold=True)
-
-    title_surf = font_title.render("Unsaved Changes", True, current_colors['text_white'])
+    title_surf = render_text("Unsaved Changes", FONT_SIZE_LARGE, current_colors['text_white'], bold=True)
 
     dialog_width = 500
     dialog_height = 160
@@ -2934,8 +4773,7 @@ def unsaved_settings_dialog(surface, clock):
                 clicked_on_button = False
                 for key, data in buttons.items():
                     if data["clicked"] and data["hovered"]:
-                        if eat_sound:
-                            eat_sound.play()
+                        play_sound('eat')
                         result = key
                         running = False
                         clicked_on_button = True
@@ -2978,12 +4816,8 @@ def win_screen(surface, clock, final_length, final_speed):
     fade_surf.fill((0, 0, 0, 200))  # Semi-transparent black background
     surface.blit(fade_surf, (0, 0))
     
-    font_large = pygame.font.SysFont(FONT_NAME_PRIMARY, 48)
-    font = pygame.font.SysFont(FONT_NAME_PRIMARY, 36)
-    small_font = pygame.font.SysFont(FONT_NAME_PRIMARY, 24)
-    
     # Title
-    title = font_large.render("You Won!", True, (255, 255, 100))
+    title = render_text("You Won!", 48, (255, 255, 100))
     title_rect = title.get_rect(center=(SCREEN_WIDTH // 2, SCREEN_HEIGHT // 4))
     surface.blit(title, title_rect)
     
@@ -2996,7 +4830,7 @@ def win_screen(surface, clock, final_length, final_speed):
     ]
     
     for i, text in enumerate(stats_text):
-        stat = font.render(text, True, (200, 200, 255))
+        stat = render_text(text, 36, (200, 200, 255))
         stat_rect = stat.get_rect(center=(SCREEN_WIDTH // 2, SCREEN_HEIGHT // 3 + i * 40))
         surface.blit(stat, stat_rect)
     
@@ -3047,8 +4881,64 @@ def win_screen(surface, clock, final_length, final_speed):
         pygame.display.update()
         clock.tick(60)
 
+def parse_grid_size(text: str) -> Tuple[int, int]:
+    """Разбирает размер поля вида WxH."""
+    try:
+        width, height = (int(part) for part in text.lower().split('x'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected WxH, got '{text}'")
+    if width < 2 or height < 2:
+        raise argparse.ArgumentTypeError("board must be at least 2x2")
+    return width, height
+
 if __name__ == '__main__':
+    startup_profiler.mark('module body')
+    parser = argparse.ArgumentParser(description='Modern Snake Game')
+    parser.add_argument('--grid', type=parse_grid_size, metavar='WxH',
+                        help='board size in cells; boards larger than the window get a camera')
+    parser.add_argument('--metrics', metavar='PATH',
+                        help='write per-second performance samples to PATH (.csv for CSV, otherwise JSONL), rotated by size')
+    parser.add_argument('--metrics-prometheus', metavar='PATH',
+                        help='keep the latest sample in PATH for the Prometheus node_exporter textfile collector')
+    parser.add_argument('--state', metavar='PATH',
+                        help='start games from a saved board state (.snake text or .json fixture)')
+    parser.add_argument('--profile-startup', action='store_true',
+                        help='print a timed breakdown of startup up to the first menu frame, then exit '
+                             '(exit status 1 if time to first frame exceeds --startup-budget-ms)')
+    parser.add_argument('--startup-budget-ms', type=float, default=DEFAULT_STARTUP_BUDGET_MS, metavar='MS',
+                        help=f'time-to-first-frame budget for --profile-startup (default: {DEFAULT_STARTUP_BUDGET_MS:.0f})')
+    parser.add_argument('--slow-step-ms', type=float, metavar='MS',
+                        help='save the board state before any logic step slower than MS milliseconds')
+    parser.add_argument('--slow-step-dir', default='slow_steps', metavar='DIR',
+                        help='directory for slow step fixtures (default: slow_steps)')
+    parser.add_argument('--lookahead', action='store_true',
+                        help='let the autopilot check its moves with a time-boxed search several moves ahead')
+    args = parser.parse_args()
+    if args.grid:
+        configure_grid_size(*args.grid)
+    set_lookahead(args.lookahead)
+    metrics_sink = None
+    if args.metrics or args.metrics_prometheus:
+        metrics_sink = MetricsSink(args.metrics, args.metrics_prometheus)
+    watchdog = SlowStepWatchdog(args.slow_step_ms, args.slow_step_dir) if args.slow_step_ms else None
+    board_state = None
+    if args.state:
+        try:
+            board_state = load_board_fixture(args.state)
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            parser.error(f"could not load --state '{args.state}': {e}")
+
+    startup_profiler.enabled = args.profile_startup
+    startup_profiler.budget_ms = args.startup_budget_ms
+    startup_profiler.mark('parse arguments')
+
     pygame.init()
-    pygame.mixer.init()
+    startup_profiler.mark('pygame.init')
+    assets.start()
     set_theme("default")
-    main()
+    startup_profiler.mark('start sound loader, theme')
+    try:
+        main(metrics_sink, watchdog, board_state)
+    finally:
+        if metrics_sink is not None:
+            metrics_sink.close()